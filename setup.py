@@ -12,5 +12,6 @@ setup(name='conda_tools',
     url='https://github.com/groutr/conda-tools',
     packages=find_packages('src'),
     package_dir={'':'src'},
+    extras_require={'conda': ['zstandard']},
     zip_safe=False      
 )
@@ -1,22 +1,40 @@
 from os.path import realpath, normpath, join, exists
 from pathlib import PurePath
 
+import io
 import os
+import re
+import posixpath
 import hashlib
 import bz2
 import tempfile
 import tarfile
-
-from fnmatch import filter as fnfilter
+import zipfile
+
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from concurrent.futures.process import BrokenProcessPool
+from fnmatch import translate as fntranslate
+from functools import lru_cache
+from itertools import groupby
 from typing import NewType
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from . import lazyproperty
 from . import _types
 
 from .exceptions import BadPathError, BadLinkError, InvalidCachePackage
+from .bz2index import BZ2Index, decompress_parallel
 
 PATH = _types.PATH
 
+CONDA_EXT = '.conda'
+TAR_BZ2_EXT = '.tar.bz2'
+
 def sane_members(members, destination):
     resolve = lambda path: realpath(normpath(join(destination, path)))
 
@@ -41,14 +59,102 @@ def sane_members(members, destination):
 
         yield member
 
+# Member indexes shared between archive objects, keyed by file identity and access mode
+MEMBER_INDEX_CACHE_SIZE = 256
+_MEMBER_INDEXES = OrderedDict()
+
+
+@lru_cache(maxsize=1024)
+def _compile_pattern(pattern: str):
+    return re.compile(fntranslate(pattern)).match
+
+
+_WILDCARD = re.compile(r'[*?\[]')
+
+def _literal_prefix(pattern: str) -> str:
+    """
+    Return the part of pattern before the first wildcard.
+    """
+    m = _WILDCARD.search(pattern)
+    return pattern if m is None else pattern[:m.start()]
+
+
+def _file_identity(path: PATH) -> tuple:
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class MemberIndex(object):
+    """
+    Index of the members of an archive.
+
+    Member paths are kept sorted, so members under a prefix can be found by bisection,
+    and are grouped by directory.
+    """
+    def __init__(self, members):
+        self.members = tuple(members)
+        self._by_path = {m.path: m for m in self.members}
+        self.paths = sorted(self._by_path)
+
+        tree = defaultdict(list)
+        for p in self.paths:
+            tree[posixpath.dirname(p)].append(p)
+        self.tree = dict(tree)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, path):
+        return path in self._by_path
+
+    def _range(self, prefix):
+        paths = self.paths
+        lo = bisect_left(paths, prefix)
+        hi = lo
+        while hi < len(paths) and paths[hi].startswith(prefix):
+            hi += 1
+        return paths[lo:hi]
+
+    def prefix(self, prefix: str) -> tuple:
+        """
+        Return the members whose path starts with prefix.
+        """
+        return tuple(self._by_path[p] for p in self._range(prefix))
+
+    def children(self, directory: str) -> tuple:
+        """
+        Return the members directly inside directory.
+        """
+        return tuple(self._by_path[p] for p in self.tree.get(directory.rstrip('/'), ()))
+
+    def match(self, pattern: str) -> tuple:
+        """
+        Return the members matching the glob pattern, in path order.
+        """
+        literal = _literal_prefix(pattern)
+        if literal == pattern:
+            m = self._by_path.get(pattern)
+            return (m,) if m is not None else ()
+
+        match = _compile_pattern(pattern)
+        return tuple(self._by_path[p] for p in self._range(literal) if match(p))
+
+
 class PackageArchive(object):
     """
     A very thin wrapper around tarfile objects.
 
     A convenience class specifically tailored to conda archives.
     This class is intended for read-only access.
+
+    Both `.tar.bz2` and `.conda` archives are supported.  A `.conda` archive is a zip
+    file holding two zstd compressed tarballs, `info-*.tar.zst` for the metadata and
+    `pkg-*.tar.zst` for the payload.  Metadata queries (:py:meth:`info`,
+    :py:meth:`recipe` and :py:meth:`get_member` on `info/` paths) only read the
+    small info tarball, the payload is decompressed on first use.
+    Reading `.conda` archives requires the zstandard package.
     """
-    def __init__(self, path: PATH, decompress:bool=False):
+    def __init__(self, path: PATH, decompress:bool=False, random_access:bool=False, workers:int=None):
         """
         Represent a package archive in the global package cache.
 
@@ -56,9 +162,24 @@ class PackageArchive(object):
         especially if working with many files inside the archive.
         Performance gains can be as much as 10000%.
 
+        With decompress=True, *workers* processes are used to decompress
+        `.tar.bz2` archives in parallel.
+
+        Setting random_access=True uses a :py:class:`BZ2Index` for `.tar.bz2` archives.
+        Reading a member then only decompresses the block(s) that contain it,
+        without a temporary file.  The index is built on first access and saved
+        next to the archive for reuse.
         """
         self._decompressed = False
         self._tarfile = None
+        self._info_tar = None
+        self._members = None
+        self._all_index = None
+        self._info_index = None
+        self._random_access = random_access and str(path).endswith(TAR_BZ2_EXT)
+        self._workers = workers
+        self._tempfiles = []
+        self.is_conda = str(path).endswith(CONDA_EXT)
 
         if exists(path):
             self.path = path
@@ -83,12 +204,19 @@ class PackageArchive(object):
         """
         Close an open archive and clean up possible temporary file.
         """
-
-        if isinstance(self._tarfile, tarfile.TarFile):
-            self._tarfile.close()
-
-            if self._decompressed and exists(self.path):
-                os.remove(self.path)
+        for tf in (self._tarfile, self._info_tar):
+            if isinstance(tf, tarfile.TarFile):
+                tf.close()
+                if self._members is not None and tf is self._tarfile:
+                    # tarfile does not close file objects it was given
+                    tf.fileobj.close()
+
+        if self._decompressed and not self.is_conda and exists(self.path):
+            os.remove(self.path)
+        for t in self._tempfiles:
+            if exists(t):
+                os.remove(t)
+        self._tempfiles = []
 
     def _open(self, reopen:bool=False) -> None:
         """
@@ -96,14 +224,44 @@ class PackageArchive(object):
 
         If self.path is already open, then simply return.
         Reloading to file can be done by setting reopen=True.
+
+        For `.conda` archives, only the info tarball is opened.
         """
+        if reopen:
+            self._all_index = self._info_index = None
+
+        if self.is_conda:
+            _info_tar = self._info_tar
+            if not reopen and isinstance(_info_tar, tarfile.TarFile) and not _info_tar.closed:
+                return
+            if _info_tar is not None:
+                _info_tar.close()
+            self._info_tar = tarfile.open(fileobj=_conda_component(self.path, 'info-'), mode='r:')
+            return
+
         _tarfile = self._tarfile
         if not reopen and isinstance(_tarfile, tarfile.TarFile) and not _tarfile.closed:
             # Checked first for lowest overhead possible
             return
 
 
-        if _tarfile is None:
+        if self._random_access and not self._decompressed:
+            if _tarfile is not None:
+                _tarfile.close()
+                if self._members is not None:
+                    # tarfile does not close file objects it was given
+                    _tarfile.fileobj.close()
+            try:
+                index = BZ2Index.get(self.path)
+            except (OSError, ValueError):
+                # The block boundaries could not be found reliably, read sequentially
+                self._random_access = False
+                self._members = None
+                self._tarfile = tarfile.open(self.path, mode='r')
+                return
+            self._members = index.tarinfos()
+            self._tarfile = tarfile.TarFile(fileobj=index.open(), mode='r')
+        elif _tarfile is None:
             self._tarfile = tarfile.open(self.path, mode='r')
         else:
             try:
@@ -114,12 +272,45 @@ class PackageArchive(object):
             except OSError:
                 raise
 
+    def _open_pkg(self) -> None:
+        """
+        Open the payload tarball of a `.conda` archive.
+
+        The payload is decompressed to a temporary file, so members can be read in any order.
+        """
+        _tarfile = self._tarfile
+        if isinstance(_tarfile, tarfile.TarFile) and not _tarfile.closed:
+            return
+
+        if not self._tempfiles:
+            fd, tmp = tempfile.mkstemp(suffix='.tar')
+            self._tempfiles.append(tmp)
+            with os.fdopen(fd, 'wb') as fo:
+                _conda_component(self.path, 'pkg-', fileobj=fo)
+        self._tarfile = tarfile.open(self._tempfiles[0], mode='r')
+
     def _decompress(self) -> None:
         if not self._decompressed:
-            self._path = self.path
-            self.path = _decompress_bz2(self._path)
+            if self.is_conda:
+                self._open_pkg()
+            else:
+                self._path = self.path
+                self.path = _decompress_bz2(self._path, workers=self._workers)
             self._decompressed = True
 
+    def _owner(self, member) -> tarfile.TarFile:
+        """
+        Return the tarfile that contains member.
+        """
+        if self.is_conda and member.path.startswith('info/'):
+            self._open()
+            return self._info_tar
+        elif self.is_conda:
+            self._open_pkg()
+        else:
+            self._open()
+        return self._tarfile
+
     @lazyproperty
     def hash(self) -> str:
         h = hashlib.md5()
@@ -131,32 +322,79 @@ class PackageArchive(object):
                 h.update(block)
         return h.hexdigest()
 
-    def files(self) -> list:
+    def _load_members(self, info_only:bool=False) -> list:
+        """
+        Read the members of the archive.
+
+        With info_only=True, `.conda` archives only read the info tarball.
+        """
         self._open()
+        if self.is_conda:
+            if info_only:
+                return self._info_tar.getmembers()
+            self._open_pkg()
+            return self._info_tar.getmembers() + self._tarfile.getmembers()
+        elif self._members is not None:
+            return list(self._members)
         return self._tarfile.getmembers()
 
+    def _member_index(self, info_only:bool=False) -> 'MemberIndex':
+        """
+        Return the MemberIndex of the archive.
+
+        Indexes are shared between all archives opened from the same file in the same
+        mode, so reopening an archive does not read its members again.
+        """
+        info_only = info_only and self.is_conda
+        attr = '_info_index' if info_only else '_all_index'
+        index = getattr(self, attr)
+        if index is None:
+            key = _file_identity(self.path) + (info_only, self._random_access, self._decompressed)
+            try:
+                index = _MEMBER_INDEXES[key]
+                _MEMBER_INDEXES.move_to_end(key)
+            except KeyError:
+                index = _MEMBER_INDEXES[key] = MemberIndex(self._load_members(info_only))
+                if len(_MEMBER_INDEXES) > MEMBER_INDEX_CACHE_SIZE:
+                    _MEMBER_INDEXES.popitem(last=False)
+            setattr(self, attr, index)
+        return index
+
+    def files(self) -> list:
+        return list(self._member_index().members)
+
     def recipe(self):
         """
         Return the members that pertain to the info/recipe directory
         """
-        return tuple(x for x in self.info() if x.path.startswith('info/recipe/'))
+        return self._member_index(info_only=True).prefix('info/recipe/')
 
     def info(self):
         """
         Return TarInfo objects for info/* directory
         """
-        return tuple(x for x in self.files() if x.path.startswith('info/'))
+        return self._member_index(info_only=True).prefix('info/')
 
     def __iter__(self):
-        self._open()
-        return iter(self._tarfile)
+        return iter(self.files())
 
     def get_member(self, pattern):
         """
         Return the member(s) that match with pattern, otherwise None.
         """
-        _files = {m.path: m for m in self.files()}
-        return tuple(_files[m] for m in fnfilter(_files.keys(), pattern))
+        info_only = pattern.startswith('info/')
+        return self._member_index(info_only=info_only).match(pattern)
+
+    def get_members(self, patterns) -> dict:
+        """
+        Look up many patterns at once.
+
+        Return a dictionary mapping each pattern to the tuple of matching members.
+        """
+        patterns = tuple(patterns)
+        info_only = all(p.startswith('info/') for p in patterns)
+        index = self._member_index(info_only=info_only)
+        return {p: index.match(p) for p in patterns}
 
     def extract(self, members, destination='.'):
         """
@@ -165,15 +403,15 @@ class PackageArchive(object):
         If sanitize_paths is True, then paths will be checked
         This method does some basic sanitation of the member.
         """
-        self._open()
         if not isinstance(members, (set, list, tuple)):
             members = (members,)
 
         if destination is None:
             for m in members:
-                yield self._tarfile.extractfile(m)
+                yield self._owner(m).extractfile(m)
         else:
-            self._tarfile.extractall(path=destination, members=sane_members(members, destination))
+            for owner, group in groupby(members, key=self._owner):
+                owner.extractall(path=destination, members=sane_members(group, destination))
 
     def __repr__(self):
         return 'PackageArchive({}) @ {}'.format(self.path, hex(id(self)))
@@ -181,17 +419,82 @@ class PackageArchive(object):
     def __str__(self):
         return self.path
 
-def _decompress_bz2(filename: PATH, blocksize:int=900*1024) -> PATH:
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("The zstandard package is required to read .conda archives")
+
+def _component_name(zf: zipfile.ZipFile, prefix: str) -> str:
+    """
+    Return the name of the tarball in the `.conda` zip file whose name starts with *prefix*.
+    """
+    for name in zf.namelist():
+        if name.startswith(prefix) and name.endswith('.tar.zst'):
+            return name
+    raise InvalidCachePackage("{} has no {}*.tar.zst component".format(zf.filename, prefix))
+
+def _conda_component(path: PATH, prefix: str, fileobj=None):
+    """
+    Decompress the component of the `.conda` archive at *path* whose name starts with *prefix*.
+
+    The decompressed tarball is written to fileobj, or to a BytesIO if fileobj is None.
+    Return fileobj positioned at the start of the tarball.
+    """
+    _require_zstandard()
+
+    with zipfile.ZipFile(path) as zf:
+        name = _component_name(zf, prefix)
+        if fileobj is None:
+            fileobj = io.BytesIO()
+        with zf.open(name) as src:
+            zstandard.ZstdDecompressor().copy_stream(src, fileobj)
+
+    if fileobj.seekable():
+        fileobj.seek(0)
+    return fileobj
+
+def stream_tarfiles(path: PATH):
+    """
+    Yield the tarballs of the archive at *path* as tarfiles opened in stream mode.
+
+    A `.tar.bz2` archive yields a single tarfile, a `.conda` archive yields the info
+    tarball then the payload tarball.  Members must be read in order.
+    """
+    if not str(path).endswith(CONDA_EXT):
+        with tarfile.open(path, mode='r|*') as tar:
+            yield tar
+        return
+
+    _require_zstandard()
+
+    with zipfile.ZipFile(path) as zf:
+        for prefix in ('info-', 'pkg-'):
+            with zf.open(_component_name(zf, prefix)) as src:
+                reader = zstandard.ZstdDecompressor().stream_reader(src)
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    yield tar
+
+def _decompress_bz2(filename: PATH, blocksize:int=900*1024, workers:int=None) -> PATH:
     """
     Decompress .tar.bz2 to .tar on disk (for faster access)
 
     Use TemporaryFile to guarentee write access.
+
+    If workers is greater than 1, blocks are decompressed in parallel by that many processes.
     """
-    if not filename.endswith('.tar.bz2'):
+    if not filename.endswith(TAR_BZ2_EXT):
         return filename
 
     fd, path = tempfile.mkstemp()
     with os.fdopen(fd, 'wb') as fo:
+        if workers is not None and workers > 1:
+            try:
+                decompress_parallel(filename, fo, workers=workers)
+                return path
+            except (OSError, ValueError, BrokenProcessPool):
+                # A block boundary could not be found reliably, or a worker died, start over serially
+                fo.seek(0)
+                fo.truncate()
+
         with open(filename, 'rb') as fi:
             z = bz2.BZ2Decompressor()
 
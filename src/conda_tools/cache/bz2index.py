@@ -0,0 +1,461 @@
+"""
+Random access into bz2 compressed tarballs.
+
+A bz2 stream is a sequence of independently compressed blocks.  Blocks are not
+byte aligned, but each starts with a 48 bit magic number, so the boundaries can
+be found by scanning the compressed data.  A single block can be decompressed
+by wrapping its bits in a minimal bz2 stream.
+
+:py:class:`BZ2Index` records the block boundaries of an archive along with the
+offsets of the tar members, so that one member can be read by decompressing only
+the block(s) that contain it.  The index is persisted in a sidecar file next to
+the archive and reused as long as the archive does not change.
+"""
+import io
+import os
+import bz2
+import json
+import mmap
+import tarfile
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import _types
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+_MAGIC_BITS = 48
+
+INDEX_SUFFIX = '.ctindex'
+INDEX_VERSION = 1
+
+# TarInfo attributes stored in the index
+_MEMBER_FIELDS = ('name', 'type', 'mode', 'uid', 'gid', 'size', 'mtime', 'linkname',
+                  'uname', 'gname', 'devmajor', 'devminor', 'offset', 'offset_data', 'pax_headers')
+
+
+def _magic_patterns(magic):
+    """
+    Return (shift, pattern, lead) triples to find *magic* at every bit alignment.
+
+    *pattern* is the run of bytes fully covered by the magic when it starts *shift*
+    bits into a byte, which can be searched for with bytes.find.  *lead* is the
+    number of bytes between the start of the magic and the start of pattern.
+    """
+    result = []
+    for shift in range(8):
+        window = (magic << (8 - shift)).to_bytes(7, 'big')
+        if shift == 0:
+            result.append((0, window[:6], 0))
+        else:
+            result.append((shift, window[1:6], 1))
+    return result
+
+
+def _find_magic(buf, magic):
+    """
+    Return the bit offsets of all occurrences of the 48 bit *magic* in buf.
+    """
+    found = []
+    size = len(buf)
+    mask = (1 << _MAGIC_BITS) - 1
+    for shift, pattern, lead in _magic_patterns(magic):
+        nbytes = 7 if shift else 6
+        pos = buf.find(pattern)
+        while pos != -1:
+            start = pos - lead
+            if start >= 0 and start + nbytes <= size:
+                value = int.from_bytes(buf[start:start + nbytes], 'big')
+                if shift:
+                    value = (value >> (8 - shift)) & mask
+                if value == magic:
+                    found.append(start * 8 + shift)
+            pos = buf.find(pattern, pos + 1)
+    return found
+
+
+def _read_bits(buf, bit: int, nbits: int) -> int:
+    """
+    Return the *nbits* bits of buf starting at bit offset *bit* as an integer.
+    """
+    first = bit // 8
+    last = (bit + nbits + 7) // 8
+    value = int.from_bytes(buf[first:last], 'big')
+    value >>= last * 8 - bit - nbits
+    return value & ((1 << nbits) - 1)
+
+
+def _is_stream_end(buf, pos: int) -> bool:
+    """
+    Return True if the end of stream magic at bit *pos* is followed by a valid stream trailer.
+
+    The stream CRC must be followed by zero padding up to the next byte, then by
+    the end of buf or the header of another stream.
+    """
+    end = pos + _MAGIC_BITS + 32
+    nbytes = (end + 7) // 8
+    if nbytes > len(buf):
+        return False
+    if end % 8 and _read_bits(buf, end, 8 - end % 8):
+        return False
+    header = buf[nbytes:nbytes + 4]
+    return not header or (len(header) == 4 and header[:3] == b'BZh' and 0x31 <= header[3] <= 0x39)
+
+
+def find_blocks(buf) -> list:
+    """
+    Return a list of (start_bit, end_bit) pairs for each compressed block in buf.
+
+    *buf* is any object supporting the buffer protocol and find(), like bytes or mmap.
+    Concatenated bz2 streams (as written by parallel compressors) are supported.
+    An end of stream magic that is not followed by a valid trailer occurs by chance
+    inside of compressed data, and is ignored.
+    """
+    starts = _find_magic(buf, BLOCK_MAGIC)
+    ends = [e for e in _find_magic(buf, EOS_MAGIC) if _is_stream_end(buf, e)]
+    markers = sorted([(s, True) for s in starts] + [(e, False) for e in ends])
+    if markers and markers[-1][1]:
+        raise ValueError("bz2 stream is missing its end of stream marker")
+
+    blocks = []
+    for (pos, is_block), (nxt, _) in zip(markers, markers[1:]):
+        if is_block:
+            blocks.append((pos, nxt))
+    return blocks
+
+
+def _check_streams(buf, blocks):
+    """
+    Check the stream CRC of every stream ending in *blocks* against the CRCs of its blocks.
+
+    Raise OSError on a mismatch, which means that blocks are missing from a stream.
+    """
+    combined = 0
+    for start, end in blocks:
+        crc = _read_bits(buf, start + _MAGIC_BITS, 32)
+        combined = (((combined << 1) | (combined >> 31)) & 0xffffffff) ^ crc
+        if _read_bits(buf, end, _MAGIC_BITS) == EOS_MAGIC:
+            if _read_bits(buf, end + _MAGIC_BITS, 32) != combined:
+                raise OSError("bz2 stream CRC does not match its blocks")
+            combined = 0
+
+
+def read_block(buf, start_bit: int, end_bit: int) -> bytes:
+    """
+    Decompress the single bz2 block occupying bits [start_bit, end_bit) of buf.
+    """
+    nbits = end_bit - start_bit
+    chunk = _read_bits(buf, start_bit, nbits)
+
+    # The block CRC directly follows the block magic.  For a stream holding one
+    # block, the combined stream CRC is equal to the block CRC.
+    crc = (chunk >> (nbits - _MAGIC_BITS - 32)) & 0xffffffff
+
+    stream = (int.from_bytes(b'BZh9', 'big') << (nbits + _MAGIC_BITS + 32)) | \
+             (chunk << (_MAGIC_BITS + 32)) | (EOS_MAGIC << 32) | crc
+    total = 32 + nbits + _MAGIC_BITS + 32
+    pad = -total % 8
+    data = (stream << pad).to_bytes((total + pad) // 8, 'big')
+    return bz2.decompress(data)
+
+
+def _iter_blocks(buf, blocks):
+    """
+    Decompress *blocks* in order.
+
+    Yield (start_bit, end_bit, data).  A block that fails to decompress is merged with
+    the following one, which handles a block or end of stream magic that occurs by
+    chance inside of compressed data.  The stream CRCs are checked once all blocks
+    were decompressed.
+    """
+    merged = []
+    i = 0
+    while i < len(blocks):
+        start, end = blocks[i]
+        while True:
+            try:
+                data = read_block(buf, start, end)
+                break
+            except (OSError, ValueError):
+                if i + 1 >= len(blocks):
+                    raise
+                if blocks[i + 1][0] > end:
+                    # The block ended at an end of stream magic, extend it to the next block
+                    end = blocks[i + 1][0]
+                else:
+                    i += 1
+                    end = blocks[i][1]
+        merged.append((start, end))
+        yield start, end, data
+        i += 1
+    _check_streams(buf, merged)
+
+
+def _read_block_from(path, start_bit, end_bit):
+    """
+    Read and decompress one block of the file at *path*.
+
+    Only the bytes spanning the block are read, so this is cheap to run in a worker process.
+    """
+    first = start_bit // 8
+    last = (end_bit + 7) // 8
+    with open(path, 'rb') as f:
+        f.seek(first)
+        buf = f.read(last - first)
+    return read_block(buf, start_bit - first * 8, end_bit - first * 8)
+
+
+def decompress_parallel(path: _types.PATH, fileobj, workers: int=None) -> int:
+    """
+    Decompress the bz2 file at *path* into fileobj using a pool of *workers* processes.
+
+    The stream is split at block boundaries and the blocks are decompressed
+    concurrently, then written to fileobj in order.  At most a few blocks per worker
+    are held in memory at any time.
+    Return the number of decompressed bytes written.
+    """
+    path = str(path)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        blocks = find_blocks(buf)
+        _check_streams(buf, blocks)
+
+    written = 0
+    window = 4 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in blocks:
+            pending.append(executor.submit(_read_block_from, path, start, end))
+            if len(pending) >= window:
+                written += fileobj.write(pending.popleft().result())
+        while pending:
+            written += fileobj.write(pending.popleft().result())
+    return written
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Read-only, non-seekable file object over an iterable of byte strings.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def drain(self):
+        """
+        Consume the remaining chunks.
+        """
+        self._buf = memoryview(b'')
+        for _ in self._chunks:
+            pass
+
+
+class BZ2Index(object):
+    """
+    Block and member index of a `.tar.bz2` archive.
+
+    *blocks* is a list of (start_bit, end_bit, offset, size) tuples, where offset and
+    size describe the decompressed bytes produced by the block.  *members* is a list of
+    dictionaries with the TarInfo attributes of every member.
+    """
+    def __init__(self, path: _types.PATH, blocks, members, stamp=None):
+        self.path = str(path)
+        self.blocks = blocks
+        self.members = members
+        self.stamp = stamp or _stamp(self.path)
+        self._offsets = [b[2] for b in blocks]
+
+    @classmethod
+    def build(cls, path: _types.PATH) -> 'BZ2Index':
+        """
+        Scan the archive at *path* and build its index.
+
+        The archive is decompressed once, block by block, while the tar headers are
+        parsed from the same stream.
+        """
+        path = str(path)
+        blocks = []
+        members = []
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            def chunks():
+                offset = 0
+                for start, end, data in _iter_blocks(buf, find_blocks(buf)):
+                    blocks.append((start, end, offset, len(data)))
+                    offset += len(data)
+                    yield data
+
+            reader = _ChunkReader(chunks())
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                for m in tar:
+                    member = {k: getattr(m, k) for k in _MEMBER_FIELDS}
+                    member['type'] = m.type.decode('latin-1')
+                    members.append(member)
+            reader.drain()
+        return cls(path, blocks, members)
+
+    @classmethod
+    def load(cls, path: _types.PATH, index_path: _types.PATH=None):
+        """
+        Load the index of *path* from its sidecar file.
+
+        Return None if there is no index, or if the archive changed since it was written.
+        """
+        path = str(path)
+        index_path = index_path or path + INDEX_SUFFIX
+        try:
+            with open(index_path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if data.get('version') != INDEX_VERSION or data.get('stamp') != list(_stamp(path)):
+            return None
+        return cls(path, [tuple(b) for b in data['blocks']], data['members'], tuple(data['stamp']))
+
+    @classmethod
+    def get(cls, path: _types.PATH, index_path: _types.PATH=None) -> 'BZ2Index':
+        """
+        Load the index of *path*, building and saving it first if needed.
+        """
+        index = cls.load(path, index_path)
+        if index is None:
+            index = cls.build(path)
+            index.save(index_path)
+        return index
+
+    def save(self, index_path: _types.PATH=None) -> bool:
+        """
+        Write the index to its sidecar file.
+
+        Return False if the file could not be written (ie. the cache is read-only).
+        """
+        index_path = index_path or self.path + INDEX_SUFFIX
+        data = {'version': INDEX_VERSION,
+                'stamp': list(self.stamp),
+                'blocks': self.blocks,
+                'members': self.members}
+
+        tmp = '{}.{}.tmp'.format(index_path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, index_path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def tarinfos(self) -> list:
+        """
+        Return a TarInfo object for each member of the archive.
+        """
+        result = []
+        for m in self.members:
+            ti = tarfile.TarInfo(m['name'])
+            for k in _MEMBER_FIELDS:
+                setattr(ti, k, m[k])
+            ti.type = m['type'].encode('latin-1')
+            result.append(ti)
+        return result
+
+    def block_for(self, offset: int) -> int:
+        """
+        Return the position in self.blocks of the block holding decompressed *offset*.
+        """
+        return bisect_right(self._offsets, offset) - 1
+
+    def open(self) -> io.BufferedReader:
+        """
+        Return a seekable file object over the decompressed archive.
+        """
+        return io.BufferedReader(IndexedBZ2Reader(self))
+
+
+class IndexedBZ2Reader(io.RawIOBase):
+    """
+    Seekable read-only file object over the decompressed contents of an indexed archive.
+
+    Only the blocks that are read are decompressed.  The most recently used blocks are kept.
+    """
+    def __init__(self, index: BZ2Index, cache_size: int=4):
+        self._index = index
+        self._file = open(index.path, 'rb')
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._pos = 0
+        blocks = index.blocks
+        self._size = blocks[-1][2] + blocks[-1][3] if blocks else 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence ({})".format(whence))
+        return self._pos
+
+    def _block(self, i):
+        cache = self._cache
+        try:
+            cache.move_to_end(i)
+            return cache[i]
+        except KeyError:
+            start, end, _, _ = self._index.blocks[i]
+            data = cache[i] = read_block(self._buf, start, end)
+            if len(cache) > self._cache_size:
+                cache.popitem(last=False)
+            return data
+
+    def readinto(self, b):
+        if self._pos >= self._size:
+            return 0
+        i = self._index.block_for(self._pos)
+        _, _, offset, _ = self._index.blocks[i]
+        data = self._block(i)
+        start = self._pos - offset
+        n = min(len(b), len(data) - start)
+        b[:n] = data[start:start + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._buf.close()
+            self._file.close()
+        super().close()
+
+
+def _stamp(path):
+    """
+    Return the (size, mtime) pair used to decide if an archive changed.
+    """
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
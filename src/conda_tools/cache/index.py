@@ -0,0 +1,246 @@
+"""
+Persistent metadata index of a package cache.
+
+The index stores the fields of `info/index.json`, the contents of `info/files`
+and `info/has_prefix` for every extracted package in a SQLite database.
+Entries are refreshed incrementally, so only packages that changed on disk since
+the last refresh are read again.
+"""
+import os
+import json
+import sqlite3
+
+from .package import Package, _parse_has_prefix
+from .exceptions import InvalidCachePackage
+from ..common import prime_lazy
+from .. import _types
+
+INDEX_NAME = '.conda_tools_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    dirname TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    name TEXT,
+    version TEXT,
+    build TEXT,
+    build_number INTEGER,
+    subdir TEXT,
+    index_json TEXT NOT NULL,
+    files TEXT,
+    has_prefix TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+"""
+
+# Columns that can be used to query the index
+QUERY_FIELDS = ('name', 'version', 'build', 'build_number', 'subdir')
+
+
+def _entry_state(path):
+    """
+    Return the (inode, mtime) pair used to decide if the entry at *path* changed.
+
+    The mtime is taken from the `info/` directory, which changes whenever the
+    package is re-extracted.  Return None if *path* is not a cache package.
+    """
+    try:
+        dstat = os.stat(path)
+        istat = os.stat(os.path.join(path, 'info'))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return dstat.st_ino, max(dstat.st_mtime_ns, istat.st_mtime_ns)
+
+
+def _read_entry(path):
+    """
+    Read the metadata of the package at *path*.
+
+    Return a tuple of (index, files, has_prefix), or None if the package is not valid.
+    """
+    info = os.path.join(path, 'info')
+    try:
+        with open(os.path.join(info, 'index.json'), 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    try:
+        with open(os.path.join(info, 'files'), 'r') as f:
+            files = '\n'.join(x.strip() for x in f)
+    except FileNotFoundError:
+        files = None
+
+    try:
+        with open(os.path.join(info, 'has_prefix'), 'r') as f:
+            prefixed, binary_prefix, text_prefix = _parse_has_prefix(f)
+        has_prefix = json.dumps({'files': prefixed,
+                                 'binary': binary_prefix,
+                                 'text': text_prefix})
+    except (FileNotFoundError, InvalidCachePackage):
+        has_prefix = None
+
+    return index, files, has_prefix
+
+
+class CacheIndex(object):
+    """
+    SQLite backed index of the extracted packages in a package cache.
+
+    Call :py:meth:`refresh` to synchronize the index with the cache on disk.
+    Queries only read from the database and never touch the package directories.
+    """
+    def __init__(self, path: _types.PATH, db_path: _types.PATH=None):
+        """
+        Open (or create) the index for the package cache at *path*.
+
+        By default the database is stored inside of the package cache.
+        An alternative location can be given with *db_path*.
+        """
+        if not os.path.isdir(path):
+            raise IOError('{} cache should be a directory path!'.format(path))
+
+        self.path = str(path)
+        self.db_path = str(db_path or os.path.join(self.path, INDEX_NAME))
+        self._db = sqlite3.connect(self.db_path)
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def refresh(self) -> dict:
+        """
+        Synchronize the index with the package cache.
+
+        Only entries that are new, or whose inode or mtime changed are read from disk.
+        Entries that no longer exist are removed.
+        Return a dictionary with the names of added, updated and removed entries.
+        """
+        known = {d: (ino, mt) for d, ino, mt in
+                 self._db.execute('SELECT dirname, inode, mtime_ns FROM entries')}
+        result = {'added': [], 'updated': [], 'removed': []}
+
+        with os.scandir(self.path) as it:
+            entries = [e.name for e in it if e.is_dir()]
+
+        with self._db:
+            for d in entries:
+                state = _entry_state(os.path.join(self.path, d))
+                if state is None:
+                    # Not a package (anymore), leave it in known to be removed
+                    continue
+
+                old = known.pop(d, None)
+                if state == old:
+                    continue
+
+                entry = _read_entry(os.path.join(self.path, d))
+                if entry is None:
+                    if old is not None:
+                        known[d] = old
+                    continue
+
+                index, files, has_prefix = entry
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (d, state[0], state[1],
+                     index.get('name'), index.get('version'), index.get('build'),
+                     index.get('build_number'), index.get('subdir'),
+                     json.dumps(index), files, has_prefix))
+                result['updated' if old else 'added'].append(d)
+
+            # Anything left in known has disappeared from the cache
+            self._db.executemany('DELETE FROM entries WHERE dirname = ?',
+                                 ((d,) for d in known))
+            result['removed'].extend(known)
+        return result
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __contains__(self, dirname) -> bool:
+        row = self._db.execute('SELECT 1 FROM entries WHERE dirname = ?', (dirname,)).fetchone()
+        return row is not None
+
+    def names(self) -> tuple:
+        """
+        Return the directory names of all indexed packages.
+        """
+        return tuple(r[0] for r in self._db.execute('SELECT dirname FROM entries ORDER BY dirname'))
+
+    def find(self, **fields) -> tuple:
+        """
+        Return the directory names of the packages matching all of *fields*.
+
+        Supported fields are name, version, build, build_number and subdir.
+
+        >>> idx.find(name='numpy', build_number=0)  # doctest: +SKIP
+        """
+        bad = set(fields) - set(QUERY_FIELDS)
+        if bad:
+            raise ValueError('Cannot query on fields: {}'.format(', '.join(sorted(bad))))
+
+        sql = 'SELECT dirname FROM entries'
+        if fields:
+            sql += ' WHERE ' + ' AND '.join('{} = ?'.format(k) for k in fields)
+        return tuple(r[0] for r in self._db.execute(sql, tuple(fields.values())))
+
+    def _row(self, dirname, column):
+        row = self._db.execute('SELECT {} FROM entries WHERE dirname = ?'.format(column),
+                               (dirname,)).fetchone()
+        if row is None:
+            raise KeyError(dirname)
+        return row[0]
+
+    def index(self, dirname) -> dict:
+        """
+        Return the contents of `info/index.json` for *dirname*.
+        """
+        return json.loads(self._row(dirname, 'index_json'))
+
+    def files(self, dirname) -> frozenset:
+        """
+        Return the contents of `info/files` for *dirname*.
+        """
+        files = self._row(dirname, 'files')
+        return frozenset(files.split('\n')) if files else frozenset()
+
+    def has_prefix(self, dirname) -> dict:
+        """
+        Return the parsed contents of `info/has_prefix` for *dirname*.
+
+        The result has the keys files, binary and text.
+        """
+        has_prefix = self._row(dirname, 'has_prefix')
+        if has_prefix is None:
+            return {'files': {}, 'binary': None, 'text': None}
+        return json.loads(has_prefix)
+
+    def packages(self):
+        """
+        Yield a Package for every indexed entry.
+
+        The index, files and has_prefix properties of the packages are populated
+        from the database, so no package files are read.
+        """
+        rows = self._db.execute('SELECT dirname, index_json, files, has_prefix FROM entries ORDER BY dirname')
+        for dirname, index, files, has_prefix in rows:
+            pkg = Package(os.path.join(self.path, dirname), validate=False)
+            has_prefix = json.loads(has_prefix) if has_prefix else {'files': {}, 'binary': None, 'text': None}
+            prime_lazy(pkg,
+                       index=json.loads(index),
+                       files=frozenset(files.split('\n')) if files else frozenset(),
+                       has_prefix=has_prefix['files'])
+            pkg.binary_prefix = has_prefix['binary']
+            pkg.text_prefix = has_prefix['text']
+            yield pkg
+
+    def __repr__(self):
+        return 'CacheIndex({}) @ {}'.format(self.path, hex(id(self)))
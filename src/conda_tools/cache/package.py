@@ -1,12 +1,13 @@
 from os.path import join, exists, isdir
 import json
-from functools import lru_cache
+import shlex
 import pathlib
 import typing
 from sys import intern
 
 
 from . import lazyproperty
+from ..common import reset_lazy
 from . import _types
 from .exceptions import InvalidCachePackage
 
@@ -37,24 +38,93 @@ class PackagePool(object):
 Pool = PackagePool()
 
 
+def _intern(s):
+    return None if s is None else intern(s)
+
+
+# Prefix of the build environment assumed by conda when has_prefix only lists a path
+PREFIX_PLACEHOLDER = '/opt/anaconda1anaconda2anaconda3'
+
+
+def _parse_has_prefix(lines):
+    """
+    Parse the lines of info/has_prefix.
+
+    Lines are either `prefix type path` or only `path`, which is a text file
+    containing PREFIX_PLACEHOLDER.  Fields may be quoted.
+
+    Return a tuple of (prefixed files mapped to their type, binary prefix, text prefix).
+    """
+    prefixed = {}
+    binary_prefix = None
+    text_prefix = None
+
+    for pf in lines:
+        if not pf.strip():
+            continue
+        try:
+            parts = [x.strip('"\'') for x in shlex.split(pf, posix=False)]
+        except ValueError:
+            parts = ()
+        if len(parts) == 1:
+            prefix, ftype, fname = PREFIX_PLACEHOLDER, 'text', parts[0]
+        elif len(parts) == 3:
+            prefix, ftype, fname = parts
+        else:
+            raise InvalidCachePackage('Invalid has_prefix line: {!r}'.format(pf))
+        if ftype == 'binary':
+            binary_prefix = prefix
+        elif ftype == 'text':
+            text_prefix = prefix
+        prefixed[fname] = ftype
+    if binary_prefix:
+        binary_prefix = intern(binary_prefix)
+    if text_prefix:
+        text_prefix = intern(text_prefix)
+    return prefixed, binary_prefix, text_prefix
+
+
+# Fields of index.json that are stored directly on Package instances
+HOT_FIELDS = ('name', 'version', 'build', 'build_number', 'depends', 'subdir')
+
+# Lazy properties of Package computed from each file in info/
+_INFO_PROPERTIES = {
+    'index.json': ('index', 'full_spec'),
+    'files': ('files',),
+    'has_prefix': ('has_prefix',),
+    'paths.json': ('paths',),
+    'no_link': ('no_link',),
+}
+
+
 class Package:
-    def __init__(self, path: _types.PATH):
+    __slots__ = ('path', 'binary_prefix', 'text_prefix', '__weakref__') + \
+        HOT_FIELDS + \
+        lazyproperty.slots('has_prefix', 'paths', 'no_link', 'index', 'files', 'full_spec')
+
+    def __init__(self, path: _types.PATH, validate: bool=True):
         """
         Provide an interface to a cached package.
 
         A valid *path* should have an `info/` directory.
+        Setting validate=False skips the check for `info/index.json`, which is
+        useful when the package is known to exist (ie. it comes from an index).
         """
         self.path = pathlib.Path(path)
-        self._info = self.path/'info'
-
-        self._index = self._info/'index.json'
-        if not self._index.is_file():
+        if validate and not self._index.is_file():
             raise InvalidCachePackage("{} does not exist".format(self._index))
 
         self.binary_prefix = None
         self.text_prefix = None
 
-    @lru_cache(maxsize=16)
+    @property
+    def _info(self) -> pathlib.Path:
+        return self.path/'info'
+
+    @property
+    def _index(self) -> pathlib.Path:
+        return self.path/'info'/'index.json'
+
     def __getattr__(self, name):
         """
         Provide attribute access into PackageInfo.index
@@ -62,10 +132,53 @@ class Package:
         If an attribute is not resolvable, return `None`.
         Returning `None` makes possible comprehensions like for collecting a field across many instances.
         """
-        if name in self.__dict__:
-            return self.__dict__[name]
-        elif name in self.index:
-            return self.index[name]
+        if name.startswith('__'):
+            raise AttributeError(name)
+        elif name in HOT_FIELDS:
+            self._load_fields()
+            return object.__getattribute__(self, name)
+        return self.index.get(name)
+
+    def _load_fields(self) -> None:
+        """
+        Store the frequently accessed fields of index.json on the instance.
+
+        depends is a list like in index.json, empty if the package has no dependencies.
+        """
+        index = self.index
+        build_number = index.get('build_number')
+
+        self.name = _intern(index.get('name'))
+        self.version = _intern(index.get('version'))
+        self.build = _intern(index.get('build'))
+        self.build_number = None if build_number is None else int(build_number)
+        self.depends = [intern(d) for d in index.get('depends', ())]
+        self.subdir = _intern(index.get('subdir'))
+
+    def invalidate(self, filename: str=None) -> None:
+        """
+        Discard the cached metadata read from `info/<filename>`, or all of it if no filename is given.
+
+        The metadata is read again on next access.
+        """
+        if filename is None:
+            names = list(_INFO_PROPERTIES)
+        elif filename in _INFO_PROPERTIES:
+            names = [filename]
+        else:
+            return
+
+        for name in names:
+            reset_lazy(self, *_INFO_PROPERTIES[name])
+            if name == 'index.json':
+                for field in HOT_FIELDS:
+                    try:
+                        object.__delattr__(self, field)
+                    except AttributeError:
+                        pass
+            elif name == 'has_prefix':
+                self.binary_prefix = None
+                self.text_prefix = None
 
     @lazyproperty
     def has_prefix(self):
@@ -78,17 +191,7 @@ class Package:
 
         try:
             with (self._info/'has_prefix').open(mode='r') as f:
-                for pf in f:
-                    prefix, ftype, fname = pf.split()
-                    if ftype == 'binary':
-                        binary_prefix = prefix
-                    elif ftype == 'text':
-                        text_prefix = prefix
-                    prefixed[fname] = ftype
-            if binary_prefix:
-                binary_prefix = intern(binary_prefix)
-            if text_prefix:
-                text_prefix = intern(text_prefix)
+                prefixed, binary_prefix, text_prefix = _parse_has_prefix(f)
         except FileNotFoundError:
             pass
 
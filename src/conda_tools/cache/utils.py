@@ -4,29 +4,72 @@ Utility functions that map information from caches onto environments
 from __future__ import print_function
 
 import os
+import json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .package import Package, InvalidCachePackage
-from .archive import PackageArchive
+from .archive import PackageArchive, CONDA_EXT, TAR_BZ2_EXT
+from .index import CacheIndex
+from .verify import compare_archive
+from ..common import prime_lazy
 from ..config import config
 
-def packages(path, verbose=False):
+# Archive extensions, in order of preference
+ARCHIVE_EXTS = (CONDA_EXT, TAR_BZ2_EXT)
+
+def packages(path, verbose=False, workers=None):
     """
     Collect and return a sequence of PackageInfo instances that represent
     each extracted package in the package cache, *path*.
+
+    If *workers* is given, entries are validated by a pool of that many threads
+    and each package is yielded with `info/index.json` already loaded.
+    Packages are then yielded in the order they complete, not in directory order.
+    This is much faster when per-file latency dominates (ie. network filesystems).
     """
     if not os.path.isdir(path):
         raise IOError('{} cache should be a directory path!'.format(path))
 
-    cache = os.walk(path, topdown=True)
-    root, dirs, _ = next(cache)
-    for d in dirs:
-        try:
-            yield Package(os.path.join(root, d))
-        except InvalidCachePackage:
-            if verbose:
-                print("Skipping {}".format(d))
-            continue
+    with os.scandir(path) as it:
+        dirs = [e.path for e in it if e.is_dir()]
+
+    if workers is None:
+        for d in dirs:
+            try:
+                yield Package(d)
+            except InvalidCachePackage:
+                if verbose:
+                    print("Skipping {}".format(d))
+                continue
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(_preload_package, d): d for d in dirs}
+        for fut in as_completed(futures):
+            try:
+                yield fut.result()
+            except InvalidCachePackage:
+                if verbose:
+                    print("Skipping {}".format(futures[fut]))
+                continue
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _preload_package(path):
+    """
+    Return a Package for *path* with `info/index.json` already loaded.
+    """
+    try:
+        with open(os.path.join(path, 'info', 'index.json'), 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, NotADirectoryError):
+        raise InvalidCachePackage("{} does not exist".format(os.path.join(path, 'info', 'index.json')))
+
+    pkg = Package(path, validate=False)
+    prime_lazy(pkg, index=index)
+    return pkg
 
 def named_cache(path):
     """
@@ -35,21 +78,32 @@ def named_cache(path):
     """
     return {os.path.split(x.path)[1]: x for x in packages(path)}
 
+def indexed_cache(path, db_path=None):
+    """
+    Return the same dictionary as :py:func:`named_cache`, served from a persistent :py:class:`CacheIndex`.
+
+    The index is refreshed first, so only packages that changed since the last call are read from disk.
+    """
+    with CacheIndex(path, db_path=db_path) as idx:
+        idx.refresh()
+        return {x.path.name: x for x in idx.packages()}
 
 
 def archives(path):
     """
     Return a tuple of package archives
+
+    Both `.conda` and `.tar.bz2` archives are included.
     """
     if not os.path.isdir(path):
         raise IOError('{} cache should be a directory path!'.format(path))
 
-    cache = os.walk(path, topdown=True)
-    root, _, files = next(cache)
+    with os.scandir(path) as it:
+        files = [e.path for e in it if e.name.endswith(ARCHIVE_EXTS) and e.is_file()]
+
     for f in files:
         try:
-            if f.endswith('.tar.bz2'):
-                yield PackageArchive(os.path.join(root, f))
+            yield PackageArchive(f)
         except InvalidCachePackage:
             continue
 
@@ -57,42 +111,119 @@ def named_archives(path):
     return {os.path.split(x.path)[1]: x for x in archives(path)}
 
 def correlated_cache(path):
+    """
+    Pair each extracted package with its archive.
+
+    When both formats are present, the `.conda` archive is preferred.
+    """
     dirs = named_cache(path)
     ar = named_archives(path)
     result = {}
     for d, obj in dirs.items():
-        try:
-            result[d] = (obj, ar[d+'.tar.bz2'])
-        except KeyError:
-            continue
+        for ext in ARCHIVE_EXTS:
+            if d + ext in ar:
+                result[d] = (obj, ar[d + ext])
+                break
     return result
 
 
 
-def _linked_environments(package, environments):
-    """"
-    Determine what package is linked to which environments
+def _norm(path):
+    """
+    Normalize a cache path for comparison.
+
+    Link sources in conda-meta are absolute, while caches can be given as relative
+    paths or reached through symbolic links, so paths are fully resolved.
+    """
+    return os.path.normcase(os.path.realpath(str(path)))
+
 
-    This function is wrapped by :py:func:`linked_environments` to provide a consistent API.
-    Please call :py:func:`linked_environments` instead.
+def _linked_sources(env):
     """
-    return tuple(env for env in environments if package in env.linked_packages.values())
+    Return the normalized cache paths of the packages linked into env.
+    """
+    links = env.get_field('link')
+    extracted = env.get_field('extracted_package_dir')
+    sources = set()
+    for name, link in links.items():
+        source = (link or {}).get('source') or extracted.get(name)
+        if source:
+            sources.add(_norm(source))
+    return sources
+
+
+def _meta_mtime(env):
+    return os.stat(os.path.join(env.path, 'conda-meta')).st_mtime_ns
+
+
+def _write_link_index(path, state) -> bool:
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
 
+def link_index(environments, cache_file=None) -> dict:
+    """
+    Return a dictionary that maps the path of every linked cache package to the environments it is linked into.
 
-def linked_environments(packages, environments):
+    The metadata of each environment is read exactly once.  If *cache_file* is given,
+    the index is persisted there (if it is writable) and environments whose `conda-meta`
+    directory did not change since the last call are not read again.
+    """
+    environments = tuple(environments)
+    saved = {}
+    if cache_file is not None:
+        try:
+            with open(cache_file, 'r') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+
+    state = {}
+    index = {}
+    for env in environments:
+        mtime = _meta_mtime(env)
+        entry = saved.get(env.path)
+        if entry is not None and entry['mtime'] == mtime:
+            sources = entry['sources']
+        else:
+            sources = sorted(_linked_sources(env))
+        state[env.path] = {'mtime': mtime, 'sources': sources}
+
+        for source in sources:
+            index.setdefault(source, []).append(env)
+
+    if cache_file is not None and state != saved:
+        _write_link_index(cache_file, state)
+
+    return {k: tuple(v) for k, v in index.items()}
+
+
+def linked_environments(packages, environments, index=None):
     """
     Return a dictionary that maps each package in *packages* to all of its linked environments
+
+    A prebuilt *index* from :py:func:`link_index` can be passed to avoid reading the environments again.
     """
-    return {p: _linked_environments(p, environments) for p in packages}
+    if index is None:
+        index = link_index(environments)
+    return {p: index.get(_norm(p.path), ()) for p in packages}
 
 
-def unlinked_packages(packages, environments):
+def unlinked_packages(packages, environments, index=None):
     """
     Return a tuple of all packages that are not linked into any environments
 
     These packages should be safe to remove.
     """
-    linked = linked_environments(packages, environments)
+    linked = linked_environments(packages, environments, index=index)
     return tuple(pkg for pkg, env in linked.items() if not env)
 
 
@@ -102,41 +233,19 @@ def verify_hashes(packages, archives, hash_alg='md5'):
 
     Any hash that is supported by Python's hashlib can be used for comparison.
 
-    In the interest of speed, files are iterated in the order they appear in the archive.?
-    If they are large packages, they should be opened decompressed.
+    Each archive is streamed exactly once with :py:func:`compare_archive`,
+    while the extracted files are hashed concurrently.
 
     packages and archives are assumed to zippable.
-    Return a tuple of file hashes that do match.
+    Return True if all the files match.
     """
-    def chunked(seq, size=1024):
-        for block in iter(lambda: seq.read(size), b''):
-            if block:
-                yield block
-
-
     if hash_alg not in hashlib.algorithms_available:
         raise ValueError("{} hash algorithm not available in hashlib.".format(hash_alg))
 
-    _new_hasher = lambda: hashlib.new(hash_alg)
     for pk, ar in zip(packages, archives):
-        for tarinfo in ar:
-            th, fh = _new_hasher(), _new_hasher()
-            tfile = next(ar.extract(tarinfo, destination=None))
-
-            fpath = os.path.join(pk.path, tarinfo.path)
-            if not os.path.exists(fpath):
-                return False
-
-            for x in chunked(tfile):
-                th.update(x)
-
-            with open(fpath, 'rb') as fi:
-                for x in chunked(fi):
-                    fh.update(x)
-
-            if th.digest() == fh.digest():
-                continue
-            else:
-                print("Mismathed hash: {}".format(tarinfo.path))
-                return False
+        mismatched = compare_archive(ar, pk.path, hash_alg=hash_alg)
+        if mismatched:
+            for m in mismatched:
+                print("Mismatched {}: {}".format(m.reason, m.path))
+            return False
     return True
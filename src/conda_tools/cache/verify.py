@@ -0,0 +1,217 @@
+"""
+Verify extracted packages in the package cache.
+
+Modern packages record the sha256 and size of every file in `info/paths.json`.
+These functions check the extracted files against those records, without
+having to open the package archive.
+
+For packages without paths.json, :py:func:`compare_archive` compares the
+extracted files against the package archive in a single streaming pass.
+"""
+import os
+import stat
+import hashlib
+from collections import namedtuple
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .package import Package
+from .archive import PackageArchive, stream_tarfiles
+
+BLOCKSIZE = 1024 * 1024
+
+# Reasons for a mismatch
+MISSING = 'missing'
+SIZE = 'size'
+HASH = 'hash'
+TYPE = 'type'
+UNREADABLE = 'unreadable'
+
+Mismatch = namedtuple('Mismatch', ('path', 'reason', 'expected', 'actual'))
+
+
+def file_hash(path, hash_alg='sha256', blocksize=BLOCKSIZE) -> str:
+    """
+    Return the hex digest of the file at *path*, reading blocks of *blocksize* bytes.
+    """
+    h = hashlib.new(hash_alg)
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as fi:
+        for n in iter(lambda: fi.readinto(buf), 0):
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _check_path(root, record, check_hashes, blocksize):
+    """
+    Check a single record of paths.json against the file under *root*.
+
+    Return a Mismatch or None if the file is good.
+    """
+    path = record['_path']
+    path_type = record.get('path_type', 'hardlink')
+    fpath = os.path.join(root, path)
+
+    try:
+        st = os.lstat(fpath)
+    except (FileNotFoundError, NotADirectoryError):
+        # A parent directory can have been replaced by a file
+        return Mismatch(path, MISSING, path_type, None)
+    except PermissionError:
+        return Mismatch(path, UNREADABLE, path_type, None)
+
+    if path_type == 'softlink':
+        if not stat.S_ISLNK(st.st_mode):
+            return Mismatch(path, TYPE, path_type, stat.filemode(st.st_mode))
+        return None
+    elif path_type == 'directory':
+        if not stat.S_ISDIR(st.st_mode):
+            return Mismatch(path, TYPE, path_type, stat.filemode(st.st_mode))
+        return None
+    elif not stat.S_ISREG(st.st_mode):
+        return Mismatch(path, TYPE, path_type, stat.filemode(st.st_mode))
+
+    # Cheap size check first, only hash files that could still match
+    size = record.get('size_in_bytes')
+    if size is not None and size != st.st_size:
+        return Mismatch(path, SIZE, size, st.st_size)
+
+    sha256 = record.get('sha256')
+    if check_hashes and sha256:
+        try:
+            actual = file_hash(fpath, 'sha256', blocksize)
+        except PermissionError:
+            return Mismatch(path, UNREADABLE, path_type, None)
+        if actual != sha256:
+            return Mismatch(path, HASH, sha256, actual)
+    return None
+
+
+def verify_package(package, check_hashes=True, blocksize=BLOCKSIZE):
+    """
+    Verify the extracted files of *package* against its `info/paths.json`.
+
+    If check_hashes is False, only the existence, type and size of the files are checked.
+    Return a tuple of Mismatch records (empty if the package is intact), or None
+    if the package has no paths.json to verify against.
+    """
+    if not isinstance(package, Package):
+        package = Package(package)
+
+    paths = package.paths.get('paths')
+    if paths is None:
+        return None
+
+    root = str(package.path)
+    result = []
+    for record in paths:
+        m = _check_path(root, record, check_hashes, blocksize)
+        if m is not None:
+            result.append(m)
+    return tuple(result)
+
+
+def _verify_path(path, check_hashes, blocksize):
+    return verify_package(Package(path), check_hashes=check_hashes, blocksize=blocksize)
+
+
+def verify_packages(packages, workers=None, processes=False, check_hashes=True, blocksize=BLOCKSIZE) -> dict:
+    """
+    Verify many packages concurrently.
+
+    Packages are distributed over a pool of *workers* threads (or processes if
+    processes=True).  hashlib releases the GIL while hashing large blocks, so
+    threads are usually sufficient.
+
+    Return a dictionary mapping each package to the result of :py:func:`verify_package`.
+    """
+    packages = [p if isinstance(p, Package) else Package(p) for p in packages]
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+
+    with pool(max_workers=workers) as executor:
+        results = executor.map(_verify_path, (str(p.path) for p in packages),
+                               repeat(check_hashes), repeat(blocksize))
+        return dict(zip(packages, results))
+
+
+def _disk_digest(path, hash_alg, blocksize):
+    """
+    Return (size, digest) of the regular file at *path*, or None if it does not exist.
+    """
+    try:
+        st = os.lstat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return st.st_size, None
+    return st.st_size, file_hash(path, hash_alg, blocksize)
+
+
+def _stream_members(archive):
+    for tar in stream_tarfiles(archive):
+        for member in tar:
+            yield tar, member
+
+
+def compare_archive(archive, directory, hash_alg='sha256', workers=4, blocksize=BLOCKSIZE) -> tuple:
+    """
+    Compare the members of a package archive to the files extracted in *directory*.
+
+    The archive is read exactly once, sequentially, as a stream.  Each member is
+    hashed as its bytes are decompressed while the matching file on disk is hashed
+    concurrently by a pool of *workers* threads.  Memory use is bounded by
+    *blocksize*, regardless of the size of the members.
+
+    Return a tuple of Mismatch records, empty if the directory matches the archive.
+    """
+    if hash_alg not in hashlib.algorithms_available:
+        raise ValueError("{} hash algorithm not available in hashlib.".format(hash_alg))
+    if isinstance(archive, PackageArchive):
+        archive = archive.path
+    directory = str(directory)
+
+    result = []
+    pending = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tar, member in _stream_members(archive):
+            fpath = os.path.join(directory, member.path)
+
+            if member.isdir():
+                if not os.path.isdir(fpath):
+                    result.append(Mismatch(member.path, MISSING, 'directory', None))
+                continue
+            elif member.issym():
+                try:
+                    target = os.readlink(fpath)
+                except (FileNotFoundError, NotADirectoryError):
+                    result.append(Mismatch(member.path, MISSING, 'softlink', None))
+                except OSError:
+                    result.append(Mismatch(member.path, TYPE, 'softlink', None))
+                else:
+                    if target != member.linkname:
+                        result.append(Mismatch(member.path, HASH, member.linkname, target))
+                continue
+            elif not member.isreg():
+                continue
+
+            future = executor.submit(_disk_digest, fpath, hash_alg, blocksize)
+            h = hashlib.new(hash_alg)
+            fin = tar.extractfile(member)
+            for block in iter(lambda: fin.read(blocksize), b''):
+                h.update(block)
+            pending.append((member, h.hexdigest(), future))
+
+        for member, digest, future in pending:
+            try:
+                disk = future.result()
+            except PermissionError:
+                result.append(Mismatch(member.path, UNREADABLE, 'hardlink', None))
+                continue
+            if disk is None:
+                result.append(Mismatch(member.path, MISSING, 'hardlink', None))
+            elif disk[0] != member.size:
+                result.append(Mismatch(member.path, SIZE, member.size, disk[0]))
+            elif disk[1] != digest:
+                result.append(Mismatch(member.path, HASH, digest, disk[1]))
+    return tuple(result)
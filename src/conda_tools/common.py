@@ -1,21 +1,49 @@
+import os
 from functools import wraps
 from sys import intern
 
 class lazyproperty(object):
+    """
+    Property that is computed once on first access.
+
+    The value is stored in the instance `__dict__`.  Classes that define `__slots__`
+    must reserve a slot for each lazy property, see :py:meth:`lazyproperty.slots`.
+    """
     class Sentinel:
         __slots__ = []
 
+    SLOT_PREFIX = '_cached_'
+
     def __init__(self, func):
         self._func = func
         wraps(self._func,)(self)
+        self._slot = self.SLOT_PREFIX + self.__name__
+
+    @classmethod
+    def slots(cls, *names):
+        """
+        Return the slot names needed to store the lazy properties *names*.
+        """
+        return tuple(cls.SLOT_PREFIX + n for n in names)
 
     def __get__(self, instance, owner):
         if instance is None:
             return None
 
-        result = instance.__dict__.get(self.__name__, self.Sentinel())
+        try:
+            cache = object.__getattribute__(instance, '__dict__')
+        except AttributeError:
+            # Slotted instance, the value lives in the reserved slot
+            try:
+                return object.__getattribute__(instance, self._slot)
+            except AttributeError:
+                result = self._func(instance)
+                object.__setattr__(instance, self._slot, result)
+                return result
+
+        result = cache.get(self.__name__, self.Sentinel())
         if isinstance(result, self.Sentinel):
-            result = instance.__dict__[self.__name__] = self._func(instance)
+            result = cache[self.__name__] = self._func(instance)
         return result
 
 
@@ -23,6 +51,38 @@ class lazyproperty(object):
         raise AttributeError('Cannot set read-only attribute on {}'.format(type(instance)))
 
 
+def prime_lazy(instance, **values):
+    """
+    Populate lazy properties of instance with precomputed values.
+
+    Subsequent property access returns the primed value without touching the filesystem.
+    """
+    try:
+        object.__getattribute__(instance, '__dict__').update(values)
+    except AttributeError:
+        for name, value in values.items():
+            object.__setattr__(instance, lazyproperty.SLOT_PREFIX + name, value)
+
+
+def reset_lazy(instance, *names):
+    """
+    Discard the values of the lazy properties *names* of instance.
+
+    The properties are computed again on next access.
+    """
+    try:
+        cache = object.__getattribute__(instance, '__dict__')
+    except AttributeError:
+        for name in names:
+            try:
+                object.__delattr__(instance, lazyproperty.SLOT_PREFIX + name)
+            except AttributeError:
+                pass
+    else:
+        for name in names:
+            cache.pop(name, None)
+
+
 def intern_keys(d):
     """
     Intern the string keys of d
@@ -35,4 +95,16 @@ def intern_keys(d):
 
         if isinstance(v, dict):
             d[k] = intern_keys(v)
-    return d
\ No newline at end of file
+    return d
+
+def user_cache_dir(*parts) -> str:
+    """
+    Return a path in the conda-tools cache directory.
+
+    This is $CONDA_TOOLS_CACHE if set, otherwise conda-tools in the user cache directory.
+    """
+    root = os.environ.get('CONDA_TOOLS_CACHE')
+    if root is None:
+        root = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+                            'conda-tools')
+    return os.path.join(root, *parts)
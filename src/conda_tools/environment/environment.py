@@ -5,12 +5,17 @@ import json
 import pprint
 import pathlib
 from functools import lru_cache, reduce
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from operator import itemgetter
 from os.path import join, isdir, basename, dirname
 
-from ..common import lazyproperty, intern_keys
+from sys import intern
+
+from ..common import lazyproperty, reset_lazy
 from ..cache.package import Package, Pool as PkgPool
 from .history import History
+from .snapshot import load_records
+from .ownership import OwnershipIndex
 from ..constants import cast_link_type, LINK_TYPE
 from ..foreign import groupby
 
@@ -20,6 +25,13 @@ class DictionaryPool(object):
     """
     Store only unique dictionaries.
 
+    Dictionaries are looked up by a fingerprint of their content, so registering a
+    dictionary is O(1) amortized.  Nested dictionaries and lists are pooled as well,
+    so identical sub-structures (like `depends` lists or `link` dictionaries) are shared
+    between records that are otherwise different.
+
+    Pooled objects are shared and must not be mutated.
+
     Optional string interning can be enabled to as an extra memory optimization.
     """
     def __init__(self, intern_keys=False):
@@ -27,28 +39,63 @@ class DictionaryPool(object):
         self._intern_keys = intern_keys
 
     def register(self, d):
-        d_id = id(d)
-        _pool = self._pool
+        fingerprint = _fingerprint(d)
+        for pooled in self._pool.get(fingerprint, ()):
+            if pooled == d:
+                return pooled
+        return self._share(d)
 
-        try:
-            return _pool[d_id]
-        except KeyError:
-            # maybe a dict with same content in pool.
-            for _d in _pool.values():
-                if d == _d:
-                    return _d
-
-            if self._intern_keys:
-                d = intern_keys(d)
-            self._pool[d_id] = d
-            return d
+    def _share(self, obj):
+        """
+        Return the pooled version of obj, pooling its nested dictionaries and lists first.
+        """
+        if isinstance(obj, dict):
+            shared = {}
+            for k, v in obj.items():
+                if self._intern_keys and isinstance(k, str):
+                    k = intern(k)
+                shared[k] = self._share(v)
+        elif isinstance(obj, list):
+            if any(isinstance(v, (dict, list)) for v in obj):
+                shared = [self._share(v) for v in obj]
+            else:
+                shared = obj
+        else:
+            return obj
+
+        bucket = self._pool.setdefault(_fingerprint(shared), [])
+        for pooled in bucket:
+            if pooled == shared:
+                return pooled
+        bucket.append(shared)
+        return shared
+
+    def __len__(self):
+        return sum(len(b) for b in self._pool.values())
 
     def clear(self):
         self._pool.clear()
 
+def _fingerprint(obj):
+    """
+    Return a hash of the content of obj, which may contain dictionaries and lists.
+    """
+    if isinstance(obj, dict):
+        return hash((dict, frozenset((k, _fingerprint(v) if isinstance(v, (dict, list)) else (type(v), v))
+                                     for k, v in obj.items())))
+    elif isinstance(obj, list):
+        try:
+            # Fast path for flat lists, like depends and files
+            return hash((list, tuple(obj)))
+        except TypeError:
+            return hash((list, tuple(_fingerprint(v) for v in obj)))
+    return hash((type(obj), obj))
+
 Pool = DictionaryPool(intern_keys=True)
 
 class PackageProxy:
+    __slots__ = ('path', 'info', '__weakref__')
+
     def __init__(self, path, info=None):
         self.path = path
 
@@ -80,31 +127,89 @@ class PackageProxy:
     def __str__(self):
         return self._triplet()
 
-    @lru_cache(maxsize=16)
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         return self.info[name]
 
 
+# Lazy properties of Environment derived from the package records
+_RECORD_PROPERTIES = ('package_channels', 'package_specs')
+
+
 class Environment(object):
-    def __init__(self, path):
+    def __init__(self, path, snapshot=False):
         """
         Initialize an Environment object.  Many of the properties of this object
         are lazy, and are calculated on first access.
-        To reflect changes in the underlying environment, a new Environment object should be created.
+        To reflect changes in the underlying environment, call :py:meth:`invalidate` or
+        register the environment with a :py:class:`conda_tools.watch.Watcher` (Linux only).
+
+        If *snapshot* is True (or a directory path), the parsed conda-meta records are
+        kept in a persistent snapshot, so that only the JSON files that changed since the
+        last load are parsed.  See :py:mod:`conda_tools.environment.snapshot`.
         """
         if not is_conda_env(path):
             raise InvalidEnvironment('Unable to load environment {}'.format(path))
 
         self._packages = {}
+        self._partitions = None
+        self._meta_mtime = None
+        self._ownership = None
         self.path = path
         self._meta = join(path, 'conda-meta')
         self.name = basename(path)
+        self._snapshot = snapshot
 
         self.history = History(self.path)
 
     def _read_package_json(self):
         if not self._packages:
-            self._packages = _load_all_json(self._meta)
+            if self._snapshot:
+                snapshot_dir = None if self._snapshot is True else self._snapshot
+                self._packages = _load_all_snapshot(self.path, snapshot_dir)
+            else:
+                self._packages = _load_all_json(self._meta)
+
+    def invalidate(self):
+        """
+        Discard all the cached package records of this environment.
+
+        They are read again on next access.
+        """
+        self._packages = {}
+        self._partitions = None
+        self._meta_mtime = None
+        self._ownership = None
+        reset_lazy(self, *_RECORD_PROPERTIES)
+
+    def _partition(self):
+        """
+        Return the package records of the environment partitioned by link type.
+
+        The records are read once and partitioned in a single pass.  The result is
+        cached until the mtime of conda-meta changes (ie. a package is added or removed).
+        The key None maps to all records.
+        """
+        mtime = os.stat(self._meta).st_mtime_ns
+        if self._partitions is None or mtime != self._meta_mtime:
+            if self._meta_mtime is not None:
+                self.invalidate()
+            self._read_package_json()
+
+            partitions = {t: [] for t in LINK_TYPE}
+            proxies = []
+            for path, info in self._packages.items():
+                proxy = PackageProxy(path, info=info)
+                link = info.get('link')
+                ltype = cast_link_type(link['type']) if link else LINK_TYPE.hardlink
+                partitions[ltype].append(proxy)
+                proxies.append(proxy)
+
+            self._partitions = {t: tuple(v) for t, v in partitions.items()}
+            self._partitions[None] = tuple(proxies)
+            self._meta_mtime = mtime
+        return self._partitions
 
     def activated(self):
         """
@@ -154,21 +259,33 @@ class Environment(object):
             specs.append('{}-{}-{}'.format(p, v, b))
         return tuple(specs)
 
+    @property
+    def ownership(self):
+        """
+        Index of the files in the environment mapped to the packages that own them.
+
+        Like the link type partitions, the index is rebuilt when conda-meta changes.
+        """
+        self._partition()
+        if self._ownership is None:
+            self._ownership = OwnershipIndex(self)
+        return self._ownership
+
     @property
     def hard_linked(self):
-        return tuple(_filter_json_by_type(self._meta, link_type=LINK_TYPE.hardlink))
+        return self._partition()[LINK_TYPE.hardlink]
 
     @property
     def soft_linked(self):
-        return tuple(_filter_json_by_type(self._meta, link_type=LINK_TYPE.softlink))
+        return self._partition()[LINK_TYPE.softlink]
 
     @property
     def copy_linked(self):
-        return tuple(_filter_json_by_type(self._meta, link_type=LINK_TYPE.copy))
+        return self._partition()[LINK_TYPE.copy]
 
     @property
     def packages(self):
-        return tuple(_filter_json_by_type(self._meta, link_type=None))
+        return self._partition()[None]
 
     @lru_cache(maxsize=4)
     def _link_type_packages(self, link_type='all'):
@@ -247,25 +364,23 @@ def _load_all_json(path):
     """
     result = {}
     for f in pathlib.Path(path).glob('*.json'):
-        result[f] = update_values(_load_json(str(f)))
+        result[f] = _load_json(str(f))
     return result
 
+def _load_all_snapshot(path, snapshot_dir=None):
+    """
+    Load all json files in the conda-meta directory of the environment at *path* through a snapshot.
+    Return the same dictionary as :py:func:`_load_all_json`.
+    """
+    meta = pathlib.Path(path, 'conda-meta')
+    records = load_records(path, snapshot_dir)
+    return {meta/f: Pool.register(update_values(r)) for f, r in records.items()}
+
 def _load_json(path):
     with open(path, 'r') as fin:
-        x = Pool.register(json.load(fin))
+        x = Pool.register(update_values(json.load(fin)))
     return x
 
-def _filter_json_by_type(path, link_type=LINK_TYPE.hardlink):
-    for _json in pathlib.Path(path).glob('*.json'):
-        meta = update_values(_load_json(_json))
-
-        if link_type is None:
-            yield PackageProxy(_json, info=meta)
-        else:
-            if LINK_TYPE(meta['link']['type']) == link_type:
-                yield PackageProxy(_json, info=meta)
-
-
 def is_conda_env(path):
     return isdir(path) and isdir(join(path, 'conda-meta'))
 
@@ -295,6 +410,118 @@ def named_environments(path):
     """
     return {e.name: e for e in environments(path)}
 
+# Registry files listing environment prefixes, one per line
+REGISTRY_NAMES = ('environments.txt',)
+
+
+def _read_registry(path):
+    """
+    Return the environment prefixes listed in the registry file at *path*.
+    """
+    try:
+        with open(path, 'r') as f:
+            return [l.strip() for l in f if l.strip() and not l.lstrip().startswith('#')]
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return []
+
+
+def _search_dir(path, depth, max_depth):
+    """
+    Look at a single directory during discovery.
+
+    Return a tuple of (path if it is an environment or None, [(subdirectory, depth)], registry entries).
+    Environments are not searched further, except for their `envs/` directory.
+    """
+    if is_conda_env(path):
+        envs = join(path, 'envs')
+        children = [(envs, depth + 1)] if depth < max_depth and isdir(envs) else []
+        return path, children, []
+
+    registry = []
+    for name in REGISTRY_NAMES:
+        registry.extend(_read_registry(join(path, name)))
+
+    children = []
+    if depth < max_depth:
+        try:
+            with os.scandir(path) as it:
+                children = [(e.path, depth + 1) for e in it if e.is_dir(follow_symlinks=False)]
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            pass
+    return None, children, registry
+
+
+def _load_environment(path, snapshot, preload):
+    try:
+        env = Environment(path, snapshot=snapshot)
+    except InvalidEnvironment:
+        return None
+    if preload:
+        try:
+            env._partition()
+        except (OSError, ValueError):
+            # A record could not be read, the error is raised again on access
+            env.invalidate()
+    return env
+
+
+def discover_environments(roots, max_depth=2, workers=None, preload=True, snapshot=False):
+    """
+    Yield the environments found under many *roots*.
+
+    Roots are searched concurrently by a pool of *workers* threads, up to *max_depth*
+    directory levels below each root.  A root can be an environment, a directory
+    containing environments (like `envs/`), or a registry file such as
+    `~/.conda/environments.txt`.  Registry files found in searched directories are
+    read as well.  Each environment is yielded once, even if it is reachable through
+    several roots or symbolic links.
+
+    With preload=True, the package records of the environments are read in the pool
+    before they are yielded.  An environment with a record that cannot be read is
+    yielded without its records.  Environments are yielded as soon as they are loaded,
+    in no particular order.
+    """
+    if isinstance(roots, (str, pathlib.PurePath)):
+        roots = [roots]
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+
+        def search(path, depth):
+            path = str(path)
+            real = os.path.realpath(path)
+            if real in seen:
+                return
+            seen.add(real)
+            if os.path.isfile(path):
+                for p in _read_registry(path):
+                    search(p, max_depth)
+            else:
+                pending.add(executor.submit(_search_dir, path, depth, max_depth))
+
+        for root in roots:
+            search(os.path.expanduser(str(root)), 0)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                result = fut.result()
+                if result is None or isinstance(result, Environment):
+                    if result is not None:
+                        yield result
+                    continue
+
+                env_path, children, registry = result
+                if env_path is not None:
+                    pending.add(executor.submit(_load_environment, env_path, snapshot, preload))
+                for path, depth in children:
+                    search(path, depth)
+                for path in registry:
+                    # Entries of a registry are environment prefixes, not searched further
+                    search(path, max_depth)
+
+
 def active_environment():
     """
     Return the active environment.
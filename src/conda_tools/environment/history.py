@@ -5,13 +5,22 @@ Licensed under BSD 3-clause license.
 from __future__ import print_function
 
 
+import os
 import re
 import time
 from json import loads
 from os.path import isfile, join
 from functools import lru_cache
 
-from ..common import lazyproperty
+from ..common import lazyproperty, reset_lazy
+
+_SEP_PAT = re.compile(r'==>\s*(.+?)\s*<==')
+
+# Bytes at the start of the file compared to detect a replaced history file
+HEAD_SIZE = 256
+
+# Revisions between full copies of the state in RevisionStates
+CHECKPOINT_INTERVAL = 32
 
 class CondaHistoryException(Exception):
     pass
@@ -61,6 +70,28 @@ def pretty_diff(diff):
         yield '+%s-%s' % (name, added[name])
 
 
+def _parse_lines(lines, res):
+    """
+    Parse lines of a history file, appending revisions to res.
+
+    Lines that do not start a new revision belong to the last revision in res.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        m = _SEP_PAT.match(line)
+        if m:
+            res.append((m.group(1), set(), []))
+        elif not res:
+            continue
+        elif line.startswith('#'):
+            res[-1][2].append(line)
+        else:
+            res[-1][1].add(line)
+    return res
+
+
 def pretty_content(content):
     if is_diff(content):
         return pretty_diff(content)
@@ -68,36 +99,204 @@ def pretty_content(content):
         return iter(sorted(content))
 
 
+class RevisionStates(object):
+    """
+    Sequence of tuples(datetime strings, frozenset of distributions), one per revision.
+
+    Only the diff of every revision is stored, plus a full checkpoint of the state
+    every *interval* revisions.  A state is computed on demand by applying at most
+    *interval* diffs to the nearest checkpoint.  Revisions that did not change
+    anything share the frozenset of the previous revision.
+    """
+    def __init__(self, revisions, interval=CHECKPOINT_INTERVAL):
+        if interval < 1:
+            raise ValueError('interval must be at least 1')
+        self.interval = interval
+        self._dates = []
+        # Per revision either (None, full state) or (added, removed)
+        self._diffs = []
+        self._checkpoints = []
+
+        cur = set()
+        state = frozenset()
+        for dt, cont, unused_com in revisions:
+            if not is_diff(cont):
+                diff = (None, frozenset(cont))
+                cur = set(cont)
+                changed = True
+            else:
+                added, removed = set(), set()
+                for s in cont:
+                    if s.startswith('-'):
+                        removed.add(s[1:])
+                    elif s.startswith('+'):
+                        added.add(s[1:])
+                    else:
+                        raise CondaHistoryException('Did not expect: %s' % s)
+                diff = (frozenset(added), frozenset(removed))
+                changed = bool(removed & cur) or not added <= cur
+                cur -= removed
+                cur |= added
+
+            if len(self._diffs) % interval == 0:
+                if changed or state is None:
+                    state = frozenset(cur)
+                self._checkpoints.append(state)
+            elif changed:
+                # Mark the checkpoint stale, so the next one is built from cur
+                state = None
+            self._dates.append(dt)
+            self._diffs.append(diff)
+
+    def __len__(self):
+        return len(self._diffs)
+
+    def _state(self, rev):
+        c = rev // self.interval
+        state = self._checkpoints[c]
+        start = c * self.interval
+        cur = None
+        for i in range(start + 1, rev + 1):
+            added, removed = self._diffs[i]
+            if added is None:
+                state, cur = removed, None
+                continue
+            if cur is None:
+                if not (removed & state) and added <= state:
+                    continue
+                cur = set(state)
+            cur -= removed
+            cur |= added
+        return state if cur is None else frozenset(cur)
+
+    def __getitem__(self, rev):
+        if isinstance(rev, slice):
+            return [self[i] for i in range(*rev.indices(len(self)))]
+        n = len(self)
+        if rev < 0:
+            rev += n
+        if not 0 <= rev < n:
+            raise IndexError('revision out of range')
+        return self._dates[rev], self._state(rev)
+
+    def __iter__(self):
+        cur = set()
+        state = frozenset()
+        for dt, (added, removed) in zip(self._dates, self._diffs):
+            if added is None:
+                state = removed
+                cur = set(state)
+            elif (removed & cur) or not added <= cur:
+                cur -= removed
+                cur |= added
+                state = frozenset(cur)
+            yield dt, state
+
+    def __repr__(self):
+        return 'RevisionStates({} revisions) @ {}'.format(len(self), hex(id(self)))
+
+
 class History(object):
 
+    # Lazy properties derived from the parsed revisions
+    _DERIVED = ('get_user_requests', 'construct_states', 'object_log')
+
     def __init__(self, prefix):
         meta_dir = join(prefix, 'conda-meta')
         self.path = join(meta_dir, 'history')
+        self._revisions = []
+        self._offset = 0
+        self._identity = None
+        self._head = b''
+        self._loaded = False
 
-    @lazyproperty
+    @property
     def _parse(self):
         """
         parse the history file and return a list of
         tuples(datetime strings, set of distributions/diffs, comments)
+
+        The file is read once, call :py:meth:`update` to pick up new revisions.
+        """
+        if not self._loaded:
+            self.update()
+        return self._revisions
+
+    @property
+    def offset(self) -> int:
+        """
+        Byte offset in the history file up to which revisions were parsed.
+        """
+        return self._offset
+
+    def update(self) -> int:
+        """
+        Parse the revisions appended to the history file since the last update.
+
+        conda only appends to the history file, so parsing resumes at the byte
+        offset reached previously.  If the file was replaced or truncated it is
+        parsed again from the start.  Only complete lines are consumed.
+        Return the number of new revisions.
+        """
+        self._loaded = True
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+
+        if st is None:
+            if self._revisions or self._offset:
+                self._reset()
+            return 0
+
+        with open(self.path, 'rb') as f:
+            head = f.read(len(self._head)) if self._head else b''
+            identity = (st.st_dev, st.st_ino)
+            if identity != self._identity or st.st_size < self._offset or head != self._head:
+                self._reset()
+                self._identity = identity
+            if st.st_size == self._offset:
+                return 0
+
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return 0
+        if not self._offset:
+            self._head = data[:min(end, HEAD_SIZE)]
+
+        before = len(self._revisions)
+        _parse_lines(data[:end].decode('utf-8', 'replace').splitlines(), self._revisions)
+        self._offset += end
+        reset_lazy(self, *self._DERIVED)
+        return len(self._revisions) - before
+
+    def _reset(self):
+        self._revisions = []
+        self._offset = 0
+        self._identity = None
+        self._head = b''
+        reset_lazy(self, *self._DERIVED)
+
+    def iter_revisions(self):
+        """
+        Yield the revisions of the history file one at a time, as
+        tuples(datetime strings, set of distributions/diffs, comments)
+
+        The file is streamed, so the whole log is never held in memory.
         """
-        res = []
         if not isfile(self.path):
-            return res
-        sep_pat = re.compile(r'==>\s*(.+?)\s*<==')
-        with open(self.path, 'r') as f:
-            lines = f.read().splitlines()
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            m = sep_pat.match(line)
-            if m:
-                res.append((m.group(1), set(), []))
-            elif line.startswith('#'):
-                res[-1][2].append(line)
-            else:
-                res[-1][1].add(line)
-        return res
+            return
+        res = []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                _parse_lines((line.decode('utf-8', 'replace'),), res)
+                if len(res) > 1:
+                    # The previous revision is complete
+                    yield res.pop(0)
+        yield from res
 
     @lazyproperty
     def get_user_requests(self):
@@ -133,23 +332,11 @@ class History(object):
     @lazyproperty
     def construct_states(self):
         """
-        return a list of tuples(datetime strings, set of distributions)
+        return a sequence of tuples(datetime strings, frozenset of distributions)
+
+        States are computed on demand from per revision diffs, see RevisionStates.
         """
-        res = []
-        cur = set([])
-        for dt, cont, unused_com in self._parse:
-            if not is_diff(cont):
-                cur = cont
-            else:
-                for s in cont:
-                    if s.startswith('-'):
-                        cur.discard(s[1:])
-                    elif s.startswith('+'):
-                        cur.add(s[1:])
-                    else:
-                        raise CondaHistoryException('Did not expect: %s' % s)
-            res.append((dt, cur.copy()))
-        return res
+        return RevisionStates(self._parse)
 
     def get_state(self, rev=-1):
         """
@@ -159,10 +346,8 @@ class History(object):
         """
         states = self.construct_states
         if not states:
-            return set([])
-        times, pkgs = zip(*states)
-        return pkgs[rev]
-
+            return frozenset()
+        return states[rev][1]
 
     def print_log(self):
         for i, (date, content, unused_com) in enumerate(self._parse):
@@ -220,8 +405,8 @@ class History(object):
             result.append(event)
         return result
 
-        def __repr__(self):
-            return 'History({}) @ {}'.format(self.path, hex(id(self)))
+    def __repr__(self):
+        return 'History({}) @ {}'.format(self.path, hex(id(self)))
 
-        def __str__(self):
-            return 'History({})'.format(self.path)
+    def __str__(self):
+        return 'History({})'.format(self.path)
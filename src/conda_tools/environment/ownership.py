@@ -0,0 +1,160 @@
+"""
+Inverted index of the files owned by the packages of an environment.
+"""
+import os
+import json
+from bisect import bisect_left
+from collections import defaultdict
+
+from .. import _types
+
+
+def _meta_mtime(prefix):
+    return os.stat(os.path.join(prefix, 'conda-meta')).st_mtime_ns
+
+
+class OwnershipIndex(object):
+    """
+    Map every file listed in the conda-meta records of an environment to the package(s) that own it.
+
+    Paths are relative to the environment prefix and use forward slashes, like the
+    `files` lists in conda-meta.  Absolute paths under the prefix are also accepted
+    by the query methods.
+    """
+    def __init__(self, env, owners=None, mtime=None):
+        """
+        Build the index for *env* from the `files` of its package records.
+
+        *mtime* is the mtime of the conda-meta directory the index was built from.
+        """
+        self.env = env
+        self.path = env.path
+        if mtime is None:
+            mtime = _meta_mtime(env.path)
+        self.mtime = mtime
+        if owners is None:
+            owners = defaultdict(list)
+            for pkg in env.packages:
+                for f in pkg.info.get('files', ()):
+                    owners[f].append(pkg)
+        self._owners = {k: tuple(v) for k, v in owners.items()}
+        self._paths = sorted(self._owners)
+
+    @classmethod
+    def load(cls, env, index_path: _types.PATH) -> 'OwnershipIndex':
+        """
+        Load the index of *env* saved at *index_path*.
+
+        The index is rebuilt (and saved) if it is missing or the conda-meta directory changed.
+        """
+        mtime = _meta_mtime(env.path)
+        try:
+            with open(index_path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = None
+
+        if data is not None and data['mtime'] == mtime:
+            by_name = {p.path.name: p for p in env.packages}
+            if all(n in by_name for n in data['packages']):
+                packages = [by_name[n] for n in data['packages']]
+                owners = {f: [packages[i] for i in idx] for f, idx in data['files'].items()}
+                return cls(env, owners, mtime)
+
+        index = cls(env, mtime=mtime)
+        index.save(index_path)
+        return index
+
+    def save(self, index_path: _types.PATH) -> bool:
+        """
+        Save the index to *index_path*.
+
+        The index is saved with the conda-meta mtime it was built from, so an index
+        built before the environment changed is rebuilt by the next :py:meth:`load`.
+        Return False if the file could not be written.
+        """
+        position = {}
+        for pkgs in self._owners.values():
+            for p in pkgs:
+                position.setdefault(p, len(position))
+        data = {'mtime': self.mtime,
+                'packages': [p.path.name for p in position],
+                'files': {f: [position[p] for p in pkgs] for f, pkgs in self._owners.items()}}
+
+        tmp = '{}.{}.tmp'.format(index_path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, index_path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def _relative(self, path) -> str:
+        path = str(path)
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.path)
+        if os.sep != '/':
+            path = path.replace(os.sep, '/')
+        return path
+
+    def __len__(self):
+        return len(self._owners)
+
+    def __contains__(self, path):
+        return self._relative(path) in self._owners
+
+    def owners(self, path) -> tuple:
+        """
+        Return the packages that own *path*.
+
+        A file is normally owned by a single package.  More than one owner could
+        mean the packages in the environment were incorrectly built.
+        """
+        return self._owners.get(self._relative(path), ())
+
+    def owners_many(self, paths) -> dict:
+        """
+        Return a dictionary mapping each of *paths* to the packages that own it.
+        """
+        return {p: self.owners(p) for p in paths}
+
+    def under(self, directory) -> dict:
+        """
+        Return a dictionary of all owned files under *directory* mapped to their owners.
+        """
+        prefix = self._relative(directory).rstrip('/')
+        prefix = prefix + '/' if prefix not in ('', '.') else ''
+
+        paths = self._paths
+        result = {}
+        for i in range(bisect_left(paths, prefix), len(paths)):
+            if not paths[i].startswith(prefix):
+                break
+            result[paths[i]] = self._owners[paths[i]]
+        return result
+
+    def unowned(self, directory=None, exclude=('conda-meta',)) -> list:
+        """
+        Return the files under the environment prefix (or *directory*) that no package owns.
+
+        Top level directories in *exclude* are not searched.
+        """
+        root = self.path if directory is None else os.path.join(self.path, self._relative(directory))
+        result = []
+        for dirpath, dirs, files in os.walk(root):
+            rel = self._relative(dirpath)
+            if rel == '.':
+                dirs[:] = [d for d in dirs if d not in exclude]
+                rel = ''
+            else:
+                rel += '/'
+            for f in files:
+                if rel + f not in self._owners:
+                    result.append(rel + f)
+        return sorted(result)
+
+    def __repr__(self):
+        return 'OwnershipIndex({}) @ {}'.format(self.path, hex(id(self)))
@@ -0,0 +1,100 @@
+"""
+Persistent snapshots of parsed conda-meta records.
+
+Parsing every `conda-meta/*.json` file of an environment is the bulk of the cost
+of loading an Environment.  A snapshot stores the parsed records of an environment
+in a compact binary file along with the mtime and size of every JSON file.
+When the environment is loaded again, only the JSON files that changed are parsed.
+
+Snapshots are written with :py:mod:`marshal`, which can only hold plain data.
+They are tied to the Python version that wrote them and are ignored otherwise.
+"""
+import os
+import sys
+import json
+import marshal
+import hashlib
+from os.path import join, abspath
+
+from ..common import user_cache_dir
+from .. import _types
+
+SNAPSHOT_VERSION = 1
+_HEADER = (SNAPSHOT_VERSION, tuple(sys.version_info[:2]))
+
+
+def default_snapshot_dir() -> str:
+    """
+    Return the directory snapshots are stored in by default.
+
+    This is $CONDA_TOOLS_CACHE/snapshots if set, otherwise the user cache directory.
+    """
+    return user_cache_dir('snapshots')
+
+
+def snapshot_path(prefix: _types.PATH, snapshot_dir: _types.PATH=None) -> str:
+    """
+    Return the path of the snapshot file for the environment at *prefix*.
+    """
+    snapshot_dir = snapshot_dir or default_snapshot_dir()
+    key = hashlib.sha1(abspath(str(prefix)).encode('utf8')).hexdigest()
+    return join(str(snapshot_dir), key + '.snapshot')
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'rb') as f:
+            header, files = marshal.loads(f.read())
+    except (FileNotFoundError, EOFError, ValueError, TypeError):
+        return {}
+    if header != _HEADER:
+        return {}
+    return files
+
+
+def _write_snapshot(path, files) -> bool:
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            marshal.dump((_HEADER, files), f)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def load_records(prefix: _types.PATH, snapshot_dir: _types.PATH=None) -> dict:
+    """
+    Return the parsed records in `conda-meta` of the environment at *prefix*.
+
+    The result maps JSON file names to the parsed dictionaries.  Records are taken
+    from the snapshot when the mtime and size of their file are unchanged, and
+    the snapshot is rewritten if any file was added, changed or removed.
+    """
+    meta = join(str(prefix), 'conda-meta')
+    path = snapshot_path(prefix, snapshot_dir)
+    saved = _read_snapshot(path)
+
+    files = {}
+    changed = False
+    with os.scandir(meta) as it:
+        for entry in it:
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+
+            st = entry.stat()
+            old = saved.get(entry.name)
+            if old is not None and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+                files[entry.name] = old
+            else:
+                with open(entry.path, 'r') as fin:
+                    files[entry.name] = (st.st_mtime_ns, st.st_size, json.load(fin))
+                changed = True
+
+    if changed or len(files) != len(saved):
+        _write_snapshot(path, files)
+
+    return {name: record for name, (_, _, record) in files.items()}
@@ -3,11 +3,14 @@ Utility functions that map information from environments onto package cache
 """
 from __future__ import print_function
 
-from os.path import join
+from os.path import join, dirname, realpath
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from .environment import Environment, environments
 from ..cache.package import Package
-from ..utils import is_hardlinked
+from ..cache.exceptions import InvalidCachePackage
+from ..utils import is_hardlinked, inode_map, _is_under
 from ..constants import LINK_TYPE
 
 
@@ -26,7 +29,7 @@ def owns(env:Environment, path) -> tuple:
     shouldn't typically happen, and if it does, could mean the packages in the
     environment were incorrectly built.
     """
-    return tuple(p for p in env.packages if path in p.files)
+    return env.ownership.owners(path)
 
 
 def check_hardlinked_pkg(env:Environment, Pkg:Package) -> list:
@@ -36,7 +39,7 @@ def check_hardlinked_pkg(env:Environment, Pkg:Package) -> list:
     Returns a list of improperly hardlinked files.
     """
     bad_linked = []
-    expected_linked = Pkg.files - Pkg.has_prefix.keys() - Pkg.no_link
+    expected_linked = _expected_links(Pkg)
     for f in expected_linked:
         src = join(Pkg.path, f)
         tgt = join(env.path, f)
@@ -45,6 +48,85 @@ def check_hardlinked_pkg(env:Environment, Pkg:Package) -> list:
     return bad_linked
 
 
+LinkReport = namedtuple('LinkReport', ('missing', 'broken', 'copied'))
+LinkReport.__doc__ = """
+Result of a hardlink check for one package in one environment.
+
+missing: files absent from the environment
+broken: files absent from the package cache
+copied: files present in both, but not hardlinked to each other
+"""
+
+
+def _expected_links(pkg:Package) -> frozenset:
+    return pkg.files - pkg.has_prefix.keys() - pkg.no_link
+
+
+def _link_source(p):
+    return (p.info.get('link') or {}).get('source')
+
+
+def check_hardlinked_fleet(envs, workers:int=8) -> dict:
+    """
+    Check all hardlinked packages in all environments *envs* at once.
+
+    The cache directory of every hardlinked package and every environment prefix
+    are scanned exactly once, concurrently, to build maps of (st_dev, st_ino).
+    Hardlink correctness is then decided by comparing those maps, without
+    stat'ing files pair by pair.
+
+    Package caches and other environments nested in an environment (as in the
+    root environment) are not scanned.  Packages without a recorded link source
+    are skipped, since their cache directory is unknown.  Packages that are gone
+    from the cache or cannot be read are checked against the files of their record.
+
+    Returns a dictionary mapping each environment to a dictionary of package names
+    mapped to a :py:class:`LinkReport`.
+    """
+    envs = tuple(envs)
+    linked = {env: [p for p in env.hard_linked if _link_source(p)] for env in envs}
+    sources = {_link_source(p) for pkgs in linked.values() for p in pkgs}
+
+    roots = {realpath(e.path) for e in envs} | {realpath(dirname(s)) for s in sources}
+
+    def scan_env(env):
+        root = realpath(env.path)
+        return inode_map(root, exclude=[r for r in roots if _is_under(r, root)])
+
+    def scan_package(source):
+        try:
+            expected = _expected_links(Package(source, validate=False))
+        except (FileNotFoundError, InvalidCachePackage):
+            # The package is gone from the cache, or its metadata is invalid
+            expected = None
+        return source, (expected, inode_map(source))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        env_maps = dict(zip(envs, executor.map(scan_env, envs)))
+        cache = dict(executor.map(scan_package, sources))
+
+    result = {}
+    for env, pkgs in linked.items():
+        env_map = env_maps[env]
+        result[env] = report = {}
+        for p in pkgs:
+            expected, pkg_map = cache[_link_source(p)]
+            if expected is None:
+                expected = p.info.get('files', ())
+            missing, broken, copied = [], [], []
+            for f in sorted(expected):
+                tgt = env_map.get(f)
+                src = pkg_map.get(f)
+                if tgt is None:
+                    missing.append(f)
+                elif src is None:
+                    broken.append(f)
+                elif src != tgt:
+                    copied.append(f)
+            report[p.name] = LinkReport(tuple(missing), tuple(broken), tuple(copied))
+    return result
+
+
 def explicitly_installed(env:Environment) -> dict:
     """
     Return list of explicitly installed packages.
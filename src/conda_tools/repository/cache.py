@@ -0,0 +1,211 @@
+"""
+On-disk cache of parsed repodata.
+
+Each channel/subdir url is stored in its own file, together with the ETag and
+Last-Modified headers of the response it was parsed from.  Later fetches send
+a conditional request, and when the repodata did not change the packages are
+reloaded from the cache instead of being downloaded and parsed again.
+
+Cache files are written with :py:mod:`marshal`, storing one row of field values
+per package, and are tied to the Python version that wrote them.  The headers
+are stored in a small length prefixed block at the start of the file, so that
+they can be read without loading the packages.
+"""
+import os
+import sys
+import time
+import struct
+import marshal
+import hashlib
+from os.path import join
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from ..common import user_cache_dir
+from .. import _types
+from .repository import Repository, RepoPackage, REPODATA_NAME
+from .repodata import load_repodata
+
+CACHE_VERSION = 1
+_HEADER = (CACHE_VERSION, tuple(sys.version_info[:2]))
+# Size of the block holding the header and the response headers
+_SIZE = struct.Struct('<I')
+
+# Order of the values in a cached row
+_ROW_FIELDS = ('filename',) + RepoPackage.PACKAGE_FIELDS
+
+
+def default_cache_dir() -> str:
+    """
+    Return the directory repodata is cached in by default.
+    """
+    return user_cache_dir('repodata')
+
+
+def _to_row(pkg):
+    return tuple(getattr(pkg, f) for f in _ROW_FIELDS)
+
+
+def _from_row(row):
+    pkg = RepoPackage.__new__(RepoPackage)
+    for f, v in zip(_ROW_FIELDS, row):
+        setattr(pkg, f, v)
+    return pkg
+
+
+class RepodataCache(object):
+    """
+    Cache of parsed repodata, keyed by channel/subdir url.
+
+    >>> cache = RepodataCache()  # doctest: +SKIP
+    >>> repo = cache.get_repo('https://conda.anaconda.org/conda-forge', 'noarch')  # doctest: +SKIP
+    """
+    def __init__(self, cache_dir: _types.PATH=None):
+        self.cache_dir = str(cache_dir or default_cache_dir())
+
+    def path(self, url: str) -> str:
+        """
+        Return the path of the cache file for *url*.
+        """
+        key = hashlib.sha1(url.encode('utf8')).hexdigest()
+        return join(self.cache_dir, key + '.repodata')
+
+    def _read(self, url, packages, merge_conda=False):
+        try:
+            with open(self.path(url), 'rb') as f:
+                size, = _SIZE.unpack(f.read(_SIZE.size))
+                header, headers = marshal.loads(f.read(size))
+                if header != _HEADER:
+                    return None
+                headers['mtime'] = os.fstat(f.fileno()).st_mtime
+                if not packages:
+                    return headers, None
+                # marshal.loads of the whole block is much faster than marshal.load
+                info, rows, conda_rows = marshal.loads(f.read())
+        except (FileNotFoundError, EOFError, ValueError, TypeError, struct.error):
+            return None
+        data = {'info': info,
+                'packages': {row[0]: _from_row(row) for row in rows},
+                'packages.conda': {row[0]: _from_row(row) for row in conda_rows}}
+        return headers, Repository(url, data, merge_conda)
+
+    def headers(self, url: str) -> dict:
+        """
+        Return the headers cached for *url*, without loading the packages, or None.
+
+        headers is a dictionary with the keys etag, last_modified and mtime.
+        """
+        cached = self._read(url, False)
+        return None if cached is None else cached[0]
+
+    def load(self, url: str, merge_conda: bool=False):
+        """
+        Return a tuple of (headers, Repository) cached for *url*, or None.
+
+        headers is a dictionary with the keys etag, last_modified and mtime.
+        """
+        return self._read(url, True, merge_conda)
+
+    def _load_repo(self, url, merge_conda):
+        cached = self._read(url, True, merge_conda)
+        return None if cached is None else cached[1]
+
+    def save(self, repo: Repository, etag: str=None, last_modified: str=None) -> bool:
+        """
+        Store *repo* in the cache.  Return False if the cache file could not be written.
+        """
+        path = self.path(repo.url)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        conda = repo.conda_packages
+        rows = [_to_row(p) for f, p in repo.packages.items() if isinstance(p, RepoPackage) and f not in conda]
+        conda_rows = [_to_row(p) for p in conda.values() if isinstance(p, RepoPackage)]
+        headers = {'etag': etag, 'last_modified': last_modified}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            header = marshal.dumps((_HEADER, headers))
+            with open(tmp, 'wb') as f:
+                f.write(_SIZE.pack(len(header)))
+                f.write(header)
+                marshal.dump((repo.info, rows, conda_rows), f)
+            os.replace(tmp, path)
+        except (OSError, ValueError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def touch(self, url: str) -> None:
+        """
+        Mark the cache for *url* as fresh.
+        """
+        try:
+            os.utime(self.path(url))
+        except FileNotFoundError:
+            pass
+
+    def get_repo(self, url: str, platform: str=None, max_age: float=None, merge_conda: bool=False) -> Repository:
+        """
+        Return the Repository of the channel at *url*, using the cache when possible.
+
+        If the cache is younger than *max_age* seconds, no request is made.
+        Otherwise a conditional request is made with the cached ETag and
+        Last-Modified headers, and the repodata is only parsed again if it changed.
+        The cached packages are only loaded when they are used.
+
+        The packages are RepoPackage objects, see :py:func:`.repodata.load_repodata`.
+        """
+        ch_url = join(url, platform) if platform is not None else url
+        headers = self.headers(ch_url)
+
+        if headers is not None and max_age is not None and time.time() - headers['mtime'] < max_age:
+            repo = self._load_repo(ch_url, merge_conda)
+            if repo is not None:
+                return repo
+            headers = None
+
+        request = Request(join(ch_url, REPODATA_NAME))
+        if headers is not None:
+            if headers.get('etag'):
+                request.add_header('If-None-Match', headers['etag'])
+            if headers.get('last_modified'):
+                request.add_header('If-Modified-Since', headers['last_modified'])
+
+        try:
+            response = urlopen(request)
+        except HTTPError as e:
+            if e.code == 304 and headers is not None:
+                e.close()
+                repo = self._load_repo(ch_url, merge_conda)
+                if repo is not None:
+                    self.touch(ch_url)
+                    return repo
+                # The cached packages are unreadable, download them again
+                response = urlopen(Request(join(ch_url, REPODATA_NAME)))
+            else:
+                raise
+
+        with response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            # Servers (and file:// urls) may ignore conditional requests
+            if headers is not None and (etag or last_modified) and \
+                    (etag, last_modified) == (headers.get('etag'), headers.get('last_modified')):
+                repo = self._load_repo(ch_url, merge_conda)
+                if repo is not None:
+                    self.touch(ch_url)
+                    return repo
+            repo = Repository(ch_url, load_repodata(response), merge_conda)
+
+        self.save(repo, etag, last_modified)
+        return repo
+
+    def __repr__(self):
+        return 'RepodataCache({}) @ {}'.format(self.cache_dir, hex(id(self)))
+
+
+def cached_repo(url: str, platform: str=None, cache_dir: _types.PATH=None, max_age: float=None,
+                merge_conda: bool=False) -> Repository:
+    """
+    Return the Repository of the channel at *url*, using the repodata cache in *cache_dir*.
+    """
+    return RepodataCache(cache_dir).get_repo(url, platform, max_age, merge_conda)
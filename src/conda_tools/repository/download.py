@@ -0,0 +1,275 @@
+"""
+Concurrent, verifying package downloader.
+
+Packages are downloaded by a bounded pool of threads.  Each thread keeps one
+HTTP connection per host alive between downloads.  The sha256 of a package is
+computed while it is written, partial downloads are resumed with Range requests,
+and a package only appears in the pkgs directory once it is complete and verified.
+"""
+import os
+import time
+import hashlib
+import threading
+import http.client
+from collections import namedtuple
+from urllib.parse import urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from typing import Callable, Iterable
+
+from .. import _types
+from .exceptions import DownloadError, ChecksumMismatch
+
+BLOCKSIZE = 256 * 1024
+MAX_REDIRECTS = 5
+PARTIAL_SUFFIX = '.partial'
+
+DownloadResult = namedtuple('DownloadResult',
+                            ('url', 'path', 'bytes', 'seconds', 'resumed', 'skipped', 'error'))
+DownloadResult.__doc__ = """
+Outcome of a single download.
+
+bytes: number of bytes transferred (excluding resumed bytes).
+resumed: True if a partial download was continued.
+skipped: True if a verified file was already in place.
+error: the exception raised, or None on success.
+"""
+
+# Connection errors that can happen when a kept alive connection is closed or left unusable
+_STALE = (http.client.RemoteDisconnected, http.client.BadStatusLine, http.client.CannotSendRequest,
+          http.client.ResponseNotReady, ConnectionResetError, BrokenPipeError)
+
+
+def _hash_file(path, blocksize=BLOCKSIZE):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h
+
+
+class Downloader(object):
+    """
+    Download packages into *pkgs_dir* with a pool of *workers* threads.
+
+    Metrics are accumulated over all downloads: files, bytes, seconds (wall time
+    spent in :py:meth:`download`) and :py:attr:`throughput`.
+    """
+    def __init__(self, pkgs_dir: _types.PATH, workers: int=4, blocksize: int=BLOCKSIZE, timeout: float=60):
+        self.pkgs_dir = str(pkgs_dir)
+        self.workers = workers
+        self.blocksize = blocksize
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # One lock per destination file, so duplicate requests do not write the same file
+        self._dest_locks = {}
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes per second transferred by :py:meth:`download`.
+        """
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def _connection(self, scheme, netloc, fresh=False):
+        """
+        Return the connection of the current thread to *netloc*.
+        """
+        conns = getattr(self._local, 'connections', None)
+        if conns is None:
+            conns = self._local.connections = {}
+        key = (scheme, netloc)
+        conn = conns.get(key)
+        if conn is not None and fresh:
+            conn.close()
+            conn = None
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            elif scheme == 'http':
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise DownloadError('Unsupported url scheme: {}'.format(scheme))
+            conns[key] = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _request(self, url, headers):
+        """
+        Send a GET request for *url*, following redirects.  Return the response.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            path = parts.path + ('?' + parts.query if parts.query else '')
+            conn = self._connection(parts.scheme, parts.netloc)
+            self._local.current = (parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except _STALE:
+                # The server closed the kept alive connection, try once more on a new one
+                conn = self._connection(parts.scheme, parts.netloc, fresh=True)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader('Location')
+                response.read()
+                if not location:
+                    raise DownloadError('Redirect without location for {}'.format(url))
+                url = urljoin(url, location)
+                continue
+            return response
+        raise DownloadError('Too many redirects for {}'.format(url))
+
+    def _discard(self):
+        """
+        Close and forget the connection of the current thread used by the last request.
+
+        A response that was not read to the end leaves its connection unusable.
+        """
+        conns = getattr(self._local, 'connections', {})
+        conn = conns.pop(getattr(self._local, 'current', None), None)
+        if conn is not None:
+            conn.close()
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+
+    def fetch(self, url: str, sha256: str=None, filename: str=None) -> DownloadResult:
+        """
+        Download *url* into the pkgs directory and return a DownloadResult.
+
+        If *sha256* is given, the file is verified while it is written, and
+        ChecksumMismatch is raised if it does not match.  An existing verified file
+        is not downloaded again, and a partial download is resumed.
+        """
+        start = time.perf_counter()
+        filename = filename or os.path.basename(urlsplit(url).path)
+        dest = os.path.join(self.pkgs_dir, filename)
+
+        with self._lock:
+            lock = self._dest_locks.setdefault(dest, threading.Lock())
+        with lock:
+            try:
+                return self._fetch_to(url, sha256, dest, start)
+            except Exception:
+                self._discard()
+                raise
+
+    def _fetch_to(self, url, sha256, dest, start):
+        partial = dest + PARTIAL_SUFFIX
+
+        if sha256 and os.path.isfile(dest) and _hash_file(dest, self.blocksize).hexdigest() == sha256:
+            return DownloadResult(url, dest, 0, time.perf_counter() - start, False, True, None)
+
+        try:
+            offset = os.path.getsize(partial)
+        except OSError:
+            offset = 0
+
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        response = self._request(url, headers)
+
+        if response.status == 416 and offset:
+            # The partial file may already be complete, otherwise start over
+            response.read()
+            h = _hash_file(partial, self.blocksize)
+            if not sha256 or h.hexdigest() == sha256:
+                os.replace(partial, dest)
+                return DownloadResult(url, dest, 0, time.perf_counter() - start, True, False, None)
+            os.remove(partial)
+            offset = 0
+            response = self._request(url, {})
+
+        if response.status == 206 and offset:
+            h = _hash_file(partial, self.blocksize)
+            mode = 'ab'
+        elif response.status == 200:
+            h = hashlib.sha256()
+            offset = 0
+            mode = 'wb'
+        else:
+            response.read()
+            raise DownloadError('{} {} for {}'.format(response.status, response.reason, url))
+
+        transferred = 0
+        buf = bytearray(self.blocksize)
+        view = memoryview(buf)
+        with open(partial, mode) as f:
+            while True:
+                n = response.readinto(buf)
+                if not n:
+                    break
+                block = view[:n]
+                h.update(block)
+                f.write(block)
+                transferred += n
+
+        with self._lock:
+            self.bytes += transferred
+
+        if sha256 and h.hexdigest() != sha256:
+            os.remove(partial)
+            raise ChecksumMismatch('{}: expected sha256 {}, got {}'.format(url, sha256, h.hexdigest()))
+
+        os.replace(partial, dest)
+        with self._lock:
+            self.files += 1
+        return DownloadResult(url, dest, transferred, time.perf_counter() - start, bool(offset), False, None)
+
+    def _fetch(self, url, sha256):
+        try:
+            return self.fetch(url, sha256)
+        except Exception as e:
+            return DownloadResult(url, None, 0, 0.0, False, False, e)
+
+    def download(self, items: Iterable, progress: Callable=None) -> list:
+        """
+        Download (url, sha256) pairs concurrently, as yielded by Repository.fetch_urls.
+
+        *progress* is called with each DownloadResult as it completes.  Errors do not
+        stop the other downloads, they are reported in the error field of the results.
+        """
+        os.makedirs(self.pkgs_dir, exist_ok=True)
+        start = time.perf_counter()
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self._fetch, url, sha256) for url, sha256 in items]
+                for fut in as_completed(futures):
+                    result = fut.result()
+                    results.append(result)
+                    if progress is not None:
+                        progress(result)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.close()
+        return results
+
+    def close(self) -> None:
+        """
+        Close all open connections.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return 'Downloader({}) @ {}'.format(self.pkgs_dir, hex(id(self)))
+
+
+def download_packages(repo, pkgs: Iterable, pkgs_dir: _types.PATH, workers: int=4, progress: Callable=None) -> list:
+    """
+    Download the packages *pkgs* (RepoPackage) of *repo* into *pkgs_dir*.
+    """
+    return Downloader(pkgs_dir, workers=workers).download(repo.fetch_urls(pkgs), progress)
@@ -0,0 +1,11 @@
+class RepositoryException(Exception):
+    pass
+
+class DownloadError(RepositoryException):
+    pass
+
+class ChecksumMismatch(DownloadError):
+    pass
+
+class InvalidSpec(RepositoryException, ValueError):
+    pass
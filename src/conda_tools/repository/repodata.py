@@ -0,0 +1,173 @@
+"""
+Streaming parser for repodata.json.
+
+A repodata.json file is one large JSON object.  Loading it with json.loads needs
+the compressed bytes, the decompressed bytes, the decoded text and the parsed
+dictionaries in memory at the same time.  Here the file is decompressed and
+decoded incrementally, and package records are parsed one at a time, so only
+a small window of text is held in memory besides the parsed records.
+"""
+import re
+import bz2
+import codecs
+from json import JSONDecoder, JSONDecodeError
+from sys import intern
+
+from typing import Iterable, Iterator
+
+CHUNK_SIZE = 256 * 1024
+
+# Top level keys of repodata.json that hold package records
+PACKAGE_SECTIONS = ('packages', 'packages.conda')
+
+_WS = re.compile(r'[ \t\n\r]*')
+# Characters that can continue a number
+_NUMBER_TAIL = frozenset('0123456789.eE+-')
+
+
+def iter_chunks(fileobj, compressed: bool=True, chunk_size: int=CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield the text of *fileobj* in chunks, decompressing bz2 data if *compressed*.
+    """
+    decompressor = bz2.BZ2Decompressor() if compressed else None
+    decoder = codecs.getincrementaldecoder('utf8')()
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        if decompressor is not None:
+            data = decompressor.decompress(data)
+        if data:
+            yield decoder.decode(data)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class _StreamParser(object):
+    """
+    Parse JSON tokens from a stream of text chunks.
+    """
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._decoder = JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Return the next non whitespace character without consuming it.
+        """
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of repodata')
+
+    def expect(self, chars: str) -> str:
+        """
+        Consume the next character, which must be one of *chars*.
+        """
+        c = self.peek()
+        if c not in chars:
+            raise ValueError('Expected {!r} at {!r}'.format(chars, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        Consume and return the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer, or followed by an incomplete
+            # fraction or exponent (1. or 1e), could continue in the next chunk
+            if (end < len(self.buf) and self.buf[end] not in _NUMBER_TAIL) or self.eof or not self._fill():
+                self.pos = end
+                return value
+
+
+def iter_repodata(chunks: Iterable[str]) -> Iterator[tuple]:
+    """
+    Parse the text of a repodata.json file incrementally.
+
+    Yield (section, filename, record) for every package record, where section is
+    one of PACKAGE_SECTIONS, and (None, key, value) for the other top level keys.
+    """
+    p = _StreamParser(chunks)
+    p.expect('{')
+    if p.peek() == '}':
+        return
+    while True:
+        key = p.value()
+        p.expect(':')
+        if key in PACKAGE_SECTIONS and p.peek() == '{':
+            p.expect('{')
+            if p.peek() == '}':
+                p.expect('}')
+            else:
+                while True:
+                    filename = p.value()
+                    p.expect(':')
+                    yield key, filename, p.value()
+                    if p.expect(',}') == '}':
+                        break
+        else:
+            yield None, key, p.value()
+        if p.expect(',}') == '}':
+            break
+
+
+def _compact(record: dict) -> dict:
+    """
+    Intern the strings of a package record that repeat across many records.
+    """
+    for field in ('name', 'license', 'license_family'):
+        v = record.get(field)
+        if isinstance(v, str):
+            record[field] = intern(v)
+    for field in ('depends', 'requires'):
+        v = record.get(field)
+        if v:
+            record[field] = [intern(d) for d in v]
+    return record
+
+
+def load_repodata(fileobj, compressed: bool=True, chunk_size: int=CHUNK_SIZE) -> dict:
+    """
+    Load repodata from *fileobj*, creating a RepoPackage for each package record.
+
+    The result has the same layout as repodata.json, except that the values of
+    `packages` and `packages.conda` are RepoPackage objects.  Fields of the records
+    that RepoPackage does not hold (timestamp, constrains, ...) are dropped.
+    """
+    from .repository import RepoPackage
+
+    data = {'info': {}, 'packages': {}}
+    for section, key, value in iter_repodata(iter_chunks(fileobj, compressed, chunk_size)):
+        if section is None:
+            if key not in PACKAGE_SECTIONS:
+                data[key] = value
+        else:
+            packages = data.get(section)
+            if packages is None:
+                packages = data[section] = {}
+            packages[key] = RepoPackage(key, _compact(value))
+    return data
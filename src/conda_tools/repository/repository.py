@@ -5,6 +5,11 @@ from urllib.request import urlopen
 
 from typing import Generator, Sequence
 
+from ..common import lazyproperty
+from .repodata import load_repodata
+
+REPODATA_NAME = 'repodata.json.bz2'
+
 class RepoPackage:
     PACKAGE_FIELDS = (
     'build', 'build_number', 'date', 'depends', 'requires',
@@ -34,13 +39,51 @@ class RepoPackage:
 
 
 def repo_packages(d:dict) -> set:
-    return set(RepoPackage(*info) for info in d.items())
+    """
+    Return the set of RepoPackage for the package records in *d*.
+
+    Values of *d* can be record dictionaries or RepoPackage objects.
+    """
+    return set(v if isinstance(v, RepoPackage) else RepoPackage(k, v) for k, v in d.items())
 
 class Repository:
-    def __init__(self, url:str, data:dict):
+    def __init__(self, url:str, data:dict, merge_conda:bool=False):
+        """
+        *data* has the layout of repodata.json.  The records of `packages.conda`
+        are kept in conda_packages, and are also added to packages if *merge_conda*.
+        """
         self.url = url
         self.info = data['info']
         self.packages = data['packages']
+        self.conda_packages = data.get('packages.conda', {})
+        if merge_conda and self.conda_packages:
+            self.packages = dict(self.packages)
+            self.packages.update(self.conda_packages)
+
+    @lazyproperty
+    def table(self):
+        """
+        Columnar PackageTable of the packages, see :py:mod:`conda_tools.repository.table`.
+        """
+        from .table import PackageTable
+        return PackageTable.from_packages(self.packages)
+
+    @lazyproperty
+    def search_index(self):
+        """
+        Indexes of the packages by name and build string, see :py:mod:`conda_tools.repository.search`.
+        """
+        from .search import SearchIndex
+        return SearchIndex(v if isinstance(v, RepoPackage) else RepoPackage(k, v)
+                           for k, v in self.packages.items())
+
+    def search(self, spec:str) -> list:
+        """
+        Return the packages matching the conda match spec *spec*, newest first.
+
+        >>> repo.search('numpy >=1.20,<2 py39*')  # doctest: +SKIP
+        """
+        return self.search_index.search(spec)
 
     def __repr__(self):
         return 'Repository({})'.format(self.url)
@@ -53,18 +96,28 @@ class Repository:
     def fetch_urls(self, pkgs:Sequence) -> Generator:
         base_url = self.url
         for p in pkgs:
-            if p in self.packages:
+            if p.filename in self.packages:
                 yield join(base_url, p.filename), p.sha256
 
 
-def get_repo(url:str, platform:str=None) -> Repository:
+def get_repo(url:str, platform:str=None, stream:bool=False, merge_conda:bool=False) -> Repository:
+    """
+    Download and parse the repodata of the channel at *url*.
+
+    By default the whole file is loaded at once and the packages are the record
+    dictionaries of repodata.json.  With stream=True, the repodata is decompressed
+    and parsed incrementally, using much less memory, and the packages are
+    RepoPackage objects, which only hold RepoPackage.PACKAGE_FIELDS.
+    """
     if platform is not None:
         ch_url = join(url, platform)
     else:
         ch_url = url
 
-    x = urlopen(join(ch_url, 'repodata.json.bz2'))
-    x = bz2.decompress(x.read())
+    with urlopen(join(ch_url, REPODATA_NAME)) as x:
+        if stream:
+            return Repository(ch_url, load_repodata(x), merge_conda)
+        x = bz2.decompress(x.read())
 
     repo_json = loads(x.decode('utf8'))
-    return Repository(ch_url, repo_json)
+    return Repository(ch_url, repo_json, merge_conda)
@@ -0,0 +1,412 @@
+"""
+Search repodata with conda match specs.
+
+Supported spec forms:
+
+    numpy
+    numpy 1.20.*
+    numpy >=1.20,<2 py39*
+    numpy=1.20=py39_0
+    numpy==1.20.1
+    numpy >=1.20|<1.10
+    conda-forge::numpy[version='>=1.20', build=py39*, build_number=2]
+
+Versions are ordered following conda's rules (a simplified VersionOrder).
+Compiled specs are cached, and candidates are looked up in indexes by name and
+by build string, so resolving many specs does not scan all records.
+"""
+import re
+from fnmatch import translate
+from operator import eq
+from functools import lru_cache, cmp_to_key, partial
+from collections import namedtuple
+
+from typing import Callable
+
+from .exceptions import InvalidSpec
+
+_SPLIT = re.compile(r'[0-9]+|[^0-9]+')
+_OPERATOR = re.compile(r'^(==|!=|>=|<=|~=|>|<|=)?\s*(\S+)$')
+_BRACKET = re.compile(r'^(.*?)\[(.*)\]\s*$')
+_BRACKET_ITEM = re.compile(r'''(\w+)\s*=\s*(?:'([^']*)'|"([^"]*)"|([^,\s]+))''')
+_NAME = re.compile(r'^([^\s=<>!~]+)\s*(.*)$')
+_OPERATOR_CHARS = '=<>!~'
+_ALNUM = re.compile(r'[0-9A-Za-z]')
+
+# Padding element when comparing versions of different lengths
+_FILL = (1, 0)
+
+
+def _element(e):
+    """
+    Sortable form of a version element: dev < strings < numbers < post.
+    """
+    if e.isdigit():
+        return (1, int(e))
+    elif e == 'dev':
+        return (-1, e)
+    elif e == 'post':
+        return (2, e)
+    return (0, e)
+
+
+def _components(s):
+    comps = []
+    for c in s.replace('_', '.').split('.'):
+        elems = [_element(e) for e in _SPLIT.findall(c)]
+        if not elems or elems[0][0] != 1:
+            # Components starting with a string sort before numbers
+            elems.insert(0, (1, 0))
+        comps.append(elems)
+    return comps
+
+
+def _normalize(comps):
+    result = []
+    for elems in comps:
+        elems = list(elems)
+        while elems and elems[-1] == _FILL:
+            elems.pop()
+        result.append(tuple(elems))
+    while result and not result[-1]:
+        result.pop()
+    return tuple(result)
+
+
+def _compare_elements(ca, cb):
+    for ea, eb in zip(ca, cb):
+        if ea != eb:
+            return -1 if ea < eb else 1
+    if len(ca) == len(cb):
+        return 0
+    rest, sign = (ca[len(cb):], 1) if len(ca) > len(cb) else (cb[len(ca):], -1)
+    for e in rest:
+        if e != _FILL:
+            return sign if e > _FILL else -sign
+    return 0
+
+
+def _compare(a, b):
+    """
+    Compare normalized version components, padding the shorter one with zeros.
+    """
+    for ca, cb in zip(a, b):
+        if ca != cb:
+            return _compare_elements(ca, cb)
+    if len(a) == len(b):
+        return 0
+    rest, sign = (a[len(b):], 1) if len(a) > len(b) else (b[len(a):], -1)
+    for c in rest:
+        r = _compare_elements(c, ())
+        if r:
+            return r * sign
+    return 0
+
+
+class VersionOrder(object):
+    """
+    Comparable conda version.
+
+    This follows the ordering rules of conda: an optional epoch (`1!`), dot or
+    underscore separated components and an optional local version (`+local`).
+    Missing components compare as zero, so 1.0 == 1.0.0, and within a component
+    dev < alpha strings < numbers < post: 1.1dev < 1.1a < 1.1 < 1.1post.
+    """
+    __slots__ = ('version', '_key')
+
+    def __init__(self, version: str):
+        self.version = version
+        v = version.strip().lower().replace('-', '_')
+        epoch, _, rest = v.rpartition('!')
+        main, _, local = rest.partition('+')
+        if not main or '*' in v:
+            raise InvalidSpec('Invalid version: {!r}'.format(version))
+        try:
+            epoch = int(epoch) if epoch else 0
+        except ValueError:
+            raise InvalidSpec('Invalid version epoch: {!r}'.format(version))
+        self._key = (epoch, _normalize(_components(main)), _normalize(_components(local)) if local else ())
+
+    def _cmp(self, other):
+        if self._key[0] != other._key[0]:
+            return -1 if self._key[0] < other._key[0] else 1
+        return _compare(self._key[1], other._key[1]) or _compare(self._key[2], other._key[2])
+
+    def __eq__(self, other):
+        if other.__class__ is self.__class__:
+            return self._key == other._key
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __lt__(self, other):
+        return self._cmp(other) < 0
+
+    def __le__(self, other):
+        return self._cmp(other) <= 0
+
+    def __gt__(self, other):
+        return self._cmp(other) > 0
+
+    def __ge__(self, other):
+        return self._cmp(other) >= 0
+
+    def __repr__(self):
+        return 'VersionOrder({})'.format(self.version)
+
+
+@lru_cache(maxsize=None)
+def version_order(version: str) -> VersionOrder:
+    """
+    Return the (cached) VersionOrder of *version*.
+    """
+    return VersionOrder(version)
+
+
+def _version_key(version):
+    try:
+        return version_order(version)
+    except InvalidSpec:
+        return None
+
+
+def _glob(pattern):
+    return re.compile(translate(pattern)).match
+
+
+def _prefix_match(pattern):
+    """
+    Return a predicate on version strings for a pattern with wildcards.
+    """
+    prefix = pattern.rstrip('*').rstrip('.')
+    if '*' not in prefix:
+        # 1.20.* matches 1.20 and 1.20.1, but not 1.201
+        dotted = prefix + '.'
+        return lambda v: v == prefix or v.startswith(dotted)
+    match = _glob(pattern)
+    return lambda v: match(v) is not None
+
+
+def _constraint(text):
+    """
+    Compile a single version constraint into a predicate on version strings.
+    """
+    m = _OPERATOR.match(text)
+    if m is None:
+        raise InvalidSpec('Invalid version constraint: {!r}'.format(text))
+    op, version = m.groups()
+    # The operator is optional, so '>=' and '>>1' would otherwise parse as '>' with version '=' or '>1'
+    if version[0] in _OPERATOR_CHARS or (version != '*' and _ALNUM.search(version) is None):
+        raise InvalidSpec('Invalid version constraint: {!r}'.format(text))
+
+    if version == '*' and op in (None, '==', '='):
+        return lambda v: True
+    if '*' in version:
+        if op in (None, '==', '='):
+            return _prefix_match(version)
+        elif op == '!=':
+            match = _prefix_match(version)
+            return lambda v: not match(v)
+        # >=1.2.* is the same as >=1.2
+        version = version.rstrip('*').rstrip('.')
+
+    if op == '=':
+        return _prefix_match(version + '.*')
+
+    ref = version_order(version)
+    if op in (None, '=='):
+        return lambda v: _version_key(v) == ref
+    elif op == '!=':
+        return lambda v: _version_key(v) != ref
+    elif op == '~=':
+        # Compatible release: >= version and same prefix up to the last component
+        head = version.rsplit('.', 1)[0]
+        match = _prefix_match(head + '.*')
+        return lambda v: match(v) and _compare_key(v, ref) >= 0
+
+    elif op == '>=':
+        return lambda v: _compare_key(v, ref) >= 0
+    elif op == '>':
+        return lambda v: _compare_key(v, ref) > 0
+    elif op == '<=':
+        return lambda v: -1 <= _compare_key(v, ref) <= 0
+    return lambda v: -1 <= _compare_key(v, ref) < 0
+
+
+def _compare_key(version, ref):
+    """
+    Compare *version* to the VersionOrder *ref*, invalid versions compare as -2 (never match).
+    """
+    key = _version_key(version)
+    if key is None:
+        return -2
+    return key._cmp(ref)
+
+
+@lru_cache(maxsize=4096)
+def compile_version(spec: str) -> Callable:
+    """
+    Compile a version spec into a predicate on version strings.
+
+    `,` (and) binds tighter than `|` (or).  Parentheses are not supported.
+    """
+    spec = re.sub(r'\s*([,|])\s*', r'\1', spec.strip())
+    if '(' in spec or ')' in spec:
+        raise InvalidSpec('Parentheses are not supported: {!r}'.format(spec))
+
+    alternatives = []
+    for group in spec.split('|'):
+        preds = tuple(_constraint(c) for c in group.split(','))
+        if len(preds) == 1:
+            alternatives.append(preds[0])
+        elif len(preds) == 2:
+            p1, p2 = preds
+            alternatives.append(lambda v: p1(v) and p2(v))
+        else:
+            alternatives.append(lambda v, preds=preds: all(p(v) for p in preds))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    alternatives = tuple(alternatives)
+    return lambda v: any(p(v) for p in alternatives)
+
+
+MatchSpec = namedtuple('MatchSpec', ('spec', 'name', 'version', 'build', 'build_number',
+                                     'version_match', 'build_match', 'exact_build'))
+MatchSpec.__doc__ = """
+Parsed match spec.
+
+version_match and build_match are predicates on version and build strings (None matches anything).
+exact_build is True if the spec matches a single build string, *build*.
+"""
+
+
+def _bracket_fields(text):
+    fields = {}
+    for key, q1, q2, bare in _BRACKET_ITEM.findall(text):
+        fields[key] = q1 or q2 or bare
+    return fields
+
+
+@lru_cache(maxsize=4096)
+def parse_spec(spec: str) -> MatchSpec:
+    """
+    Parse and compile a match spec.  The result is cached per spec string.
+    """
+    text = spec.strip()
+    fields = {}
+    m = _BRACKET.match(text)
+    if m is not None:
+        text, fields = m.group(1).strip(), _bracket_fields(m.group(2))
+
+    if '::' in text:
+        text = text.rsplit('::', 1)[1]
+
+    m = _NAME.match(text)
+    if m is None:
+        raise InvalidSpec('Invalid match spec: {!r}'.format(spec))
+    name, rest = m.groups()
+    version = build = None
+
+    if rest.startswith('=') and not rest.startswith('=='):
+        # name=version[=build]
+        parts = rest[1:].split('=', 1)
+        version = parts[0].strip()
+        if len(parts) > 1:
+            build = parts[1].strip()
+        if version and not build and not re.search(r'[*<>!~=,|]', version):
+            # name=1.20 matches 1.20.*, name=1.20=build matches exactly 1.20
+            version += '.*'
+    elif rest:
+        # Operators may be followed by spaces, join them to their version
+        rest = re.sub(r'(==|!=|>=|<=|~=|>|<)\s+', r'\1', rest)
+        rest = re.sub(r'\s*([,|])\s*', r'\1', rest)
+        parts = rest.split()
+        if len(parts) > 2:
+            raise InvalidSpec('Invalid match spec: {!r}'.format(spec))
+        version = parts[0]
+        if len(parts) > 1:
+            build = parts[1]
+
+    version = fields.get('version', version) or None
+    build = fields.get('build', build) or None
+    build_number = fields.get('build_number')
+    if build_number is not None:
+        try:
+            build_number = int(build_number)
+        except ValueError:
+            raise InvalidSpec('Invalid build_number in {!r}'.format(spec))
+
+    version_match = compile_version(version) if version and version != '*' else None
+    exact_build = False
+    if build is None or build == '*':
+        build_match = None
+    elif '*' in build:
+        match = _glob(build)
+        build_match = lambda b: b is not None and match(b) is not None
+    else:
+        build_match = partial(eq, build)
+        exact_build = True
+    return MatchSpec(spec, name, version, build, build_number, version_match, build_match, exact_build)
+
+
+class SearchIndex(object):
+    """
+    Indexes of package records by name and by build string.
+
+    Records of each name are kept sorted from the newest to the oldest version
+    (then build number), and search results keep that order.
+    """
+    def __init__(self, packages):
+        """
+        *packages* is an iterable of RepoPackage.
+        """
+        by_name = {}
+        for p in packages:
+            by_name.setdefault(p.name, []).append(p)
+
+        def newest_first(a, b):
+            ka, kb = _version_key(a.version or ''), _version_key(b.version or '')
+            if ka != kb:
+                if ka is None or kb is None:
+                    return 1 if ka is None else -1
+                return kb._cmp(ka)
+            return (b.build_number or 0) - (a.build_number or 0)
+
+        self.by_name = {n: tuple(sorted(ps, key=cmp_to_key(newest_first))) for n, ps in by_name.items()}
+        by_build = {}
+        for ps in self.by_name.values():
+            for p in ps:
+                by_build.setdefault(p.build, []).append(p)
+        self.by_build = {b: tuple(ps) for b, ps in by_build.items()}
+
+    def search(self, spec) -> list:
+        """
+        Return the records matching the match spec *spec* (a string or a MatchSpec).
+        """
+        if isinstance(spec, str):
+            spec = parse_spec(spec)
+
+        if spec.name == '*':
+            if spec.exact_build:
+                candidates = self.by_build.get(spec.build, ())
+            else:
+                candidates = [p for ps in self.by_name.values() for p in ps]
+        else:
+            candidates = self.by_name.get(spec.name, ())
+
+        version_match, build_match = spec.version_match, spec.build_match
+        build_number = spec.build_number
+        result = []
+        for p in candidates:
+            if build_number is not None and p.build_number != build_number:
+                continue
+            if build_match is not None and not build_match(p.build):
+                continue
+            if version_match is not None and not version_match(p.version or ''):
+                continue
+            result.append(p)
+        return result
+
+    def __repr__(self):
+        return 'SearchIndex({} names) @ {}'.format(len(self.by_name), hex(id(self)))
@@ -0,0 +1,283 @@
+"""
+Columnar storage of repodata package records.
+
+A PackageTable stores each field of RepoPackage.PACKAGE_FIELDS in its own column.
+String fields are pooled: every distinct value is stored once and rows hold
+integer codes into the pool, in a compact :py:mod:`array`.  Filters compare
+codes instead of strings, and predicates are evaluated once per distinct value
+instead of once per row.  NumPy is used for the scans if it is installed.
+"""
+import sys
+from array import array
+from operator import eq
+from functools import partial
+from itertools import compress
+
+from typing import Callable, Iterable, Iterator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .repository import RepoPackage
+
+# Fields stored as integers, None is stored as MISSING
+INT_FIELDS = ('build_number', 'size')
+# Fields holding lists of strings, stored as pooled tuples
+LIST_FIELDS = ('depends', 'requires')
+# Fields unique to each record, pooling them would only add overhead
+UNIQUE_FIELDS = ('filename', 'md5', 'sha256')
+MISSING = -1
+
+
+class _Pool(object):
+    """
+    Pool of distinct values, each identified by an integer code.
+    """
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def add(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class PackageTable(object):
+    """
+    Columnar table of package records.
+
+    >>> table = PackageTable.from_packages(repo.packages)  # doctest: +SKIP
+    >>> [p.filename for p in table.rows(table.where(name='numpy'))]  # doctest: +SKIP
+    """
+    FIELDS = ('filename',) + RepoPackage.PACKAGE_FIELDS
+
+    def __init__(self):
+        self._len = 0
+        self._pools = {}
+        self._columns = {}
+        for field in self.FIELDS:
+            if field in INT_FIELDS:
+                self._columns[field] = array('q')
+            elif field in UNIQUE_FIELDS:
+                self._columns[field] = []
+            else:
+                self._pools[field] = _Pool()
+                self._columns[field] = array('l')
+        self._name_index = None
+
+    @classmethod
+    def from_packages(cls, packages) -> 'PackageTable':
+        """
+        Build a table from a dictionary of filename to records (dictionaries or RepoPackage),
+        or from an iterable of RepoPackage.
+        """
+        table = cls()
+        if isinstance(packages, dict):
+            items = packages.items()
+        else:
+            items = ((p.filename, p) for p in packages)
+        for filename, record in items:
+            table.append(filename, record)
+        return table
+
+    def append(self, filename: str, record) -> int:
+        """
+        Append a record (dictionary or RepoPackage) and return its row number.
+        """
+        if isinstance(record, RepoPackage):
+            get = record.__getattribute__
+        else:
+            get = record.get
+
+        for field in self.FIELDS:
+            value = filename if field == 'filename' else get(field)
+            if field in INT_FIELDS:
+                self._columns[field].append(MISSING if value is None else int(value))
+            elif field in UNIQUE_FIELDS:
+                self._columns[field].append(value)
+            else:
+                if field in LIST_FIELDS and value is not None:
+                    value = tuple(value)
+                self._columns[field].append(self._pools[field].add(value))
+        self._name_index = None
+        self._len += 1
+        return self._len - 1
+
+    def __len__(self):
+        return self._len
+
+    def _value(self, field, i):
+        v = self._columns[field][i]
+        if field in INT_FIELDS:
+            return None if v == MISSING else v
+        elif field in UNIQUE_FIELDS:
+            return v
+        v = self._pools[field].values[v]
+        if field in LIST_FIELDS and v is not None:
+            return list(v)
+        return v
+
+    def column(self, field: str) -> list:
+        """
+        Return the values of *field* for all rows.
+        """
+        col = self._columns[field]
+        if field in INT_FIELDS:
+            return [None if v == MISSING else v for v in col]
+        elif field in UNIQUE_FIELDS:
+            return list(col)
+        return [self._value(field, i) for i in range(self._len)] if field in LIST_FIELDS \
+            else list(map(self._pools[field].values.__getitem__, col))
+
+    def distinct(self, field: str) -> list:
+        """
+        Return the distinct values of *field*.
+        """
+        if field not in self._pools:
+            return sorted(set(self.column(field)), key=lambda v: (v is None, v))
+        return list(self._pools[field].values)
+
+    def row(self, i: int) -> dict:
+        """
+        Return row *i* as a dictionary.
+        """
+        return {f: self._value(f, i) for f in self.FIELDS}
+
+    def __getitem__(self, i: int) -> RepoPackage:
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('row out of range')
+        row = self.row(i)
+        return RepoPackage(row['filename'], row)
+
+    def rows(self, indices: Iterable[int]) -> Iterator[RepoPackage]:
+        """
+        Yield a RepoPackage for each of the row *indices*.
+        """
+        for i in indices:
+            yield self[i]
+
+    def __iter__(self) -> Iterator[RepoPackage]:
+        return self.rows(range(self._len))
+
+    @property
+    def name_index(self) -> dict:
+        """
+        Dictionary mapping each package name to the array of its row numbers.
+        """
+        if self._name_index is None:
+            names = self._pools['name'].values
+            index = {}
+            for i, code in enumerate(self._columns['name']):
+                rows = index.get(code)
+                if rows is None:
+                    rows = index[code] = array('l')
+                rows.append(i)
+            self._name_index = {names[c]: rows for c, rows in index.items()}
+        return self._name_index
+
+    def _match_codes(self, field, codes):
+        """
+        Return the sorted rows whose code in *field* is one of *codes*.
+        """
+        col = self._columns[field]
+        if not codes:
+            return array('l')
+        if np is not None:
+            data = np.frombuffer(col, dtype=col.typecode)
+            if len(codes) == 1:
+                mask = data == next(iter(codes))
+            else:
+                mask = np.isin(data, np.fromiter(codes, dtype=data.dtype))
+            return array('l', np.flatnonzero(mask).tolist())
+        if len(codes) == 1:
+            test = partial(eq, next(iter(codes)))
+        else:
+            test = frozenset(codes).__contains__
+        return array('l', compress(range(self._len), map(test, col)))
+
+    def where(self, **conditions) -> array:
+        """
+        Return the rows (sorted) where every field equals the given value.
+
+        The name condition is answered from the name index.
+        """
+        rows = None
+        if 'name' in conditions:
+            rows = array('l', self.name_index.get(conditions.pop('name'), ()))
+
+        for field, value in conditions.items():
+            if field in INT_FIELDS:
+                # partial(eq) rather than value.__eq__, which returns NotImplemented (truthy) for other types
+                selected = self.filter(field, partial(eq, MISSING if value is None else value))
+            elif field in UNIQUE_FIELDS:
+                selected = self.filter(field, lambda v: v == value)
+            else:
+                if field in LIST_FIELDS and value is not None:
+                    value = tuple(value)
+                code = self._pools[field].codes.get(value)
+                selected = self._match_codes(field, () if code is None else (code,))
+            rows = selected if rows is None else _intersect(rows, selected)
+
+        if rows is None:
+            return array('l', range(self._len))
+        return rows
+
+    def filter(self, field: str, predicate: Callable, rows: Iterable[int]=None) -> array:
+        """
+        Return the rows (sorted) where *predicate* is true for the value of *field*.
+
+        For pooled fields the predicate is called once per distinct value.
+        Integer fields are passed MISSING for None.  Fields unique to each
+        record (filename, md5, sha256) are not pooled, and the predicate is
+        called for every row.  If *rows* are given, only those rows are considered.
+        """
+        col = self._columns[field]
+        if field not in self._pools:
+            if rows is None:
+                return array('l', compress(range(self._len), map(predicate, col)))
+            return array('l', (i for i in rows if predicate(col[i])))
+
+        values = self._pools[field].values
+        codes = {c for c, v in enumerate(values) if predicate(v)}
+        if rows is None:
+            return self._match_codes(field, codes)
+        return array('l', (i for i in rows if col[i] in codes))
+
+    def memory(self) -> int:
+        """
+        Return an estimate in bytes of the memory held by the columns and pools.
+        """
+        total = 0
+        for field, col in self._columns.items():
+            total += sys.getsizeof(col)
+            if field in UNIQUE_FIELDS:
+                total += sum(sys.getsizeof(v) for v in col)
+        for pool in self._pools.values():
+            total += sys.getsizeof(pool.values) + sys.getsizeof(pool.codes)
+            total += sum(sys.getsizeof(v) for v in pool.values)
+        return total
+
+    def __repr__(self):
+        return 'PackageTable({} rows) @ {}'.format(self._len, hex(id(self)))
+
+
+def _intersect(a, b) -> array:
+    """
+    Intersect two sorted arrays of row numbers.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    s = frozenset(b)
+    return array('l', (i for i in a if i in s))
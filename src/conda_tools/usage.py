@@ -0,0 +1,126 @@
+"""
+Hardlink aware disk usage of a package cache and its environments.
+
+Most files in an environment are hardlinks into the package cache, so adding up
+the sizes of the files in an environment vastly overstates what it costs.
+Here every inode is counted exactly once and its bytes are attributed to the
+environment alone, or as shared with the cache or with other environments.
+"""
+from os.path import realpath
+from collections import namedtuple
+
+from .utils import InodeIndex, _is_under
+
+Usage = namedtuple('Usage', ('unique', 'shared_with_cache', 'shared_across_envs', 'files'))
+Usage.__doc__ = """
+Bytes on disk of a single root.
+
+unique: bytes of inodes only found under this root.
+shared_with_cache: bytes of inodes that are also in the package cache.
+shared_across_envs: bytes of inodes that are also in other environments, but not in the cache.
+files: number of distinct inodes under this root.
+"""
+
+
+class DiskUsage(object):
+    """
+    Disk usage of a package cache and a set of environments.
+
+    The cache and the environments are walked once by :py:meth:`refresh`.
+    Later refreshes only list again the directories whose mtime changed.
+    Sizes are the space allocated on disk (st_blocks), or the file size where
+    the platform does not report blocks.
+    """
+    def __init__(self, cache, environments, workers=None):
+        """
+        *environments* can be paths or Environment objects.
+        """
+        self.cache = realpath(str(cache))
+        self.environments = tuple(realpath(str(getattr(e, 'path', e))) for e in environments)
+        self.workers = workers
+
+        # Environments often contain the cache or other environments (the root env).
+        # Each directory is only accounted to the innermost root containing it.
+        roots = (self.cache,) + self.environments
+        self._indexes = {r: InodeIndex(r, exclude=[o for o in roots if _is_under(o, r)])
+                         for r in roots}
+        self._inodes = None
+        self._owners = None
+
+    def refresh(self) -> int:
+        """
+        Rescan the cache and environments.
+
+        Return the number of directories that were listed again.
+        """
+        rescanned = sum(idx.refresh(self.workers) for idx in self._indexes.values())
+        if rescanned or self._inodes is None:
+            self._owners = None
+            self._inodes = {r: idx.inodes() for r, idx in self._indexes.items()}
+        return rescanned
+
+    def _ownership(self):
+        """
+        Return a dictionary mapping each inode to the set of roots containing it.
+        """
+        if self._owners is None:
+            if self._inodes is None:
+                self.refresh()
+            owners = {}
+            for root, inodes in self._inodes.items():
+                for key in inodes:
+                    s = owners.get(key)
+                    if s is None:
+                        owners[key] = s = set()
+                    s.add(root)
+            self._owners = owners
+        return self._owners
+
+    def _usage(self, root) -> Usage:
+        owners = self._ownership()
+        unique = with_cache = across = 0
+        inodes = self._inodes[root]
+        for key, size in inodes.items():
+            roots = owners[key]
+            if len(roots) == 1:
+                unique += size
+            elif root != self.cache and self.cache in roots:
+                with_cache += size
+            else:
+                across += size
+        return Usage(unique, with_cache, across, len(inodes))
+
+    def environment(self, env) -> Usage:
+        """
+        Return the Usage of a single environment.
+        """
+        return self._usage(realpath(str(getattr(env, 'path', env))))
+
+    def report(self) -> dict:
+        """
+        Return a dictionary mapping every environment path to its Usage.
+        """
+        return {e: self._usage(e) for e in self.environments}
+
+    def cache_usage(self) -> Usage:
+        """
+        Return the Usage of the package cache.
+
+        The unique bytes are not linked into any of the environments, and could be
+        reclaimed by removing the unused packages.  Bytes linked into environments
+        are reported as shared_across_envs.
+        """
+        return self._usage(self.cache)
+
+    def total(self) -> int:
+        """
+        Return the bytes used by the cache and the environments together.
+        """
+        self._ownership()
+        seen = {}
+        for inodes in self._inodes.values():
+            seen.update(inodes)
+        return sum(seen.values())
+
+    def __repr__(self):
+        return 'DiskUsage({}, {} environments) @ {}'.format(self.cache, len(self.environments), hex(id(self)))
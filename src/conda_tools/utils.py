@@ -4,18 +4,174 @@ import stat
 import io
 import platform
 from collections import defaultdict
-from os.path import exists, join
-from os import lstat, error, walk
+from os.path import exists, join, realpath
+from os import lstat, error, walk, scandir, sep
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def index_inodes(root):
+def scan_tree(root, workers=None, exclude=()):
+    """
+    Yield (path, stat_result) for every non-directory entry under root.
+
+    Directories are listed with os.scandir by a pool of *workers* threads, so that
+    many directories are read concurrently.  Entries are stat'ed without following
+    symbolic links.  The order of the results is not defined.
+    Directories whose path (joined from root) is in *exclude* are not scanned.
+    """
+    def scan(directory):
+        entries, subdirs = [], []
+        try:
+            with scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in exclude:
+                            subdirs.append(entry.path)
+                    else:
+                        try:
+                            entries.append((entry.path, entry.stat(follow_symlinks=False)))
+                        except FileNotFoundError:
+                            continue
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            pass
+        return entries, subdirs
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                entries, subdirs = fut.result()
+                pending.update(executor.submit(scan, d) for d in subdirs)
+                for entry in entries:
+                    yield entry
+
+def _is_under(path, root):
+    return path != root and path.startswith(root.rstrip(sep) + sep)
+
+def inode_map(root, workers=None, exclude=()):
+    """
+    Map the path of every file under root, relative to root, to its (st_dev, st_ino) pair.
+
+    Directories in *exclude* are not scanned.
+    """
+    if exclude:
+        root = realpath(root)
+        exclude = frozenset(realpath(d) for d in exclude)
+    start = len(root.rstrip(sep)) + 1
+    return {path[start:].replace(sep, '/'): (st.st_dev, st.st_ino)
+            for path, st in scan_tree(root, workers=workers, exclude=exclude)}
+
+def index_inodes(root, workers=None):
+    """
+    Map each (st_dev, st_ino) pair under root to the list of paths that share it.
+
+    If workers is given, directories are scanned concurrently with :py:func:`scan_tree`.
+    """
     index = defaultdict(list)
-    for root, dirs, files in walk(root):
-        for f in files:
-            path = join(root, f)
-            fstat = lstat(path)
+    if workers is None:
+        for root, dirs, files in walk(root):
+            for f in files:
+                path = join(root, f)
+                fstat = lstat(path)
+                index[(fstat.st_dev, fstat.st_ino)].append(path)
+    else:
+        for path, fstat in scan_tree(root, workers=workers):
             index[(fstat.st_dev, fstat.st_ino)].append(path)
     return dict(index)
 
+class InodeIndex(object):
+    """
+    Incrementally maintained index of the inodes under a directory tree.
+
+    The first :py:meth:`refresh` lists every directory.  Later refreshes only list
+    the directories whose mtime changed, all other directories are reused from the
+    previous scan (one stat per directory instead of one per file).
+    Changes to the size of existing files are not detected, since they do not change
+    the mtime of their directory.
+
+    Directories in *exclude* (absolute paths) are not scanned, which is useful for
+    environments that contain other environments or package caches.
+    """
+    def __init__(self, root, exclude=()):
+        self.root = realpath(root)
+        self.exclude = frozenset(realpath(d) for d in exclude)
+        # directory -> (mtime, {name: (st_dev, st_ino, bytes)}, subdirectories)
+        self._dirs = {}
+
+    def _scan(self, directory):
+        try:
+            mtime = lstat(directory).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return directory, None
+
+        old = self._dirs.get(directory)
+        if old is not None and old[0] == mtime:
+            return directory, old
+
+        files, subdirs = {}, []
+        try:
+            with scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self.exclude:
+                            subdirs.append(entry.path)
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    files[entry.name] = (st.st_dev, st.st_ino, _disk_bytes(st))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return directory, None
+        return directory, (mtime, files, tuple(subdirs))
+
+    def refresh(self, workers=None) -> int:
+        """
+        Bring the index up to date with the filesystem.
+
+        Return the number of directories that were listed again.
+        """
+        dirs = {}
+        rescanned = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(self._scan, self.root)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    directory, state = fut.result()
+                    if state is None:
+                        continue
+                    if self._dirs.get(directory) is not state:
+                        rescanned += 1
+                    dirs[directory] = state
+                    pending.update(executor.submit(self._scan, d) for d in state[2])
+        self._dirs = dirs
+        return rescanned
+
+    def inodes(self) -> dict:
+        """
+        Map each (st_dev, st_ino) pair to its size on disk in bytes.
+        """
+        return {(dev, ino): size
+                for _, files, _ in self._dirs.values()
+                for dev, ino, size in files.values()}
+
+    def index(self) -> dict:
+        """
+        Return the same mapping as :py:func:`index_inodes`.
+        """
+        index = defaultdict(list)
+        for directory, (_, files, _) in self._dirs.items():
+            for name, (dev, ino, _) in files.items():
+                index[(dev, ino)].append(join(directory, name))
+        return dict(index)
+
+def _disk_bytes(st):
+    """
+    Return the space allocated on disk for a stat result, falling back to the file size.
+    """
+    blocks = getattr(st, 'st_blocks', None)
+    return st.st_size if blocks is None else blocks * 512
+
 def is_hardlinked(f1, f2):
     """
     Determine if two files are hardlinks to the same inode.
@@ -23,7 +179,7 @@ def is_hardlinked(f1, f2):
     try:
         s, d = lstat(f1), lstat(f2)
         return s.st_ino == d.st_ino and s.st_dev == d.st_dev
-    except:
+    except OSError:
         return False
 
 def is_executable(mode):
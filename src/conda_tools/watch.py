@@ -0,0 +1,309 @@
+"""
+Live invalidation of Environment and Package objects on Linux.
+
+Environment and Package objects cache what they read from disk.  A long running
+process can register them with a :py:class:`Watcher`, which subscribes to
+`conda-meta/` and the package cache through inotify and invalidates only the
+cached data affected by each change.
+
+This module only works on Linux, where inotify is available from libc.
+"""
+import os
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+from collections import defaultdict
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Events that mean the contents of a directory changed
+_DIR_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        if not hasattr(os, 'O_CLOEXEC') or not os.uname().sysname == 'Linux':
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def _check(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+class Watcher(object):
+    """
+    Invalidate cached data of Environments and Packages when their files change.
+
+    Register objects with :py:meth:`watch_environment` and :py:meth:`watch_package`,
+    then either call :py:meth:`poll` from an event loop or :py:meth:`start` a
+    background thread.  Invalidation happens in the thread processing the events.
+
+        Environment         conda-meta/*.json  ->  Environment.invalidate()
+                            conda-meta/history ->  History.update()
+        Package             info/<file>        ->  Package.invalidate(<file>)
+                            package directory removed or replaced -> Package.invalidate()
+    """
+    def __init__(self):
+        libc = _inotify()
+        self._libc = libc
+        self._fd = _check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self._lock = threading.RLock()
+        # wd -> path, path -> wd
+        self._paths = {}
+        self._wds = {}
+        # watched directory -> objects to invalidate
+        self._environments = defaultdict(list)
+        self._infos = defaultdict(list)
+        # package cache directory -> package directory name -> packages
+        self._packages = defaultdict(dict)
+        # package directory without info/ yet -> packages
+        self._pending = defaultdict(list)
+        self._thread = None
+        self._stop = threading.Event()
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def _add_watch(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self._wds:
+                wd = _check(self._libc.inotify_add_watch(self._fd, os.fsencode(path), _DIR_MASK))
+                self._wds[path] = wd
+                self._paths[wd] = path
+        return path
+
+    def watch_environment(self, env) -> None:
+        """
+        Invalidate the records and history of *env* when conda-meta changes.
+        """
+        path = self._add_watch(os.path.join(env.path, 'conda-meta'))
+        with self._lock:
+            if env not in self._environments[path]:
+                self._environments[path].append(env)
+
+    def watch_package(self, package) -> None:
+        """
+        Invalidate the cached metadata of *package* when its `info/` files change.
+
+        The package cache directory is also watched, to catch packages being
+        removed or extracted again.  A package directory without `info/` (ie. while
+        it is being extracted) is watched until `info/` is created.
+        """
+        root = str(package.path)
+        cache = self._add_watch(os.path.dirname(root))
+        with self._lock:
+            named = self._packages[cache].setdefault(package.path.name, [])
+            if package not in named:
+                named.append(package)
+        try:
+            info = self._add_watch(os.path.join(root, 'info'))
+        except (FileNotFoundError, NotADirectoryError):
+            root = self._add_watch(root)
+            with self._lock:
+                if package not in self._pending[root]:
+                    self._pending[root].append(package)
+            if os.path.isdir(os.path.join(root, 'info')):
+                # Created before the watch was added
+                self._info_created(root)
+            return
+        with self._lock:
+            if package not in self._infos[info]:
+                self._infos[info].append(package)
+
+    def watch_packages(self, packages) -> None:
+        for p in packages:
+            self.watch_package(p)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, i)
+            i += _EVENT.size
+            name = data[i:i + length].rstrip(b'\0')
+            i += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def _overflow(self):
+        """
+        Invalidate everything, events were dropped by the kernel.
+        """
+        with self._lock:
+            environments = [e for envs in self._environments.values() for e in envs]
+            packages = {id(p): p for pkgs in self._infos.values() for p in pkgs}
+            packages.update((id(p), p) for named in self._packages.values()
+                            for pkgs in named.values() for p in pkgs)
+            pending = list(self._pending)
+        for env in environments:
+            env.invalidate()
+            if env.history._loaded:
+                env.history.update()
+        for pkg in packages.values():
+            pkg.invalidate()
+        for root in pending:
+            if os.path.isdir(os.path.join(root, 'info')):
+                self._info_created(root)
+
+    def _remove_watch(self, path):
+        with self._lock:
+            wd = self._wds.pop(path, None)
+            if wd is not None:
+                del self._paths[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _info_created(self, root):
+        """
+        Watch the new `info/` directory of the packages waiting on *root*.
+        """
+        with self._lock:
+            packages = self._pending.pop(root, ())
+        if not packages:
+            return
+        self._remove_watch(root)
+        for pkg in packages:
+            pkg.invalidate()
+            try:
+                self.watch_package(pkg)
+            except OSError:
+                pass
+
+    def _dispatch(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._overflow()
+            return
+        with self._lock:
+            path = self._paths.get(wd)
+            if path is None:
+                return
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # The watched directory is gone, drop the watch and invalidate everything
+                del self._paths[wd]
+                del self._wds[path]
+                if not mask & IN_IGNORED:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                for env in self._environments.pop(path, ()):
+                    env.invalidate()
+                    if env.history._loaded:
+                        env.history.update()
+                for pkg in self._infos.pop(path, ()):
+                    pkg.invalidate()
+                for pkg in self._pending.pop(path, ()):
+                    pkg.invalidate()
+                for pkgs in self._packages.pop(path, {}).values():
+                    for pkg in pkgs:
+                        pkg.invalidate()
+                return
+            environments = list(self._environments.get(path, ()))
+            infos = list(self._infos.get(path, ()))
+            packages = list(self._packages[path].get(name, ())) if path in self._packages else ()
+            pending = path in self._pending
+
+        if pending and name == 'info' and mask & (IN_CREATE | IN_MOVED_TO):
+            self._info_created(path)
+            return
+
+        for env in environments:
+            if name == 'history':
+                if env.history._loaded:
+                    env.history.update()
+            elif name.endswith('.json'):
+                env.invalidate()
+
+        for pkg in infos:
+            pkg.invalidate(name)
+
+        for pkg in packages:
+            pkg.invalidate()
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Extracted again, watch the new info/ directory, or the package
+                # directory until info/ exists
+                try:
+                    self.watch_package(pkg)
+                except OSError:
+                    pass
+
+    def poll(self, timeout: float=0) -> int:
+        """
+        Process pending events, waiting up to *timeout* seconds (None waits forever).
+
+        Return the number of events processed.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return 0
+        events = self._read_events()
+        for event in events:
+            self._dispatch(*event)
+        return len(events)
+
+    def start(self) -> threading.Thread:
+        """
+        Process events in a daemon thread until :py:meth:`stop` is called.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='conda-tools-watcher', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll(0.5)
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def close(self) -> None:
+        self.stop()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return 'Watcher({} directories) @ {}'.format(len(self._wds), hex(id(self)))
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+
+def _make_package(cache, name, version='1.0', build='0', files=None, has_prefix=None, index=None):
+    """
+    Create an extracted package in *cache* and return its path.
+
+    *files* defaults to lib/<name>.txt, every file is created with its path as content.
+    An existing package is updated in place.
+    """
+    path = os.path.join(str(cache), '{}-{}-{}'.format(name, version, build))
+    info = os.path.join(path, 'info')
+    os.makedirs(info, exist_ok=True)
+    if files is None:
+        files = ['lib/{}.txt'.format(name)]
+    record = {'name': name, 'version': version, 'build': build, 'build_number': 0}
+    record.update(index or {})
+    with open(os.path.join(info, 'index.json'), 'w') as f:
+        json.dump(record, f)
+    with open(os.path.join(info, 'files'), 'w') as f:
+        f.write(''.join(fn + '\n' for fn in files))
+    for fn in files:
+        target = os.path.join(path, fn)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w') as f:
+            f.write(fn)
+    if has_prefix is not None:
+        with open(os.path.join(info, 'has_prefix'), 'w') as f:
+            f.write(has_prefix)
+    return path
+
+
+def _link_package(prefix, pkg, files=None, link=True, hardlink=True):
+    """
+    Link the package at *pkg* into the environment at *prefix* and write its conda-meta record.
+
+    *files* defaults to all files of the package.  Files are hardlinked if *hardlink*,
+    and the record only has a link source if *link*.
+    """
+    prefix, pkg = str(prefix), str(pkg)
+    meta = os.path.join(prefix, 'conda-meta')
+    os.makedirs(meta, exist_ok=True)
+    if files is None:
+        with open(os.path.join(pkg, 'info', 'files')) as f:
+            files = [x.strip() for x in f if x.strip()]
+    for fn in files:
+        if hardlink:
+            os.makedirs(os.path.dirname(os.path.join(prefix, fn)), exist_ok=True)
+            os.link(os.path.join(pkg, fn), os.path.join(prefix, fn))
+    dirname = os.path.basename(pkg)
+    name, version, build = dirname.rsplit('-', 2)
+    record = {'name': name, 'version': version, 'build': build, 'files': files}
+    if link:
+        record['link'] = {'source': os.path.realpath(pkg), 'type': 1}
+    with open(os.path.join(meta, dirname + '.json'), 'w') as f:
+        json.dump(record, f)
+    return os.path.join(meta, dirname + '.json')
+
+
+@pytest.fixture
+def make_package():
+    return _make_package
+
+
+@pytest.fixture
+def link_package():
+    return _link_package
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive HTTP/1.1 handler serving server.files, with ETag, Range and redirect support.
+
+    /redir/<path> redirects to /<path>.  Paths in server.slow send half of their
+    body, then stall.  Requests are recorded as (path, headers) in server.requests.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _empty(self, status, **headers):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers))
+        if self.path.startswith('/redir/'):
+            return self._empty(302, Location='/' + self.path[len('/redir/'):])
+        body = server.files.get(self.path)
+        if body is None:
+            return self._empty(404)
+
+        if self.path in server.slow:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            time.sleep(1.5)
+            self.close_connection = True
+            return
+
+        etag = server.etags.get(self.path)
+        if etag is not None and server.conditional and self.headers.get('If-None-Match') == etag:
+            return self._empty(304)
+
+        rng = self.headers.get('Range')
+        start = int(rng.split('=')[1].rstrip('-')) if rng else 0
+        if start >= len(body) and start:
+            return self._empty(416)
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+
+@pytest.fixture
+def http_server():
+    """
+    A local HTTP server serving the bytes in httpd.files, with its base url in httpd.url.
+    """
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    httpd.daemon_threads = True
+    httpd.files = {}
+    httpd.etags = {}
+    httpd.slow = set()
+    httpd.conditional = True
+    httpd.requests = []
+    httpd.url = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
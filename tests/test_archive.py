@@ -0,0 +1,119 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from conda_tools.cache import archive
+from conda_tools.cache.archive import PackageArchive, MemberIndex
+
+zstandard = pytest.importorskip('zstandard')
+
+INFO = {
+    'info/index.json': b'{"name": "pkg"}',
+    'info/recipe/meta.yaml': b'package: {name: pkg}',
+}
+PAYLOAD = {
+    'lib/a.txt': b'a',
+    'lib/sub/b.txt': b'b',
+    'bin/c': b'c',
+}
+
+
+def tar_bytes(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name, data in members.items():
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            tar.addfile(ti, io.BytesIO(data))
+    return buf.getvalue()
+
+
+@pytest.fixture
+def conda_archive(tmp_path):
+    path = str(tmp_path / 'pkg-1.0-0.conda')
+    compress = zstandard.ZstdCompressor().compress
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('metadata.json', '{"conda_pkg_format_version": 2}')
+        zf.writestr('pkg-pkg-1.0-0.tar.zst', compress(tar_bytes(PAYLOAD)))
+        zf.writestr('info-pkg-1.0-0.tar.zst', compress(tar_bytes(INFO)))
+    return path
+
+
+@pytest.fixture
+def bz2_archive(tmp_path):
+    path = str(tmp_path / 'pkg-1.0-0.tar.bz2')
+    with open(path, 'wb') as f, tarfile.open(fileobj=f, mode='w:bz2') as tar:
+        for name, data in dict(INFO, **PAYLOAD).items():
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            tar.addfile(ti, io.BytesIO(data))
+    return path
+
+
+def test_conda_info_only(conda_archive):
+    pa = PackageArchive(conda_archive)
+    assert [m.name for m in pa.info()] == sorted(INFO)
+    assert [m.name for m in pa.recipe()] == ['info/recipe/meta.yaml']
+    (member,) = pa.get_member('info/index.json')
+    assert [f.read() for f in pa.extract(member, None)] == [INFO['info/index.json']]
+    # The payload was never decompressed
+    assert pa._tarfile is None and pa._tempfiles == []
+    pa.close()
+
+
+def test_conda_payload(conda_archive, tmp_path):
+    pa = PackageArchive(conda_archive)
+    assert sorted(m.name for m in pa.files()) == sorted(dict(INFO, **PAYLOAD))
+    (member,) = pa.get_member('lib/sub/b.txt')
+    assert [f.read() for f in pa.extract(member, None)] == [b'b']
+
+    dest = str(tmp_path / 'dest')
+    os.mkdir(dest)
+    found = pa.get_members(['lib/*', 'info/index.json'])
+    # Members of both tarballs are extracted together
+    list(pa.extract(found['lib/*'] + found['info/index.json'], dest))
+    for name in ('lib/a.txt', 'lib/sub/b.txt', 'info/index.json'):
+        with open(os.path.join(dest, name), 'rb') as f:
+            assert f.read() == dict(INFO, **PAYLOAD)[name]
+
+    (tmp,) = pa._tempfiles
+    assert os.path.exists(tmp)
+    pa.close()
+    assert not os.path.exists(tmp)
+
+
+def test_member_index():
+    members = []
+    for name in ('lib/a.txt', 'lib/sub/b.txt', 'lib/sub/c.py', 'libx/d.txt', 'bin/e'):
+        members.append(tarfile.TarInfo(name))
+    index = MemberIndex(members)
+
+    assert len(index) == 5
+    assert 'lib/a.txt' in index and 'lib' not in index
+    names = lambda found: [m.name for m in found]
+    assert names(index.prefix('lib/')) == ['lib/a.txt', 'lib/sub/b.txt', 'lib/sub/c.py']
+    assert names(index.prefix('lib')) == ['lib/a.txt', 'lib/sub/b.txt', 'lib/sub/c.py', 'libx/d.txt']
+    assert names(index.children('lib/sub/')) == ['lib/sub/b.txt', 'lib/sub/c.py']
+    assert names(index.children('')) == []
+    assert names(index.match('lib/sub/*.py')) == ['lib/sub/c.py']
+    assert names(index.match('lib*/[ad].txt')) == ['lib/a.txt', 'libx/d.txt']
+    assert names(index.match('bin/e')) == ['bin/e']
+    assert index.match('bin/f') == ()
+
+
+def test_member_index_shared(bz2_archive, monkeypatch):
+    monkeypatch.setattr(archive, '_MEMBER_INDEXES', type(archive._MEMBER_INDEXES)())
+    first, second = PackageArchive(bz2_archive), PackageArchive(bz2_archive)
+    assert first._member_index() is second._member_index()
+
+    # An archive opened in another mode has its own index
+    indexed = PackageArchive(bz2_archive, random_access=True)
+    assert indexed._member_index() is not first._member_index()
+    (member,) = indexed.get_member('lib/a.txt')
+    assert [f.read() for f in indexed.extract(member, None)] == [b'a']
+    assert len(archive._MEMBER_INDEXES) == 2
+    for pa in (first, second, indexed):
+        pa.close()
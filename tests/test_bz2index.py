@@ -0,0 +1,146 @@
+import io
+import os
+import bz2
+import random
+import tarfile
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from conda_tools.cache import bz2index
+from conda_tools.cache import archive as archive_module
+from conda_tools.cache.bz2index import BZ2Index, INDEX_SUFFIX
+from conda_tools.cache.archive import PackageArchive
+
+# Mostly incompressible data, so the archive spans several bz2 blocks
+rng = random.Random(0)
+MEMBERS = {
+    'info/index.json': b'{"name": "pkg"}',
+    'lib/big.bin': rng.randbytes(250 * 1024),
+    'lib/small.txt': b'small\n' * 10,
+    'share/other.bin': rng.randbytes(120 * 1024),
+}
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / 'pkg-1.0-0.tar.bz2')
+    with tarfile.open(path, 'w:bz2', compresslevel=1) as tar:
+        for name, data in MEMBERS.items():
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            tar.addfile(ti, io.BytesIO(data))
+    return path
+
+
+def read_members(index):
+    with index.open() as f, tarfile.TarFile(fileobj=f, mode='r') as tar:
+        return {ti.name: tar.extractfile(ti).read() for ti in index.tarinfos()}
+
+
+def test_build(archive):
+    index = BZ2Index.build(archive)
+    assert len(index.blocks) > 2
+    assert [m['name'] for m in index.members] == list(MEMBERS)
+    assert read_members(index) == MEMBERS
+
+
+def test_round_trip(archive):
+    index = BZ2Index.build(archive)
+    assert index.save()
+    loaded = BZ2Index.load(archive)
+    assert (loaded.blocks, loaded.members, loaded.stamp) == (index.blocks, index.members, index.stamp)
+    assert read_members(loaded) == MEMBERS
+
+    # A changed archive invalidates the index
+    os.utime(archive, ns=(0, 0))
+    assert BZ2Index.load(archive) is None
+    assert BZ2Index.get(archive).members == index.members
+    assert os.path.exists(archive + INDEX_SUFFIX)
+
+
+def test_seek(archive):
+    index = BZ2Index.build(archive)
+    big = next(m for m in index.members if m['name'] == 'lib/big.bin')
+    with index.open() as f:
+        f.seek(big['offset_data'] + 200 * 1024)
+        assert f.read(1000) == MEMBERS['lib/big.bin'][200 * 1024:201 * 1024 - 24]
+        f.seek(-10, io.SEEK_CUR)
+        assert f.read(10) == MEMBERS['lib/big.bin'][201 * 1024 - 34:201 * 1024 - 24]
+
+
+def test_reopen_closes_reader(archive):
+    pa = PackageArchive(archive, random_access=True)
+    pa._open()
+    reader = pa._tarfile.fileobj
+    pa._open(reopen=True)
+    assert reader.closed
+    assert sorted(m.name for m in pa.files()) == sorted(MEMBERS)
+    (data,) = [f.read() for f in pa.extract(pa.get_member('lib/small.txt'), None)]
+    assert data == MEMBERS['lib/small.txt']
+    pa.close()
+    assert pa._tarfile.fileobj.closed
+
+
+def test_false_end_of_stream(archive, monkeypatch):
+    with open(archive, 'rb') as f:
+        buf = f.read()
+    blocks = bz2index.find_blocks(buf)
+
+    # A chance end of stream magic inside of the first block
+    find_magic = bz2index._find_magic
+    fake = blocks[0][0] + 1000
+    def with_fake(buf, magic):
+        found = find_magic(buf, magic)
+        return found + [fake] if magic == bz2index.EOS_MAGIC else found
+
+    monkeypatch.setattr(bz2index, '_find_magic', with_fake)
+    assert bz2index.find_blocks(buf) == blocks
+
+    # Even if its trailer happens to look valid, the block is merged back together
+    monkeypatch.setattr(bz2index, '_is_stream_end', lambda buf, pos: True)
+    assert bz2index.find_blocks(buf)[0] == (blocks[0][0], fake)
+    assert read_members(BZ2Index.build(archive)) == MEMBERS
+
+
+def test_stream_crc(archive):
+    with open(archive, 'rb') as f:
+        buf = f.read()
+    blocks = bz2index.find_blocks(buf)
+    bz2index._check_streams(buf, blocks)
+    with pytest.raises(OSError):
+        bz2index._check_streams(buf, blocks[:1] + blocks[2:])
+
+
+def test_no_end_of_stream(archive, monkeypatch):
+    monkeypatch.setattr(bz2index, '_is_stream_end', lambda buf, pos: False)
+    with open(archive, 'rb') as f:
+        with pytest.raises(ValueError):
+            bz2index.find_blocks(f.read())
+
+    # The archive is read sequentially instead
+    pa = PackageArchive(archive, random_access=True)
+    assert sorted(m.name for m in pa.files()) == sorted(MEMBERS)
+    assert not os.path.exists(archive + INDEX_SUFFIX)
+    pa.close()
+
+
+def test_decompress_parallel(archive):
+    with open(archive, 'rb') as f:
+        expected = bz2.decompress(f.read())
+    out = io.BytesIO()
+    assert bz2index.decompress_parallel(archive, out, workers=2) == len(expected)
+    assert out.getvalue() == expected
+
+
+def test_decompress_serial_fallback(archive, monkeypatch):
+    def broken(*args, **kwargs):
+        raise BrokenProcessPool()
+
+    monkeypatch.setattr(archive_module, 'decompress_parallel', broken)
+    path = archive_module._decompress_bz2(archive, workers=2)
+    try:
+        with open(archive, 'rb') as f, open(path, 'rb') as out:
+            assert out.read() == bz2.decompress(f.read())
+    finally:
+        os.remove(path)
@@ -0,0 +1,21 @@
+import os
+
+from conda_tools.cache.index import CacheIndex
+from conda_tools.cache.package import PREFIX_PLACEHOLDER
+
+
+def test_has_prefix_forms(tmp_path, make_package):
+    cache = str(tmp_path)
+    full = make_package(cache, 'full', has_prefix='/opt/build binary lib/libfull.so\n/opt/build text bin/full\n')
+    short = make_package(cache, 'short', has_prefix='bin/short\n\n"share/with space.txt"\n')
+    invalid = make_package(cache, 'invalid', has_prefix='/opt/build text\n')
+
+    full, short, invalid = (os.path.basename(p) for p in (full, short, invalid))
+    with CacheIndex(cache) as index:
+        index.refresh()
+        assert len(index) == 3
+        assert index.has_prefix(full) == {'files': {'lib/libfull.so': 'binary', 'bin/full': 'text'},
+                                          'binary': '/opt/build', 'text': '/opt/build'}
+        assert index.has_prefix(short) == {'files': {'bin/short': 'text', 'share/with space.txt': 'text'},
+                                           'binary': None, 'text': PREFIX_PLACEHOLDER}
+        assert index.has_prefix(invalid) == {'files': {}, 'binary': None, 'text': None}
@@ -0,0 +1,83 @@
+import os
+import json
+
+from conda_tools.cache import utils as cache_utils
+from conda_tools.cache.utils import packages, link_index, linked_environments, unlinked_packages
+from conda_tools.environment.environment import Environment
+
+
+def test_linked_environments_relative_cache(tmp_path, monkeypatch, make_package, link_package):
+    cache = str(tmp_path / 'pkgs')
+    linked = make_package(cache, 'a')
+    make_package(cache, 'b')
+    link_package(tmp_path / 'env', linked, hardlink=False)
+    env = Environment(str(tmp_path / 'env'))
+
+    monkeypatch.chdir(str(tmp_path))
+    pkgs = list(packages('pkgs'))
+    result = {p.path.name: envs for p, envs in linked_environments(pkgs, [env]).items()}
+    assert result['a-1.0-0'] == (env,)
+    assert result['b-1.0-0'] == ()
+    assert [p.path.name for p in unlinked_packages(pkgs, [env])] == ['b-1.0-0']
+
+
+def test_linked_environments_symlinked_cache(tmp_path, make_package, link_package):
+    cache = str(tmp_path / 'pkgs')
+    linked = make_package(cache, 'a')
+    link_package(tmp_path / 'env', linked, hardlink=False)
+    env = Environment(str(tmp_path / 'env'))
+    os.symlink(cache, str(tmp_path / 'alias'))
+
+    pkgs = list(packages(str(tmp_path / 'alias')))
+    assert unlinked_packages(pkgs, [env]) == ()
+
+
+def test_link_index_cache_file(tmp_path, monkeypatch, make_package, link_package):
+    cache = str(tmp_path / 'pkgs')
+    a = make_package(cache, 'a')
+    link_package(tmp_path / 'env', a, hardlink=False)
+    env = Environment(str(tmp_path / 'env'))
+    cache_file = str(tmp_path / 'links.json')
+
+    expected = {os.path.realpath(a): (env,)}
+    assert link_index([env], cache_file) == expected
+    with open(cache_file) as f:
+        assert json.load(f)[env.path]['sources'] == [os.path.realpath(a)]
+    assert sorted(os.listdir(str(tmp_path))) == ['env', 'links.json', 'pkgs']
+
+    # Unchanged environments are not read again
+    def fail(env):
+        raise AssertionError('{} was read again'.format(env.path))
+
+    with monkeypatch.context() as m:
+        m.setattr(cache_utils, '_linked_sources', fail)
+        assert link_index([env], cache_file) == expected
+
+    b = make_package(cache, 'b')
+    link_package(tmp_path / 'env', b, hardlink=False)
+    os.utime(str(tmp_path / 'env' / 'conda-meta'), ns=(0, 0))
+    env.invalidate()
+    assert link_index([env], cache_file) == {os.path.realpath(a): (env,), os.path.realpath(b): (env,)}
+
+
+def test_packages_workers(tmp_path, make_package, capsys):
+    cache = str(tmp_path / 'pkgs')
+    for i in range(8):
+        make_package(cache, 'p{}'.format(i), version='1.{}'.format(i))
+    os.makedirs(os.path.join(cache, 'not-a-package'))
+    with open(os.path.join(cache, 'p0-1.0-0.tar.bz2'), 'w'):
+        pass
+
+    # Without workers, packages are yielded in directory order
+    with os.scandir(cache) as it:
+        order = [e.name for e in it if e.is_dir() and e.name != 'not-a-package']
+    serial = list(packages(cache))
+    assert [p.path.name for p in serial] == order
+
+    # With workers, in completion order, with index.json already loaded
+    concurrent = list(packages(cache, verbose=True, workers=4))
+    assert sorted(p.path.name for p in concurrent) == sorted(order)
+    assert 'Skipping {}'.format(os.path.join(cache, 'not-a-package')) in capsys.readouterr().out
+    for p in concurrent:
+        os.remove(os.path.join(str(p.path), 'info', 'index.json'))
+    assert sorted(p.version for p in concurrent) == ['1.{}'.format(i) for i in range(8)]
@@ -0,0 +1,39 @@
+import sys
+
+from conda_tools.environment.environment import DictionaryPool
+
+
+def record(name, depends):
+    return {'name': name, 'depends': list(depends), 'link': {'source': '/pkgs/' + name, 'type': 1}}
+
+
+def test_register_shares_equal_records():
+    pool = DictionaryPool()
+    first = pool.register(record('a', ['python']))
+    assert pool.register(record('a', ['python'])) is first
+    assert pool.register(record('b', ['python'])) is not first
+    # Values of different types are not conflated
+    assert pool.register({'build_number': 1}) is not pool.register({'build_number': True})
+
+
+def test_nested_structures_are_shared():
+    pool = DictionaryPool()
+    a = pool.register({'name': 'a', 'depends': ['python', 'zlib'], 'info': {'arch': 'x86_64'}})
+    b = pool.register({'name': 'b', 'depends': ['python', 'zlib'], 'info': {'arch': 'x86_64'}})
+    assert a is not b
+    assert a['depends'] is b['depends']
+    assert a['info'] is b['info']
+
+    n = len(pool)
+    pool.register({'name': 'b', 'depends': ['python', 'zlib'], 'info': {'arch': 'x86_64'}})
+    assert len(pool) == n
+    pool.clear()
+    assert len(pool) == 0
+
+
+def test_intern_keys():
+    pool = DictionaryPool(intern_keys=True)
+    key = ''.join(['na', 'me'])
+    shared = pool.register({key: 'a'})
+    (pooled_key,) = shared
+    assert pooled_key is sys.intern('name')
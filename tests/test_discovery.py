@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from conda_tools.environment.environment import discover_environments
+
+
+def make_env(path, records=('a',)):
+    meta = os.path.join(str(path), 'conda-meta')
+    os.makedirs(meta)
+    for name in records:
+        with open(os.path.join(meta, '{}-1.0-0.json'.format(name)), 'w') as f:
+            f.write('{{"name": "{}", "version": "1.0", "build": "0"}}'.format(name))
+    return str(path)
+
+
+def discovered(roots, **kwargs):
+    return sorted(e.path for e in discover_environments(roots, workers=2, **kwargs))
+
+
+def test_depth(tmp_path):
+    shallow = make_env(tmp_path / 'envs' / 'shallow')
+    deep = make_env(tmp_path / 'a' / 'b' / 'deep')
+
+    assert discovered(tmp_path, max_depth=1) == []
+    assert discovered(tmp_path, max_depth=2) == [shallow]
+    assert discovered(tmp_path, max_depth=3) == [deep, shallow]
+
+
+def test_nested_roots(tmp_path):
+    base = make_env(tmp_path / 'base')
+    child = make_env(tmp_path / 'base' / 'envs' / 'child')
+    # Not searched, environments are only searched for envs/
+    make_env(tmp_path / 'base' / 'other' / 'env')
+
+    # Each environment is yielded once, whatever the roots are
+    roots = [base, os.path.join(base, 'envs'), child]
+    assert discovered(roots) == [base, child]
+
+    registry = tmp_path / 'environments.txt'
+    registry.write_text('# comment\n{}\n\n{}\n'.format(child, tmp_path / 'missing'))
+    assert discovered(registry) == [child]
+
+
+@pytest.mark.parametrize('preload', [True, False])
+def test_preload(tmp_path, preload):
+    good = make_env(tmp_path / 'good', records=('a', 'b'))
+    bad = make_env(tmp_path / 'bad')
+    with open(os.path.join(bad, 'conda-meta', 'broken-1.0-0.json'), 'w') as f:
+        f.write('{"name": ')
+
+    envs = {e.path: e for e in discover_environments(tmp_path, preload=preload)}
+    assert sorted(envs) == [bad, good]
+    assert (envs[good]._partitions is not None) == preload
+    assert sorted(envs[good].package_specs) == ['a-1.0-0', 'b-1.0-0']
+
+    # The broken record is only reported on access
+    assert envs[bad]._partitions is None
+    with pytest.raises(ValueError):
+        envs[bad].package_specs
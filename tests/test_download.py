@@ -0,0 +1,104 @@
+import os
+import hashlib
+
+import pytest
+
+from conda_tools.repository.download import Downloader, PARTIAL_SUFFIX
+from conda_tools.repository.exceptions import DownloadError, ChecksumMismatch
+
+DATA = bytes(range(256)) * 1024
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def server(http_server):
+    for name in ('a', 'b', 'slow'):
+        http_server.files['/{}.tar.bz2'.format(name)] = DATA
+    http_server.slow.add('/slow.tar.bz2')
+    return http_server, http_server.url
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download(server, tmp_path):
+    httpd, url = server
+    d = Downloader(tmp_path, workers=2)
+    results = d.download([(url + '/a.tar.bz2', SHA256), (url + '/b.tar.bz2', SHA256)])
+    assert all(r.error is None for r in results)
+    assert read(str(tmp_path / 'a.tar.bz2')) == DATA
+    assert d.files == 2 and d.bytes == 2 * len(DATA)
+
+    # Verified files are not downloaded again
+    results = d.download([(url + '/a.tar.bz2', SHA256)])
+    assert results[0].skipped
+    assert len(httpd.requests) == 2
+
+
+def test_resume(server, tmp_path):
+    httpd, url = server
+    with open(str(tmp_path / ('a.tar.bz2' + PARTIAL_SUFFIX)), 'wb') as f:
+        f.write(DATA[:1000])
+
+    result = Downloader(tmp_path).fetch(url + '/a.tar.bz2', SHA256)
+    assert result.resumed and result.bytes == len(DATA) - 1000
+    assert [(p, h.get('Range')) for p, h in httpd.requests] == [('/a.tar.bz2', 'bytes=1000-')]
+    assert read(result.path) == DATA
+    assert not os.path.exists(result.path + PARTIAL_SUFFIX)
+
+
+def test_complete_partial(server, tmp_path):
+    httpd, url = server
+    with open(str(tmp_path / ('a.tar.bz2' + PARTIAL_SUFFIX)), 'wb') as f:
+        f.write(DATA)
+
+    result = Downloader(tmp_path).fetch(url + '/a.tar.bz2', SHA256)
+    assert result.resumed and result.bytes == 0
+    assert read(result.path) == DATA
+
+
+def test_invalid_partial(server, tmp_path):
+    httpd, url = server
+    with open(str(tmp_path / ('a.tar.bz2' + PARTIAL_SUFFIX)), 'wb') as f:
+        f.write(b'x' * len(DATA))
+
+    # 416 for a partial file with the wrong content starts over
+    result = Downloader(tmp_path).fetch(url + '/a.tar.bz2', SHA256)
+    assert not result.resumed and result.bytes == len(DATA)
+    assert read(result.path) == DATA
+
+
+def test_redirect(server, tmp_path):
+    httpd, url = server
+    result = Downloader(tmp_path).fetch(url + '/redir/a.tar.bz2', SHA256)
+    assert result.path == str(tmp_path / 'a.tar.bz2')
+    assert read(result.path) == DATA
+    assert [p for p, _ in httpd.requests] == ['/redir/a.tar.bz2', '/a.tar.bz2']
+
+
+def test_checksum_mismatch(server, tmp_path):
+    httpd, url = server
+    d = Downloader(tmp_path)
+    with pytest.raises(ChecksumMismatch):
+        d.fetch(url + '/a.tar.bz2', '0' * 64)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_not_found(server, tmp_path):
+    httpd, url = server
+    results = Downloader(tmp_path).download([(url + '/missing', None)])
+    assert isinstance(results[0].error, DownloadError)
+
+
+def test_error_recovery(server, tmp_path):
+    httpd, url = server
+    d = Downloader(tmp_path, workers=1, timeout=0.5)
+    # The half read response must not break the next downloads of the thread
+    results = d.download([(url + '/slow.tar.bz2', SHA256), (url + '/a.tar.bz2', SHA256),
+                          (url + '/b.tar.bz2', SHA256)])
+    errors = {os.path.basename(r.url): r.error for r in results}
+    assert isinstance(errors.pop('slow.tar.bz2'), OSError)
+    assert errors == {'a.tar.bz2': None, 'b.tar.bz2': None}
+    assert read(str(tmp_path / 'b.tar.bz2')) == DATA
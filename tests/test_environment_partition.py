@@ -0,0 +1,57 @@
+import os
+import json
+
+from conda_tools.constants import LINK_TYPE
+from conda_tools.environment.environment import Environment
+
+
+def write_record(prefix, name, link_type=None):
+    meta = os.path.join(str(prefix), 'conda-meta')
+    os.makedirs(meta, exist_ok=True)
+    record = {'name': name, 'version': '1.0', 'build': '0', 'files': []}
+    if link_type is not None:
+        record['link'] = {'source': '/pkgs/{}-1.0-0'.format(name), 'type': link_type}
+    with open(os.path.join(meta, name + '-1.0-0.json'), 'w') as f:
+        json.dump(record, f)
+
+
+def names(proxies):
+    return sorted(p.name for p in proxies)
+
+
+def test_link_type_partitions(tmp_path):
+    write_record(tmp_path, 'hard', 1)
+    write_record(tmp_path, 'soft', 'soft-link')
+    write_record(tmp_path, 'copied', 3)
+    write_record(tmp_path, 'unlinked')
+    env = Environment(str(tmp_path))
+
+    assert names(env.hard_linked) == ['hard', 'unlinked']
+    assert names(env.soft_linked) == ['soft']
+    assert names(env.copy_linked) == ['copied']
+    assert names(env.packages) == ['copied', 'hard', 'soft', 'unlinked']
+    assert env._partition()[LINK_TYPE.directory] == ()
+    # Partitions are computed once
+    assert env.hard_linked is env.hard_linked
+
+
+def test_partitions_follow_conda_meta(tmp_path):
+    write_record(tmp_path, 'a', 1)
+    env = Environment(str(tmp_path))
+    before = env.hard_linked
+    assert names(before) == ['a']
+    assert env.package_specs == ('a-1.0-0',)
+
+    # A new record changes the mtime of conda-meta
+    write_record(tmp_path, 'b', 2)
+    os.utime(os.path.join(str(tmp_path), 'conda-meta'), ns=(0, 0))
+    assert names(env.soft_linked) == ['b']
+    assert env.hard_linked is not before
+    assert sorted(env.package_specs) == ['a-1.0-0', 'b-1.0-0']
+
+    # A changed record does not change the mtime of conda-meta
+    write_record(tmp_path, 'a', 3)
+    assert names(env.hard_linked) == ['a']
+    env.invalidate()
+    assert names(env.hard_linked) == []
+    assert names(env.copy_linked) == ['a']
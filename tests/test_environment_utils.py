@@ -0,0 +1,47 @@
+import os
+
+from conda_tools.environment.environment import Environment
+from conda_tools.environment.utils import check_hardlinked_fleet, LinkReport
+from conda_tools.utils import inode_map
+
+
+def test_check_hardlinked_fleet(tmp_path, make_package, link_package):
+    base = str(tmp_path / 'base')
+    cache = os.path.join(base, 'pkgs')
+    child = os.path.join(base, 'envs', 'child')
+    a = make_package(cache, 'a', files=['lib/a.txt', 'bin/a'])
+    b = make_package(cache, 'b')
+    c = make_package(cache, 'c')
+
+    link_package(base, a, ['lib/a.txt'])
+    link_package(base, c, ['lib/c.txt'], link=False)
+    link_package(child, a, ['lib/a.txt', 'bin/a'])
+    link_package(child, b, ['lib/b.txt'])
+    os.remove(os.path.join(child, 'lib', 'b.txt'))
+
+    envs = Environment(base), Environment(child)
+    result = check_hardlinked_fleet(envs, workers=2)
+    assert result[envs[0]] == {'a': LinkReport(('bin/a',), (), ())}
+    assert result[envs[1]] == {'a': LinkReport((), (), ()), 'b': LinkReport(('lib/b.txt',), (), ())}
+
+
+def test_inode_map_exclude(tmp_path, make_package, link_package):
+    base = str(tmp_path / 'base')
+    a = make_package(os.path.join(base, 'pkgs'), 'a')
+    link_package(base, a, ['lib/a.txt'])
+
+    assert 'pkgs/a-1.0-0/lib/a.txt' in inode_map(base)
+    result = inode_map(base, exclude=[os.path.join(base, 'pkgs')])
+    assert sorted(result) == ['conda-meta/a-1.0-0.json', 'lib/a.txt']
+
+
+def test_check_hardlinked_fleet_invalid_package(tmp_path, make_package, link_package):
+    prefix = str(tmp_path / 'env')
+    a = make_package(str(tmp_path / 'pkgs'), 'a', files=['lib/a.txt', 'bin/a'], has_prefix='/opt/build text\n')
+    link_package(prefix, a, ['lib/a.txt'])
+
+    # The files of the record are checked instead
+    env = Environment(prefix)
+    assert check_hardlinked_fleet([env]) == {env: {'a': LinkReport((), (), ())}}
+    os.remove(os.path.join(prefix, 'lib', 'a.txt'))
+    assert check_hardlinked_fleet([env]) == {env: {'a': LinkReport(('lib/a.txt',), (), ())}}
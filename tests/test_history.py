@@ -0,0 +1,131 @@
+import os
+import random
+
+import pytest
+
+from conda_tools.environment.history import History, RevisionStates
+
+
+def naive_states(revisions):
+    """
+    The state of every revision built from scratch, as conda does.
+    """
+    res = []
+    cur = set()
+    for dt, cont, unused_com in revisions:
+        if not any(s.startswith(('-', '+')) for s in cont):
+            cur = set(cont)
+        else:
+            cur -= {s[1:] for s in cont if s.startswith('-')}
+            cur |= {s[1:] for s in cont if s.startswith('+')}
+        res.append((dt, frozenset(cur)))
+    return res
+
+
+def random_revisions(n, seed):
+    rng = random.Random(seed)
+    dists = ['pkg{}-1.{}-0'.format(i, j) for i in range(20) for j in range(3)]
+    revisions = [('2020-01-01 00:00:00', set(rng.sample(dists, 10)), [])]
+    for i in range(1, n):
+        dt = '2020-01-01 00:00:{:02d}'.format(i % 60)
+        r = rng.random()
+        if r < 0.05:
+            cont = set(rng.sample(dists, 8))
+        elif r < 0.25:
+            # Often adds a distribution that is already installed, which changes nothing
+            cont = {'+' + rng.choice(sorted(revisions[-1][1]) or dists).lstrip('+-')}
+        else:
+            removed = set(rng.sample(dists, 2))
+            added = set(rng.sample(dists, 3)) - removed
+            cont = {'-' + d for d in removed} | {'+' + d for d in added}
+        revisions.append((dt, cont, []))
+    return revisions
+
+
+@pytest.mark.parametrize('interval', [1, 2, 3, 32])
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_naive(interval, seed):
+    revisions = random_revisions(150, seed)
+    expected = naive_states(revisions)
+    states = RevisionStates(revisions, interval=interval)
+    assert len(states) == len(expected)
+    assert list(states) == expected
+    assert [states[i] for i in range(len(states))] == expected
+    assert states[-1] == expected[-1]
+    assert states[10:20:3] == expected[10:20:3]
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        RevisionStates([], interval=0)
+    with pytest.raises(IndexError):
+        RevisionStates([])[0]
+
+
+def test_history_update(tmp_path):
+    meta = tmp_path / 'conda-meta'
+    meta.mkdir()
+    path = str(meta / 'history')
+    with open(path, 'w') as f:
+        f.write('==> 2020-01-01 00:00:00 <==\n# cmd: conda create\na-1.0-0\nb-1.0-0\n')
+
+    history = History(str(tmp_path))
+    assert history.get_state() == {'a-1.0-0', 'b-1.0-0'}
+
+    with open(path, 'a') as f:
+        f.write('==> 2020-01-02 00:00:00 <==\n# cmd: conda update a\n-a-1.0-0\n+a-2.0-0\n')
+    assert history.update() == 1
+    assert history.get_state() == {'a-2.0-0', 'b-1.0-0'}
+    assert history.get_state(0) == {'a-1.0-0', 'b-1.0-0'}
+    assert history.offset == os.path.getsize(path)
+
+
+def write(path, text, mode='w'):
+    with open(path, mode, encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_history_truncated_and_replaced(tmp_path):
+    meta = tmp_path / 'conda-meta'
+    meta.mkdir()
+    path = str(meta / 'history')
+    first = '==> 2020-01-01 00:00:00 <==\n# cmd: conda create\na-1.0-0\n'
+    second = '==> 2020-01-02 00:00:00 <==\n# cmd: conda install b\n+b-1.0-0\n'
+    write(path, first + second)
+
+    history = History(str(tmp_path))
+    assert len(history._parse) == 2
+
+    # Truncated to the first revision
+    write(path, first)
+    assert history.update() == 1
+    assert history.get_state() == {'a-1.0-0'}
+
+    # An incomplete line is left for the next update
+    write(path, second[:20], mode='a')
+    assert history.update() == 0
+    write(path, second[20:], mode='a')
+    assert history.update() == 1
+    assert history.get_state() == {'a-1.0-0', 'b-1.0-0'}
+
+    # Replaced by a different file with the same size
+    os.remove(path)
+    write(path, first.replace('a-1', 'z-1'))
+    assert history.update() == 1
+    assert history.get_state() == {'z-1.0-0'}
+
+
+def test_iter_revisions(tmp_path):
+    meta = tmp_path / 'conda-meta'
+    meta.mkdir()
+    path = str(meta / 'history')
+    write(path, 'ignored\n==> 2020-01-01 00:00:00 <==\n# cmd: conda create\n\na-1.0-0\n'
+                '==> 2020-01-02 00:00:00 <==\n+café-1.0-0\n')
+    with open(path, 'ab') as f:
+        f.write(b'+bad\xff-1.0-0\n')
+
+    history = History(str(tmp_path))
+    revisions = list(history.iter_revisions())
+    assert revisions == history._parse
+    assert revisions == [('2020-01-01 00:00:00', {'a-1.0-0'}, ['# cmd: conda create']),
+                         ('2020-01-02 00:00:00', {'+café-1.0-0', '+bad�-1.0-0'}, [])]
@@ -0,0 +1,63 @@
+import os
+import json
+
+from conda_tools.environment.environment import Environment
+from conda_tools.environment.ownership import OwnershipIndex
+
+
+def make_env(tmp_path, make_package, link_package):
+    prefix = tmp_path / 'env'
+    cache = str(tmp_path / 'pkgs')
+    link_package(prefix, make_package(cache, 'a', files=['lib/a.txt', 'bin/a']))
+    link_package(prefix, make_package(cache, 'b', files=['lib/b.txt']))
+    return Environment(str(prefix))
+
+
+def owner_names(index, path):
+    return [p.name for p in index.owners(path)]
+
+
+def test_round_trip(tmp_path, make_package, link_package):
+    env = make_env(tmp_path, make_package, link_package)
+    index_path = str(tmp_path / 'owners.json')
+
+    built = OwnershipIndex.load(env, index_path)
+    with open(index_path) as f:
+        data = json.load(f)
+    assert sorted(data['packages']) == ['a-1.0-0.json', 'b-1.0-0.json']
+    assert not [n for n in os.listdir(str(tmp_path)) if n.endswith('.tmp')]
+
+    loaded = OwnershipIndex.load(env, index_path)
+    assert len(loaded) == len(built) == 3
+    assert owner_names(loaded, 'lib/a.txt') == ['a']
+    assert owner_names(loaded, os.path.join(env.path, 'lib', 'b.txt')) == ['b']
+    assert sorted(loaded.under('lib')) == ['lib/a.txt', 'lib/b.txt']
+
+
+def test_stale(tmp_path, make_package, link_package):
+    env = make_env(tmp_path, make_package, link_package)
+    index_path = str(tmp_path / 'owners.json')
+    old = OwnershipIndex.load(env, index_path)
+
+    # The environment changes after the index was built
+    link_package(env.path, make_package(str(tmp_path / 'pkgs'), 'c'))
+    os.utime(os.path.join(env.path, 'conda-meta'), ns=(0, 0))
+    env.invalidate()
+    assert old.save(index_path)
+
+    index = OwnershipIndex.load(env, index_path)
+    assert owner_names(index, 'lib/c.txt') == ['c']
+    with open(index_path) as f:
+        assert json.load(f)['mtime'] == 0
+
+
+def test_unowned(tmp_path, make_package, link_package):
+    env = make_env(tmp_path, make_package, link_package)
+    with open(os.path.join(env.path, 'lib', 'extra.txt'), 'w') as f:
+        f.write('extra')
+    os.makedirs(os.path.join(env.path, 'share', 'empty'))
+
+    index = OwnershipIndex(env)
+    assert index.unowned() == ['lib/extra.txt']
+    assert index.unowned('lib') == ['lib/extra.txt']
+    assert index.unowned('bin') == []
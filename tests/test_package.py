@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from conda_tools.cache.package import Package, InvalidCachePackage
+
+
+def test_hot_fields(tmp_path, make_package):
+    path = make_package(str(tmp_path), 'a', build='py_0',
+                        index={'build_number': '3', 'depends': ['python >=3'], 'subdir': 'noarch', 'license': 'MIT'})
+    pkg = Package(path)
+    assert not hasattr(pkg, '__dict__')
+    assert (pkg.name, pkg.version, pkg.build, pkg.build_number) == ('a', '1.0', 'py_0', 3)
+    assert pkg.depends == ['python >=3']
+    assert pkg.subdir == 'noarch'
+    # Other fields are looked up in index.json, missing ones are None
+    assert pkg.license == 'MIT'
+    assert pkg.platform is None
+    with pytest.raises(AttributeError):
+        pkg.__missing__
+
+
+def test_without_depends(tmp_path, make_package):
+    pkg = Package(make_package(str(tmp_path), 'a'))
+    assert pkg.depends == []
+    assert pkg.subdir is None
+
+
+def test_invalid(tmp_path):
+    with pytest.raises(InvalidCachePackage):
+        Package(str(tmp_path))
+    # Not validated, fails on first access instead
+    pkg = Package(str(tmp_path), validate=False)
+    with pytest.raises(FileNotFoundError):
+        pkg.name
+
+
+def test_invalidate(tmp_path, make_package):
+    cache = str(tmp_path)
+    pkg = Package(make_package(cache, 'a', has_prefix='/opt/build binary lib/a.txt\n'))
+    assert pkg.version == '1.0'
+    assert pkg.files == {'lib/a.txt'}
+    assert pkg.has_prefix == {'lib/a.txt': 'binary'} and pkg.binary_prefix == '/opt/build'
+
+    make_package(cache, 'a', files=['lib/a.txt', 'lib/b.txt'], index={'version': '2.0'})
+    with open(os.path.join(str(pkg.path), 'info', 'has_prefix'), 'w') as f:
+        f.write('')
+
+    # Unrelated files do not discard anything
+    pkg.invalidate('about.json')
+    assert (pkg.version, pkg.files) == ('1.0', {'lib/a.txt'})
+
+    pkg.invalidate('index.json')
+    assert pkg.version == '2.0'
+    assert pkg.files == {'lib/a.txt'}
+
+    pkg.invalidate('has_prefix')
+    assert pkg.binary_prefix is None
+    assert pkg.has_prefix == {}
+
+    pkg.invalidate()
+    assert pkg.files == {'lib/a.txt', 'lib/b.txt'}
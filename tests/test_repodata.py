@@ -0,0 +1,114 @@
+import io
+import bz2
+import json
+
+import pytest
+
+from conda_tools.repository.repodata import iter_repodata, iter_chunks, load_repodata, PACKAGE_SECTIONS
+from conda_tools.repository.repository import get_repo, RepoPackage, REPODATA_NAME
+
+REPODATA = {
+    'info': {'subdir': 'linux-64', 'arch': 'x86_64'},
+    'repodata_version': 1,
+    'packages': {
+        'numpy-1.20.1-py39_0.tar.bz2': {
+            'name': 'numpy', 'version': '1.20.1', 'build': 'py39_0', 'build_number': 0,
+            'depends': ['python >=3.9,<3.10.0a0', 'libblas >=3.8'], 'license': 'BSD-3-Clause',
+            'size': 5123456, 'timestamp': 1612345678901, 'sha256': 'ab' * 32,
+        },
+        'pkg-2.5-0.tar.bz2': {
+            'name': 'pkg', 'version': '2.5', 'build': '0', 'build_number': 12,
+            'depends': [], 'license': 'café ☃ "quoted" \\ back\\slash\n',
+            'score': -1.25e-3, 'ratio': 0.5, 'flag': True, 'other': None, 'nested': {'a': [1, {}, []]},
+        },
+    },
+    'packages.conda': {
+        'numpy-1.20.1-py39_0.conda': {
+            'name': 'numpy', 'version': '1.20.1', 'build': 'py39_0', 'build_number': 0, 'depends': [],
+        },
+    },
+    'removed': ['old-1.0-0.tar.bz2'],
+}
+
+
+def parsed(chunks):
+    result = {}
+    for section, key, value in iter_repodata(chunks):
+        if section is None:
+            result[key] = value
+        else:
+            result.setdefault(section, {})[key] = value
+    return result
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1 << 20])
+def test_matches_json(indent, size):
+    text = json.dumps(REPODATA, indent=indent, ensure_ascii=False)
+    assert parsed(split(text, size)) == json.loads(text)
+
+
+@pytest.mark.parametrize('size', [1, 5, 100])
+def test_compressed_chunks(size):
+    raw = json.dumps(REPODATA, ensure_ascii=False).encode('utf8')
+    assert parsed(iter_chunks(io.BytesIO(bz2.compress(raw)), chunk_size=size)) == REPODATA
+    # Multibyte characters split across chunks
+    assert parsed(iter_chunks(io.BytesIO(raw), compressed=False, chunk_size=size)) == REPODATA
+
+
+@pytest.mark.parametrize('chunks', [
+    ['{"a": -1', '.', '5, "b": 1', 'e', '3, "c": 2', '0}'],
+    ['{"a": -1.', '5, "b": 1e', '3, "c": 20', '}'],
+    ['{"a": -', '1.5, "b": 1', 'e3, "c": ', '20}'],
+])
+def test_split_numbers(chunks):
+    assert parsed(chunks) == {'a': -1.5, 'b': 1e3, 'c': 20}
+
+
+def test_empty_sections():
+    data = {'info': {}, 'packages': {}, 'packages.conda': {}}
+    assert parsed(split(json.dumps(data), 3)) == {'info': {}}
+    assert parsed(['{', ' }']) == {}
+
+
+@pytest.mark.parametrize('text', ['{"packages": {"a": 1', '{"a" 1}', '{"a": 1,}', '[]'])
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        parsed(split(text, 2))
+
+
+def test_load_repodata():
+    raw = bz2.compress(json.dumps(REPODATA).encode('utf8'))
+    data = load_repodata(io.BytesIO(raw), chunk_size=16)
+    assert data['info'] == REPODATA['info']
+    assert data['removed'] == REPODATA['removed']
+    for section in PACKAGE_SECTIONS:
+        assert sorted(data[section]) == sorted(REPODATA[section])
+        for filename, record in REPODATA[section].items():
+            pkg = data[section][filename]
+            assert (pkg.filename, pkg.name, pkg.version, pkg.depends, pkg.size) == \
+                (filename, record['name'], record['version'], record['depends'], record.get('size'))
+
+
+def test_get_repo(tmp_path):
+    subdir = tmp_path / 'linux-64'
+    subdir.mkdir()
+    with open(str(subdir / REPODATA_NAME), 'wb') as f:
+        f.write(bz2.compress(json.dumps(REPODATA).encode('utf8')))
+    url = 'file://' + str(tmp_path)
+
+    # Records are the dictionaries of repodata.json by default
+    repo = get_repo(url, 'linux-64')
+    assert repo.packages == REPODATA['packages']
+    assert repo.conda_packages == REPODATA['packages.conda']
+
+    repo = get_repo(url, 'linux-64', stream=True)
+    assert all(isinstance(p, RepoPackage) for p in repo.packages.values())
+    assert sorted(repo.packages) == sorted(REPODATA['packages'])
+
+    repo = get_repo(url, 'linux-64', stream=True, merge_conda=True)
+    assert sorted(repo.packages) == sorted(list(REPODATA['packages']) + list(REPODATA['packages.conda']))
@@ -0,0 +1,129 @@
+import os
+import bz2
+import json
+
+import pytest
+
+from conda_tools.repository.cache import RepodataCache
+
+PATHS = ('/channel/repodata.json.bz2', '/channel/linux-64/repodata.json.bz2')
+
+
+def repodata(version):
+    record = {'name': 'a', 'version': version, 'build': '0', 'build_number': 0, 'depends': ['b >=1']}
+    return bz2.compress(json.dumps({
+        'info': {'subdir': 'linux-64'},
+        'packages': {'a-{}-0.tar.bz2'.format(version): record},
+        'packages.conda': {'a-{}-0.conda'.format(version): record},
+    }).encode('utf8'))
+
+
+def serve(httpd, etag, version):
+    for path in PATHS:
+        httpd.etags[path] = etag
+        httpd.files[path] = repodata(version)
+
+
+@pytest.fixture
+def server(http_server):
+    serve(http_server, '"1"', '1.0')
+    return http_server, http_server.url + '/channel'
+
+
+def requests(httpd):
+    return [h.get('If-None-Match') for p, h in httpd.requests]
+
+
+def versions(repo):
+    return sorted(p.version for p in repo.packages.values())
+
+
+def count_loads(cache, monkeypatch):
+    loads = []
+    read = cache._read
+
+    def _read(url, packages, *args):
+        loads.append(packages)
+        return read(url, packages, *args)
+    monkeypatch.setattr(cache, '_read', _read)
+    return loads
+
+
+def test_not_modified(server, tmp_path, monkeypatch):
+    httpd, url = server
+    cache = RepodataCache(tmp_path)
+    assert versions(cache.get_repo(url, 'linux-64')) == ['1.0']
+    assert cache.headers(url + '/linux-64')['etag'] == '"1"'
+
+    loads = count_loads(cache, monkeypatch)
+    repo = cache.get_repo(url, 'linux-64')
+    assert versions(repo) == ['1.0']
+    assert repo.packages['a-1.0-0.tar.bz2'].depends == ['b >=1']
+    assert requests(httpd) == [None, '"1"']
+    # Only the headers are read before the request
+    assert loads == [False, True]
+
+    serve(httpd, '"2"', '2.0')
+    assert versions(cache.get_repo(url, 'linux-64')) == ['2.0']
+    assert loads == [False, True, False]
+    assert cache.headers(url + '/linux-64')['etag'] == '"2"'
+
+
+def test_unchanged_validators(server, tmp_path):
+    httpd, url = server
+    httpd.conditional = False
+    cache = RepodataCache(tmp_path)
+    cache.get_repo(url)
+    os.utime(cache.path(url), (0, 0))
+
+    # The server ignores the conditional request but sends the same ETag
+    serve(httpd, '"1"', '9.9')
+    assert versions(cache.get_repo(url)) == ['1.0']
+    assert requests(httpd) == [None, '"1"']
+    assert cache.headers(url)['mtime'] > 0
+
+
+def test_max_age(server, tmp_path):
+    httpd, url = server
+    cache = RepodataCache(tmp_path)
+    cache.get_repo(url, max_age=60)
+    serve(httpd, '"2"', '2.0')
+
+    assert versions(cache.get_repo(url, max_age=60)) == ['1.0']
+    assert len(requests(httpd)) == 1
+
+    os.utime(cache.path(url), (0, 0))
+    assert versions(cache.get_repo(url, max_age=60)) == ['2.0']
+    assert len(requests(httpd)) == 2
+
+
+def test_invalid_cache(server, tmp_path):
+    httpd, url = server
+    cache = RepodataCache(tmp_path)
+    cache.get_repo(url)
+    path = cache.path(url)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # Readable headers but truncated packages are downloaded again
+    with open(path, 'wb') as f:
+        f.write(data[:-10])
+    assert cache.headers(url) is not None
+    assert versions(cache.get_repo(url)) == ['1.0']
+    assert requests(httpd) == [None, '"1"', None]
+
+    with open(path, 'wb') as f:
+        f.write(b'garbage')
+    assert cache.headers(url) is None and cache.load(url) is None
+
+
+def test_conda_packages(server, tmp_path):
+    httpd, url = server
+    cache = RepodataCache(tmp_path)
+    cache.get_repo(url)
+    for repo in (cache.get_repo(url), cache.load(url)[1]):
+        assert list(repo.packages) == ['a-1.0-0.tar.bz2']
+        assert list(repo.conda_packages) == ['a-1.0-0.conda']
+    repo = cache.get_repo(url, merge_conda=True)
+    assert sorted(repo.packages) == ['a-1.0-0.conda', 'a-1.0-0.tar.bz2']
+    assert requests(httpd) == [None, '"1"', '"1"']
@@ -0,0 +1,85 @@
+import pytest
+
+from conda_tools.repository.repository import RepoPackage
+from conda_tools.repository.search import SearchIndex, parse_spec, compile_version, version_order
+from conda_tools.repository.exceptions import InvalidSpec
+
+RECORDS = [
+    ('numpy', '1.10.4', 'py27_0', 0),
+    ('numpy', '1.19.5', 'py39_0', 0),
+    ('numpy', '1.20', 'py38_0', 0),
+    ('numpy', '1.20.1', 'py39_0', 0),
+    ('numpy', '1.20.1', 'py39_2', 2),
+    ('numpy', '1.201', 'py39_0', 0),
+    ('numpy', '2.0.0', 'py311_0', 0),
+    ('scipy', '1.20.1', 'py39_0', 0),
+]
+
+
+def make_index():
+    packages = []
+    for name, version, build, build_number in RECORDS:
+        filename = '{}-{}-{}.tar.bz2'.format(name, version, build)
+        packages.append(RepoPackage(filename, {'name': name, 'version': version, 'build': build,
+                                               'build_number': build_number, 'sha256': filename}))
+    return SearchIndex(packages)
+
+
+def found(spec):
+    return sorted((p.version, p.build) for p in make_index().search(spec))
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('numpy', 7),
+    ('numpy 1.20.*', [('1.20', 'py38_0'), ('1.20.1', 'py39_0'), ('1.20.1', 'py39_2')]),
+    ('numpy >=1.20,<2 py39*', [('1.20.1', 'py39_0'), ('1.20.1', 'py39_2'), ('1.201', 'py39_0')]),
+    ('numpy >= 1.20, < 2 py39*', [('1.20.1', 'py39_0'), ('1.20.1', 'py39_2'), ('1.201', 'py39_0')]),
+    ('numpy=1.20', [('1.20', 'py38_0'), ('1.20.1', 'py39_0'), ('1.20.1', 'py39_2')]),
+    ('numpy=1.20.1=py39_0', [('1.20.1', 'py39_0')]),
+    ('numpy==1.20.1', [('1.20.1', 'py39_0'), ('1.20.1', 'py39_2')]),
+    ('numpy >=1.20|<1.19', [('1.10.4', 'py27_0'), ('1.20', 'py38_0'), ('1.20.1', 'py39_0'),
+                            ('1.20.1', 'py39_2'), ('1.201', 'py39_0'), ('2.0.0', 'py311_0')]),
+    ("conda-forge::numpy[version='>=1.20', build=py39*, build_number=2]", [('1.20.1', 'py39_2')]),
+    ('numpy ~=1.20.0', [('1.20', 'py38_0'), ('1.20.1', 'py39_0'), ('1.20.1', 'py39_2')]),
+])
+def test_spec_forms(spec, expected):
+    result = found(spec)
+    if isinstance(expected, int):
+        assert len(result) == expected
+    else:
+        assert result == expected
+
+
+def test_newest_first():
+    result = make_index().search('numpy')
+    assert [(p.version, p.build_number) for p in result[:3]] == [('2.0.0', 0), ('1.201', 0), ('1.20.1', 2)]
+
+
+def test_exact_build():
+    spec = parse_spec('*[build=py39_0]')
+    assert spec.exact_build
+    assert not parse_spec('numpy 1.20 py39*').exact_build
+    index = make_index()
+    # Answered from the build index
+    index.by_name = {}
+    assert sorted(p.name for p in index.search(spec)) == ['numpy', 'numpy', 'numpy', 'scipy']
+
+
+@pytest.mark.parametrize('spec', ['numpy >=', 'numpy >>1', 'numpy ==', 'numpy >=1.20,', 'numpy <=.'])
+def test_invalid_spec(spec):
+    with pytest.raises(InvalidSpec):
+        parse_spec(spec)
+
+
+def test_version_order():
+    assert version_order('1.0') == version_order('1.0.0')
+    assert version_order('1.1dev') < version_order('1.1a') < version_order('1.1') < version_order('1.1post')
+    assert version_order('1!0.1') > version_order('2.0')
+    assert compile_version('*')('1.0')
+
+
+def test_record_without_build():
+    index = SearchIndex([RepoPackage('a-1.0.tar.bz2', {'name': 'a', 'version': '1.0', 'sha256': 'x'})])
+    assert index.search('a * py39_0') == []
+    assert index.search('a 1.0 py*') == []
+    assert [p.filename for p in index.search('a 1.0')] == ['a-1.0.tar.bz2']
@@ -0,0 +1,89 @@
+import os
+import json
+
+from conda_tools.environment import snapshot
+from conda_tools.environment.environment import Environment
+from conda_tools.environment.snapshot import load_records, snapshot_path
+
+
+def write_record(prefix, name, version='1.0'):
+    meta = os.path.join(str(prefix), 'conda-meta')
+    os.makedirs(meta, exist_ok=True)
+    path = os.path.join(meta, '{}-{}-0.json'.format(name, version))
+    with open(path, 'w') as f:
+        json.dump({'name': name, 'version': version, 'build': '0'}, f)
+    return path
+
+
+def count_parses(monkeypatch):
+    parsed = []
+    load = json.load
+
+    def counting(f):
+        parsed.append(os.path.basename(f.name))
+        return load(f)
+
+    monkeypatch.setattr(snapshot.json, 'load', counting)
+    return parsed
+
+
+def test_load_records(tmp_path, monkeypatch):
+    prefix, snapshots = tmp_path / 'env', str(tmp_path / 'snapshots')
+    write_record(prefix, 'a')
+    b = write_record(prefix, 'b')
+    parsed = count_parses(monkeypatch)
+
+    records = load_records(prefix, snapshots)
+    assert sorted(records) == ['a-1.0-0.json', 'b-1.0-0.json']
+    assert records['a-1.0-0.json']['name'] == 'a'
+    assert os.path.isfile(snapshot_path(prefix, snapshots))
+    assert sorted(parsed) == ['a-1.0-0.json', 'b-1.0-0.json']
+
+    # Unchanged files come from the snapshot
+    del parsed[:]
+    assert load_records(prefix, snapshots) == records
+    assert parsed == []
+
+    # Only changed files are parsed again
+    with open(b, 'w') as f:
+        json.dump({'name': 'b', 'version': '1.0', 'build': '0', 'extra': 1}, f)
+    write_record(prefix, 'c')
+    records = load_records(prefix, snapshots)
+    assert sorted(parsed) == ['b-1.0-0.json', 'c-1.0-0.json']
+    assert records['b-1.0-0.json']['extra'] == 1
+
+    # Removed files are dropped from the snapshot
+    del parsed[:]
+    os.remove(b)
+    assert sorted(load_records(prefix, snapshots)) == ['a-1.0-0.json', 'c-1.0-0.json']
+    assert sorted(snapshot._read_snapshot(snapshot_path(prefix, snapshots))) == ['a-1.0-0.json', 'c-1.0-0.json']
+    assert parsed == []
+
+
+def test_invalid_snapshot(tmp_path, monkeypatch):
+    prefix, snapshots = tmp_path / 'env', str(tmp_path / 'snapshots')
+    write_record(prefix, 'a')
+    path = snapshot_path(prefix, snapshots)
+    os.makedirs(snapshots)
+    with open(path, 'wb') as f:
+        f.write(b'not a snapshot')
+    assert sorted(load_records(prefix, snapshots)) == ['a-1.0-0.json']
+
+    # A snapshot written by another version is ignored
+    monkeypatch.setattr(snapshot, '_HEADER', (snapshot.SNAPSHOT_VERSION + 1, (0, 0)))
+    parsed = count_parses(monkeypatch)
+    assert sorted(load_records(prefix, snapshots)) == ['a-1.0-0.json']
+    assert parsed == ['a-1.0-0.json']
+
+
+def test_environment_snapshot(tmp_path):
+    prefix, snapshots = tmp_path / 'env', str(tmp_path / 'snapshots')
+    write_record(prefix, 'a')
+    env = Environment(str(prefix), snapshot=snapshots)
+    assert env.package_specs == ('a-1.0-0',)
+    assert os.path.isfile(snapshot_path(prefix, snapshots))
+
+    write_record(prefix, 'a', version='2.0')
+    os.remove(os.path.join(str(prefix), 'conda-meta', 'a-1.0-0.json'))
+    env.invalidate()
+    assert env.package_specs == ('a-2.0-0',)
@@ -0,0 +1,50 @@
+from conda_tools.repository.repository import RepoPackage
+from conda_tools.repository.table import PackageTable
+
+RECORDS = {
+    'a-1.0-0.tar.bz2': {'name': 'a', 'version': '1.0', 'build': '0', 'build_number': 0, 'depends': ['b']},
+    'a-2.0-0.tar.bz2': {'name': 'a', 'version': '2.0', 'build': '0', 'build_number': 0, 'depends': []},
+    'b-1.0-1.tar.bz2': {'name': 'b', 'version': '1.0', 'build': '1', 'build_number': 1},
+    'unnamed.tar.bz2': {'version': '1.0'},
+}
+
+
+def test_where():
+    table = PackageTable.from_packages(RECORDS)
+    assert list(table.where(name='a')) == [0, 1]
+    assert list(table.where(name='a', version='2.0')) == [1]
+    assert list(table.where(version='1.0', build_number=None)) == [3]
+    assert list(table.where(depends=['b'])) == [0]
+    assert list(table.where(name='c')) == []
+    assert list(table.where()) == [0, 1, 2, 3]
+
+
+def test_where_none():
+    table = PackageTable.from_packages(RECORDS)
+    # None matches missing values, as for the other fields
+    assert list(table.where(name=None)) == [3]
+    assert list(table.where(build=None)) == [3]
+
+
+def test_where_returns_copy():
+    table = PackageTable.from_packages(RECORDS)
+    rows = table.where(name='a')
+    rows.append(2)
+    assert list(table.where(name='a')) == [0, 1]
+    assert list(table.name_index['a']) == [0, 1]
+
+
+def test_round_trip():
+    table = PackageTable.from_packages(RECORDS)
+    packages = [RepoPackage(f, r) for f, r in RECORDS.items()]
+    for p, q in zip(table, packages):
+        assert all(getattr(p, f) == getattr(q, f) for f in PackageTable.FIELDS)
+    assert table.filter('version', lambda v: v.startswith('1')).tolist() == [0, 2, 3]
+
+
+def test_where_wrong_type():
+    table = PackageTable.from_packages(RECORDS)
+    assert list(table.where(build_number='1')) == []
+    assert list(table.where(build_number=1.0)) == [2]
+    assert list(table.where(version=1.0)) == []
+    assert list(table.where(size='x')) == []
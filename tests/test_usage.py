@@ -0,0 +1,75 @@
+import os
+
+from conda_tools.usage import DiskUsage, Usage
+from conda_tools.utils import InodeIndex, index_inodes, _disk_bytes
+
+
+def size(path):
+    return _disk_bytes(os.lstat(path))
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+    return path
+
+
+def test_disk_usage(tmp_path, make_package, link_package):
+    base = str(tmp_path / 'base')
+    cache = os.path.join(base, 'pkgs')
+    child = os.path.join(base, 'envs', 'child')
+    a = make_package(cache, 'a', files=['lib/a.txt'])
+    b = make_package(cache, 'b', files=['lib/b.txt'])
+    make_package(cache, 'c', files=['lib/c.txt'])
+    link_package(base, a)
+    link_package(child, a)
+    link_package(child, b)
+    # Unique to the child, and shared by both environments but not the cache
+    own = write(os.path.join(child, 'own.txt'), 'x' * 10000)
+    shared = write(os.path.join(base, 'shared.txt'), 'shared')
+    os.link(shared, os.path.join(child, 'shared.txt'))
+
+    usage = DiskUsage(cache, [base, child], workers=2)
+    usage.refresh()
+
+    def meta(prefix):
+        d = os.path.join(prefix, 'conda-meta')
+        return sum(size(os.path.join(d, f)) for f in os.listdir(d))
+
+    a_txt, b_txt = os.path.join(a, 'lib/a.txt'), os.path.join(b, 'lib/b.txt')
+    assert usage.environment(child) == Usage(size(own) + meta(child), size(a_txt) + size(b_txt), size(shared), 6)
+    assert usage.environment(base) == Usage(meta(base), size(a_txt), size(shared), 3)
+
+    # Cache files linked into environments are shared, the unused package is unique
+    unique = sum(size(os.path.join(root, f)) for root, _, files in os.walk(cache) for f in files)
+    unique -= size(a_txt) + size(b_txt)
+    cached = usage.cache_usage()
+    assert cached.unique == unique
+    assert cached.shared_across_envs == size(a_txt) + size(b_txt)
+    assert sorted(usage.report()) == sorted([os.path.realpath(base), os.path.realpath(child)])
+
+    # Every inode is counted once
+    assert usage.total() == sum(size(paths[0]) for paths in index_inodes(base).values())
+
+
+def test_inode_index_refresh(tmp_path):
+    root = str(tmp_path / 'root')
+    write(os.path.join(root, 'a', 'one.txt'), '1')
+    write(os.path.join(root, 'b', 'two.txt'), '2')
+    write(os.path.join(root, 'skip', 'three.txt'), '3')
+
+    index = InodeIndex(root, exclude=[os.path.join(root, 'skip')])
+    assert index.refresh() == 3
+    assert sorted(os.path.relpath(p[0], root) for p in index.index().values()) == ['a/one.txt', 'b/two.txt']
+    assert index.refresh() == 0
+
+    # Only the changed directory is listed again
+    write(os.path.join(root, 'a', 'four.txt'), '4')
+    assert index.refresh() == 1
+    assert len(index.inodes()) == 3
+
+    os.remove(os.path.join(root, 'b', 'two.txt'))
+    os.rmdir(os.path.join(root, 'b'))
+    assert index.refresh() == 1
+    assert sorted(os.path.relpath(p[0], root) for p in index.index().values()) == ['a/four.txt', 'a/one.txt']
@@ -0,0 +1,102 @@
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+
+import pytest
+
+from conda_tools.cache import verify
+from conda_tools.cache.verify import Mismatch, verify_package, compare_archive
+
+
+def make_verified_package(tmp_path, make_package):
+    """
+    Create a package with a paths.json describing its files, and its .tar.bz2 archive.
+    """
+    files = ['lib/a.txt', 'lib/sub/b.txt', 'bin/c']
+    path = make_package(str(tmp_path), 'p', files=files)
+    os.symlink('a.txt', os.path.join(path, 'lib', 'link'))
+    paths = []
+    for fn in files:
+        with open(os.path.join(path, fn), 'rb') as f:
+            data = f.read()
+        paths.append({'_path': fn, 'path_type': 'hardlink', 'size_in_bytes': len(data),
+                      'sha256': hashlib.sha256(data).hexdigest()})
+    paths.append({'_path': 'lib/link', 'path_type': 'softlink'})
+    with open(os.path.join(path, 'info', 'paths.json'), 'w') as f:
+        json.dump({'paths': paths, 'paths_version': 1}, f)
+
+    archive = path + '.tar.bz2'
+    with tarfile.open(archive, 'w:bz2') as tar:
+        for name in os.listdir(path):
+            tar.add(os.path.join(path, name), arcname=name)
+    return path, archive
+
+
+def reasons(result):
+    return sorted((m.path, m.reason) for m in result)
+
+
+def test_verify_package(tmp_path, make_package):
+    path, _ = make_verified_package(tmp_path, make_package)
+    assert verify_package(path) == ()
+
+    with open(os.path.join(path, 'lib', 'a.txt'), 'w') as f:
+        f.write('lib/a.tx!')
+    with open(os.path.join(path, 'bin', 'c'), 'w') as f:
+        f.write('longer than before')
+    os.remove(os.path.join(path, 'lib', 'link'))
+    os.mkdir(os.path.join(path, 'lib', 'link'))
+    shutil.rmtree(os.path.join(path, 'lib', 'sub'))
+    # A file in place of a parent directory
+    with open(os.path.join(path, 'lib', 'sub'), 'w') as f:
+        f.write('')
+
+    result = verify_package(path)
+    assert reasons(result) == [('bin/c', verify.SIZE), ('lib/a.txt', verify.HASH),
+                               ('lib/link', verify.TYPE), ('lib/sub/b.txt', verify.MISSING)]
+    assert Mismatch('bin/c', verify.SIZE, len('bin/c'), len('longer than before')) in result
+    # Without hashes, only the size of files is checked
+    assert reasons(verify_package(path, check_hashes=False)) == [
+        ('bin/c', verify.SIZE), ('lib/link', verify.TYPE), ('lib/sub/b.txt', verify.MISSING)]
+
+
+def test_verify_unreadable(tmp_path, make_package, monkeypatch):
+    path, _ = make_verified_package(tmp_path, make_package)
+    denied = os.path.join(path, 'lib', 'a.txt')
+    lstat = os.lstat
+
+    def no_access(p, *args, **kwargs):
+        if p == denied:
+            raise PermissionError(13, 'Permission denied', p)
+        return lstat(p, *args, **kwargs)
+
+    monkeypatch.setattr(verify.os, 'lstat', no_access)
+    assert verify_package(path) == (Mismatch('lib/a.txt', verify.UNREADABLE, 'hardlink', None),)
+
+
+def test_verify_without_paths(tmp_path, make_package):
+    assert verify_package(make_package(str(tmp_path), 'p')) is None
+
+
+def test_compare_archive(tmp_path, make_package):
+    path, archive = make_verified_package(tmp_path, make_package)
+    assert compare_archive(archive, path) == ()
+
+    with open(os.path.join(path, 'lib', 'a.txt'), 'w') as f:
+        f.write('lib/a.tx!')
+    with open(os.path.join(path, 'bin', 'c'), 'w') as f:
+        f.write('longer than before')
+    os.remove(os.path.join(path, 'lib', 'link'))
+    os.symlink('sub', os.path.join(path, 'lib', 'link'))
+    shutil.rmtree(os.path.join(path, 'lib', 'sub'))
+
+    result = compare_archive(archive, path, hash_alg='md5', workers=2)
+    assert reasons(result) == [('bin/c', verify.SIZE), ('lib/a.txt', verify.HASH),
+                               ('lib/link', verify.HASH), ('lib/sub', verify.MISSING),
+                               ('lib/sub/b.txt', verify.MISSING)]
+    assert Mismatch('lib/link', verify.HASH, 'a.txt', 'sub') in result
+
+    with pytest.raises(ValueError):
+        compare_archive(archive, path, hash_alg='nope')
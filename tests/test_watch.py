@@ -0,0 +1,86 @@
+import os
+import shutil
+
+import pytest
+
+from conda_tools.cache.package import Package
+from conda_tools.environment.environment import Environment
+
+watch = pytest.importorskip('conda_tools.watch')
+
+
+@pytest.fixture
+def watcher():
+    try:
+        w = watch.Watcher()
+    except OSError:
+        pytest.skip('inotify is not available')
+    yield w
+    w.close()
+
+
+def test_package_changes(watcher, tmp_path, make_package):
+    cache = str(tmp_path)
+    pkgs = [Package(make_package(cache, 'p{}'.format(i))) for i in range(3)]
+    watcher.watch_packages(pkgs)
+    assert [p.version for p in pkgs] == ['1.0'] * 3
+
+    make_package(cache, 'p1', index={'version': '2.0'})
+    watcher.poll(1)
+    assert [p.version for p in pkgs] == ['1.0', '2.0', '1.0']
+
+    shutil.rmtree(pkgs[2].path)
+    make_package(cache, 'p2', index={'version': '3.0'})
+    while watcher.poll(0.2):
+        pass
+    assert pkgs[2].version == '3.0'
+
+
+def test_overflow(watcher, tmp_path, make_package):
+    pkg = Package(make_package(str(tmp_path), 'p'))
+    watcher.watch_package(pkg)
+    assert pkg.version == '1.0'
+
+    make_package(str(tmp_path), 'p', index={'version': '2.0'})
+    # Drop the pending events, as the kernel does when its queue overflows
+    watcher._read_events()
+    watcher._dispatch(-1, watch.IN_Q_OVERFLOW, '')
+    assert pkg.version == '2.0'
+
+
+def drain(watcher):
+    while watcher.poll(0.2):
+        pass
+
+
+def test_extracted_in_steps(watcher, tmp_path, make_package):
+    cache = str(tmp_path)
+    pkg = Package(make_package(cache, 'p'))
+    watcher.watch_package(pkg)
+    assert pkg.version == '1.0'
+
+    # The package directory is created before its info/ directory
+    shutil.rmtree(pkg.path)
+    os.mkdir(pkg.path)
+    drain(watcher)
+    make_package(cache, 'p', index={'version': '2.0'})
+    drain(watcher)
+    assert pkg.version == '2.0'
+
+    # info/ of the new package is watched
+    make_package(cache, 'p', index={'version': '3.0'})
+    drain(watcher)
+    assert pkg.version == '3.0'
+
+
+def test_environment_removed(watcher, tmp_path, make_package, link_package):
+    prefix = tmp_path / 'env'
+    link_package(prefix, make_package(str(tmp_path / 'pkgs'), 'a'))
+    env = Environment(str(prefix))
+    watcher.watch_environment(env)
+    assert env.package_specs == ('a-1.0-0',)
+
+    shutil.rmtree(prefix / 'conda-meta')
+    drain(watcher)
+    # The history was never read, so it is not loaded by the watcher
+    assert not env.history._loaded